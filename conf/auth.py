@@ -1 +1,10 @@
+import os
+
 MIN_PASSWORD_LENGTH = 8
+
+# In-process cache of the auth tokens (see scolendar.tokens), the timeout is in seconds
+TOKEN_CACHE = {
+    'ENABLED': os.getenv('TOKEN_CACHE', '1') not in ['0', 'false', 'False'],
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 60,
+}
@@ -0,0 +1,46 @@
+import os
+from typing import Dict
+
+
+def get_cache_info(BASE_DIR: str) -> Dict[str, Dict[str, object]]:
+    CACHE_DIR = os.getenv('CACHE_DIR', None)
+    if os.getenv('IN_DOCKER', 0) in [1, '1'] and not CACHE_DIR:
+        CACHE_DIR = os.path.join(BASE_DIR, 'cache')
+    # The iCal fragments are dropped when their occupancy changes, and left behind when a name they show changes (see
+    # `scolendar.ical.fragments_version`). The timeout frees the ones left behind.
+    ical = {
+        'TIMEOUT': 60 * 60 * 24,
+    }
+    if CACHE_DIR:
+        ical.update({
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(CACHE_DIR, 'ical'),
+        })
+        timeline = {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(CACHE_DIR, 'timeline'),
+            'TIMEOUT': None,
+        }
+    else:
+        ical.update({
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'ical',
+            'OPTIONS': {
+                'MAX_ENTRIES': 100000,
+            },
+        })
+        timeline = {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'timeline',
+            'TIMEOUT': None,
+            'OPTIONS': {
+                'MAX_ENTRIES': 10000,
+            },
+        }
+    return {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'timeline': timeline,
+        'ical': ical,
+    }
@@ -1,35 +1,139 @@
 import json
+import os
+import signal
+import threading
+from collections import namedtuple
 from datetime import time, timedelta
 from fractions import Fraction
+from time import monotonic
+from types import MappingProxyType
+from typing import Mapping, Optional
 
+CONF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conf.json')
+# Minimum delay between two checks of the modification time of the file, in seconds
+CHECK_INTERVAL = 1.
 
-def __load() -> dict:
-    with open('conf/conf.json') as f:
-        return json.load(f)
 
+class Configuration(namedtuple('Configuration', ['timings', 'start_time', 'end_time', 'max_duration',
+                                                 'service_coefficients', 'mtime'])):
+    """
+    Immutable content of `conf.json`, with its values already converted
 
-def timings() -> dict:
-    return __load()['timings']
+    :param timings: The raw `timings` section, read-only
+    :param start_time: Opening time of the establishment
+    :param end_time: Closing time of the establishment
+    :param max_duration: Maximum duration of an occupancy
+    :param service_coefficients: The coefficient of each occupancy type, as floats, read-only
+    :param mtime: The modification time of the file when it was parsed, in nanoseconds
+    """
+    __slots__ = ()
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _parse(path: str) -> Configuration:
+    mtime = os.stat(path).st_mtime_ns
+    with open(path) as f:
+        data = json.load(f)
+    timings_data = data['timings']
+    start, end, duration = timings_data['start'], timings_data['end'], timings_data['max_class_duration']
+    return Configuration(
+        timings=_freeze(timings_data),
+        start_time=time(hour=start['hour'], minute=start['minute'], second=0),
+        end_time=time(hour=end['hour'], minute=end['minute'], second=0),
+        max_duration=timedelta(days=0, hours=duration['hour'], minutes=duration['minute']),
+        service_coefficients=MappingProxyType({
+            key: float(Fraction(value)) for key, value in data['service_coefficients'].items()
+        }),
+        mtime=mtime,
+    )
+
+
+_config: Optional[Configuration] = None
+_reload_requested = False
+_next_check = 0.
+_lock = threading.Lock()
+
+
+def get_config() -> Configuration:
+    """
+    Gets the configuration of the process, parsed once
+
+    The file is parsed again when its modification time changes (checked at most every `CHECK_INTERVAL` seconds),
+    or after a SIGHUP when the `CONF_RELOAD_ON_SIGHUP` setting is enabled (see `install_reload_signal`). The
+    configuration is replaced as a whole, so a thread holding it never sees a partially reloaded one.
+    """
+    global _next_check
+    config = _config
+    if config is not None and not _reload_requested:
+        now = monotonic()
+        if now < _next_check:
+            return config
+        _next_check = now + CHECK_INTERVAL
+        if os.stat(CONF_PATH).st_mtime_ns == config.mtime:
+            return config
+    return reload_config(config)
+
+
+def reload_config(stale: Optional[Configuration] = None) -> Configuration:
+    """
+    Parses the configuration file again
+
+    :param stale: The configuration found out of date. If another thread replaced it in the meantime, the file is not
+        parsed again.
+    """
+    global _config, _reload_requested
+    with _lock:
+        if _config is not stale and not _reload_requested:
+            return _config
+        _reload_requested = False
+        _config = _parse(CONF_PATH)
+        return _config
+
+
+def install_reload_signal():
+    """
+    Reloads the configuration when the process receives SIGHUP
+
+    Only installed when the `CONF_RELOAD_ON_SIGHUP` setting is enabled, as process managers such as gunicorn or uWSGI
+    use SIGHUP themselves. The handler only flags the configuration, which is parsed again by the next `get_config`.
+    A handler installed before is still called. Nothing is done outside of the main thread, or where there is no
+    SIGHUP.
+    """
+    if not hasattr(signal, 'SIGHUP') or threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGHUP)
+
+    def handler(signum, frame):
+        global _reload_requested
+        _reload_requested = True
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGHUP, handler)
+
+
+def timings() -> Mapping:
+    return get_config().timings
 
 
 def start_time() -> time:
-    data = timings()['start']
-    return time(hour=data['hour'], minute=data['minute'], second=0)
+    return get_config().start_time
 
 
 def end_time() -> time:
-    data = timings()['end']
-    return time(hour=data['hour'], minute=data['minute'], second=0)
+    return get_config().end_time
 
 
 def max_duration() -> timedelta:
-    data = timings()['max_class_duration']
-    return timedelta(days=0, hours=data['hour'], minutes=data['minute'])
+    return get_config().max_duration
 
 
-def get_service_coefficients() -> dict:
-    base_coefficients = __load()['service_coefficients']
-    coefficients = {}
-    for key in base_coefficients.keys():
-        coefficients[key] = float(Fraction(base_coefficients[key]))
-    return coefficients
+def get_service_coefficients() -> Mapping[str, float]:
+    return get_config().service_coefficients
@@ -16,8 +16,10 @@ from django.templatetags.static import static
 from django.urls import reverse_lazy
 from django.utils.functional import lazy
 
+from conf import auth
 from conf.auth import MIN_PASSWORD_LENGTH
 from conf.bdd import get_db_info
+from conf.cache import get_cache_info
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -55,6 +57,7 @@ INSTALLED_APPS = [
     'oauth2_provider',
     'corsheaders',
     'drf_yasg',
+    'recurrence',
 
     'scolendar.apps.ScolendarConfig',
 ]
@@ -69,6 +72,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'drf_yasg.middleware.SwaggerExceptionMiddleware',
+    'scolendar.middleware.GroupReorganizationMiddleware',
 ]
 
 ROOT_URLCONF = 'enseign.urls'
@@ -98,6 +102,22 @@ WSGI_APPLICATION = 'enseign.wsgi.application'
 
 DATABASES = get_db_info(BASE_DIR)
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = get_cache_info(BASE_DIR)
+
+# In process cache of the auth tokens, see scolendar.tokens
+
+TOKEN_CACHE = auth.TOKEN_CACHE
+
+# Application configuration (conf/conf.json)
+# The file is parsed again whenever it changes. Reloading it on SIGHUP replaces the handler of the process, so it is
+# only done for deployments which leave that signal to the application.
+
+CONF_RELOAD_ON_SIGHUP = False
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
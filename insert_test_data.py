@@ -1,17 +1,16 @@
 import json
 from datetime import datetime
+from typing import Dict, List, Tuple
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
-from django.db.models.signals import post_save
 from django.db.utils import IntegrityError
 from pytz import timezone
 
-from scolendar.groups import attribute_student_groups
-from scolendar.models import Student, Class, Teacher, Classroom, Subject, Occupancy, StudentSubject
-from scolendar.signals import attribute_group_to_student, student_class_signal, \
-    student_group_reorganization_on_student_subject
+from scolendar.accounts import prepare_accounts
+from scolendar.groups import deferred_group_reorganization
+from scolendar.models import Student, Class, Teacher, Classroom, Subject, Occupancy
 import time
 
 User = get_user_model()
@@ -53,42 +52,48 @@ def create_class() -> Class:
 def create_students(_class: Class):
     with open('sample_data/students.json') as student_file:
         student_json = json.load(student_file)
-        subjects = _class.subject_set.all()
+        students = []
         for student_entry in student_json:
             f_name = student_entry['first_name']
             l_name = student_entry['last_name']
-            print(f'Creating Student: {f_name} {l_name}')
+            students.append(Student(
+                username=f'{f_name.lower().replace(" ", "")}.{l_name.lower().replace(" ", "")}',
+                _class=_class,
+                first_name=f_name,
+                last_name=l_name,
+            ))
+        print(f'Hashing {len(students)} passwords')
+        prepare_accounts(students, ['passwdtest'] * len(students))
+        for student in students:
+            print(f'Creating Student: {student.first_name} {student.last_name}')
             try:
-                student = Student(
-                    username=f'{f_name.lower().replace(" ", "")}.{l_name.lower().replace(" ", "")}',
-                    _class=_class,
-                    first_name=f_name,
-                    last_name=l_name,
-                )
-                student.set_password('passwdtest')
+                # The student is registered to the subjects of the class by the post_save signal
                 student.save()
-                for subject in subjects:
-                    student_subject = StudentSubject(subject=subject, student=student)
-                    student_subject.save()
             except IntegrityError:
                 pass
 
 
-def create_teachers(f_name: str, l_name: str) -> Teacher:
-    print(f'Creating Teacher: {f_name} {l_name}')
-    try:
-        teacher = Teacher(
-            username=f'{f_name.lower().replace(" ", "")}.{l_name.lower().replace(" ", "")}',
-            email=f'{f_name.lower().replace(" ", "-")}.{l_name.lower().replace(" ", "-")}@univ-amu.fr',
-            phone_number='06 61 66 16 61',
-            first_name=f_name,
-            last_name=l_name,
-        )
-        teacher.set_password('passwdtest')
+def create_teachers(names: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Teacher]:
+    teachers = {}
+    new_teachers = []
+    for f_name, l_name in dict.fromkeys(names):
+        try:
+            teachers[f_name, l_name] = Teacher.objects.get(first_name=f_name, last_name=l_name)
+        except Teacher.DoesNotExist:
+            teachers[f_name, l_name] = Teacher(
+                username=f'{f_name.lower().replace(" ", "")}.{l_name.lower().replace(" ", "")}',
+                email=f'{f_name.lower().replace(" ", "-")}.{l_name.lower().replace(" ", "-")}@univ-amu.fr',
+                phone_number='06 61 66 16 61',
+                first_name=f_name,
+                last_name=l_name,
+            )
+            new_teachers.append(teachers[f_name, l_name])
+    print(f'Hashing {len(new_teachers)} passwords')
+    prepare_accounts(new_teachers, ['passwdtest'] * len(new_teachers))
+    for teacher in new_teachers:
+        print(f'Creating Teacher: {teacher.first_name} {teacher.last_name}')
         teacher.save()
-    except IntegrityError:
-        teacher = Teacher.objects.get(first_name=f_name, last_name=l_name)
-    return teacher
+    return teachers
 
 
 def create_classroom(name: str) -> Classroom:
@@ -135,12 +140,12 @@ def create_occupancy(start: int, end: int, name: str, description: str, teacher:
 
 def create_teachers_classrooms_subjects_occupancies():
     with open('sample_data/occupancies.json') as f:
-        data = json.load(f)
-        for entry in data:
-            if entry['professor'] is None:
-                continue
-            professor = entry['professor'].split(' ', 1)
-            teacher_obj = create_teachers(f_name=professor[1], l_name=professor[0])
+        data = [entry for entry in json.load(f) if entry['professor'] is not None]
+        # The professors are written as "LAST_NAME First name"
+        professors = [tuple(reversed(entry['professor'].split(' ', 1))) for entry in data]
+        teachers = create_teachers(professors)
+        for entry, professor in zip(data, professors):
+            teacher_obj = teachers[professor]
             classroom_obj = create_classroom(entry['location'])
             subject_obj = create_subject(entry['subject'], _class=_class)
             create_occupancy(
@@ -155,23 +160,8 @@ def create_teachers_classrooms_subjects_occupancies():
             )
 
 
-def disconnect_triggers():
-    post_save.disconnect(receiver=attribute_group_to_student, sender=Student)
-    post_save.disconnect(receiver=student_class_signal, sender=Student)
-    post_save.disconnect(receiver=student_group_reorganization_on_student_subject, sender=StudentSubject)
-
-
-def attribute_subject_groups():
-    for s in Subject.objects.all():
-        print(f'Attributing groups for {s.name}')
-        attribute_student_groups(s)
-
-
 start_time = time.time()
 print()
-print('Disconnecting signals')
-disconnect_triggers()
-print()
 print('Creating super')
 create_super()
 if settings.DEBUG:
@@ -186,9 +176,8 @@ if settings.DEBUG:
     create_teachers_classrooms_subjects_occupancies()
     print()
     print('Creating students')
-    create_students(_class)
-    print()
-    print('Attributing groups to students')
-    attribute_subject_groups()
+    # The groups of each subject are attributed once, when the block exits
+    with deferred_group_reorganization():
+        create_students(_class)
 print("--- %s seconds ---" % (time.time() - start_time))
 exit(0)
@@ -0,0 +1,152 @@
+import os
+import random
+import string
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Sequence
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+
+from conf.auth import MIN_PASSWORD_LENGTH
+from scolendar.search import SearchableModel, index_objects
+
+User = get_user_model()
+
+# Up to this many passwords are hashed in place, starting the workers would take longer
+INLINE_HASHES = 2
+
+# The hashing pools of the process, by size, started on first use and reused by the next calls
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def generate_password() -> str:
+    return ''.join(
+        random.SystemRandom().choice(string.ascii_uppercase + string.ascii_lowercase + string.digits) for _ in
+        range(MIN_PASSWORD_LENGTH))
+
+
+def hashing_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def _init_worker(settings_module: str):
+    # Forked workers inherit the configured settings, spawned ones have to load them
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            settings_module = os.environ.get('DJANGO_SETTINGS_MODULE', 'enseign.settings')
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                         initargs=(settings_module,))
+        return pool
+
+
+def _discard_pool(workers: int, pool: ProcessPoolExecutor):
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    pool.shutdown(wait=False)
+
+
+def hash_passwords(passwords: Sequence[str], workers: Optional[int] = None) -> List[str]:
+    """
+    Hashes passwords with the configured hasher, in a pool of processes
+
+    The default PBKDF2 hasher is designed to be slow, so creating many accounts is CPU bound. Each process hashes a
+    share of the passwords, which scales with the number of cores. The pool is started by the first call needing it
+    and kept for the next ones, so a request only pays for the start of the workers once per process.
+
+    :param passwords: The plaintext passwords
+    :param workers: Size of the pool. Defaults to the number of cores. Up to `INLINE_HASHES` passwords are always
+        hashed in place.
+    :return: The encoded passwords, in the same order
+    """
+    workers = workers or hashing_workers()
+    if workers <= 1 or len(passwords) <= INLINE_HASHES:
+        return [make_password(password) for password in passwords]
+    pool = _get_pool(workers)
+    chunksize = max(1, len(passwords) // (workers * 4))
+    try:
+        return list(pool.map(make_password, passwords, chunksize=chunksize))
+    except BrokenProcessPool:
+        # A worker died, the next call starts a new pool
+        _discard_pool(workers, pool)
+        raise
+
+
+def prepare_accounts(users: Sequence[User], passwords: Sequence[Optional[str]] = None,
+                     workers: Optional[int] = None) -> List[str]:
+    """
+    Sets the passwords of unsaved accounts, generating the missing ones
+
+    The passwords are hashed in parallel (see `hash_passwords`). The plaintext passwords are returned so that they can
+    be handed out once, as only their hash is stored.
+
+    :param users: The unsaved students, teachers or users
+    :param passwords: The chosen passwords, None (or a None item) to generate them
+    :param workers: Size of the hashing pool
+    :return: The plaintext passwords, in the same order as the users
+    """
+    passwords = [password or generate_password() for password in (passwords or [None] * len(users))]
+    for user, encoded in zip(users, hash_passwords(passwords, workers)):
+        user.password = encoded
+    return passwords
+
+
+def credentials(users: Sequence[User], passwords: Sequence[str]) -> List[dict]:
+    """
+    Lists the initial credentials of saved accounts, for distribution
+    """
+    return [
+        {'id': user.id, 'username': user.username, 'password': password}
+        for user, password in zip(users, passwords)
+    ]
+
+
+def bulk_insert_users(users: List[User]) -> List[User]:
+    """
+    Inserts accounts of a model inheriting from the user model (students, teachers) with one query per table
+
+    `bulk_create` does not handle multi-table inheritance, so the user rows are created with `bulk_create`, and the
+    child rows are inserted on their own, the same way `Model.save` inserts the child table. The search column of the
+    accounts is filled beforehand, as `save` is not called, and the in-process search index updated once the
+    transaction commits.
+
+    :param users: The unsaved accounts, all of the same model
+    :return: The saved accounts, with their id set
+    """
+    if not users:
+        return users
+    model = type(users[0])
+    searchable = issubclass(model, SearchableModel)
+    if searchable:
+        for user in users:
+            user.refresh_search_text()
+    parents = [User(**{f.attname: getattr(u, f.attname) for f in User._meta.concrete_fields}) for u in users]
+    User.objects.bulk_create(parents)
+    if not connection.features.can_return_rows_from_bulk_insert:
+        # The ids are not returned by every database, but the usernames are unique
+        ids = dict(User.objects.filter(username__in=[u.username for u in parents]).values_list('username', 'id'))
+        for parent in parents:
+            parent.id = ids[parent.username]
+    parent_link = model._meta.get_ancestor_link(User)
+    for user, parent in zip(users, parents):
+        setattr(user, parent_link.attname, parent.id)
+        user.id = parent.id
+    fields = list(model._meta.local_concrete_fields)
+    batch_size = max(connection.ops.bulk_batch_size(fields, users), 1)
+    for i in range(0, len(users), batch_size):
+        # Private API of Django 3.0 (QuerySet._insert, as used by Model._do_insert), checked by BulkInsertUsersTests
+        model.objects._insert(users[i:i + batch_size], fields=fields, raw=True)
+    if searchable:
+        index_objects(users)
+    return users
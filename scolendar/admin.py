@@ -14,7 +14,8 @@ from django.utils.html import escape
 from django.utils.translation import gettext as _
 
 from .forms import UserChangeForm, UserCreationForm, AdminPasswordChangeForm
-from .models import Class, Subject, Teacher, Student, Classroom, TeacherSubject, Occupancy, StudentSubject, ICalToken
+from .models import Class, Subject, Teacher, Student, Classroom, TeacherSubject, Occupancy, StudentSubject, ICalToken, \
+    OccupancySeries
 
 
 @admin.register(Class)
@@ -278,6 +279,7 @@ class OccupancyAdmin(admin.ModelAdmin):
         (None, {'fields': ['subject', 'teacher', 'occupancy_type', 'name', 'group_number', ], }),
         (_('Localisation'), {'fields': ['classroom', ], }),
         (_('Date'), {'fields': ['start_datetime', 'duration', ], }),
+        (_('Série'), {'fields': ['series', 'series_start', ], }),
         (_('Supprimé'), {'fields': ['deleted', ]})
     ]
 
@@ -286,6 +288,32 @@ class OccupancyAdmin(admin.ModelAdmin):
     ordering = ['start_datetime', ]
 
 
+@admin.register(OccupancySeries)
+class OccupancySeriesAdmin(admin.ModelAdmin):
+    list_display = [
+        'start_datetime',
+        'duration',
+        'classroom',
+        'group_number',
+        'subject',
+        'teacher',
+        'occupancy_type',
+        'name',
+        'deleted',
+    ]
+
+    fieldsets = [
+        (None, {'fields': ['subject', 'teacher', 'occupancy_type', 'name', 'group_number', ], }),
+        (_('Localisation'), {'fields': ['classroom', ], }),
+        (_('Date'), {'fields': ['start_datetime', 'duration', 'recurrences', ], }),
+        (_('Supprimé'), {'fields': ['deleted', ]})
+    ]
+
+    search_fields = ('name',)
+
+    ordering = ['start_datetime', ]
+
+
 @admin.register(ICalToken)
 class ICalTokenAdmin(admin.ModelAdmin):
     list_display = [
@@ -1,4 +1,6 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_migrate
 
 
 class ScolendarConfig(AppConfig):
@@ -6,3 +8,10 @@ class ScolendarConfig(AppConfig):
 
     def ready(self):
         import scolendar.signals
+        if getattr(settings, 'CONF_RELOAD_ON_SIGHUP', False):
+            from conf.conf import install_reload_signal
+            install_reload_signal()
+        from scolendar.ledger import fill_ledger
+        from scolendar.search import install_search_indexes
+        post_migrate.connect(install_search_indexes, sender=self)
+        post_migrate.connect(fill_ledger, sender=self)
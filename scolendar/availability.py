@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+from functools import reduce
+from heapq import merge
+from operator import or_
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.timezone import localtime
+from pytz import timezone
+
+from conf.conf import end_time, max_duration, start_time
+from scolendar.models import Occupancy
+from scolendar.series import expand_series
+
+# Longest time window searched at once
+MAX_WINDOW = timedelta(days=366)
+
+Interval = Tuple[datetime, datetime]
+
+
+def busy_condition(teacher_ids: Iterable[int] = (), class_ids: Iterable[int] = (),
+                   groups: Iterable[Tuple[int, int, Optional[int]]] = (), classroom_ids: Iterable[int] = ()) -> Q:
+    """
+    Builds the condition selecting the occupancies (or series) which keep one of several resources busy
+
+    The resources are held the same way as in `Occupancy.clean`: a class is busy during the sessions of all its
+    groups, and a group during the sessions of the whole class and of the group itself.
+
+    :param teacher_ids: The teachers
+    :param class_ids: The classes, as a whole
+    :param groups: The groups, as (class id, subject id, group number) triples. A None group number stands for the
+        whole class of the subject.
+    :param classroom_ids: The classrooms
+    """
+    conditions = []
+    if teacher_ids:
+        conditions.append(Q(teacher_id__in=list(teacher_ids)))
+    if classroom_ids:
+        conditions.append(Q(classroom_id__in=list(classroom_ids)))
+    class_ids = set(class_ids)
+    for class_id, subject_id, group_number in groups:
+        if group_number is None:
+            class_ids.add(class_id)
+        else:
+            conditions.append(Q(subject___class_id=class_id, group_number__isnull=True) |
+                              Q(subject_id=subject_id, group_number=group_number))
+    if class_ids:
+        conditions.append(Q(subject___class_id__in=sorted(class_ids)))
+    return reduce(or_, conditions)
+
+
+def closed_hours(start: datetime, end: datetime) -> Iterator[Interval]:
+    """
+    Lists the nights (from closing to opening time, in the application timezone) overlapping a time window, sorted
+    """
+    tz = timezone(settings.TIME_ZONE)
+    opening, closing = start_time(), end_time()
+    day = localtime(start, tz).date() - timedelta(days=1)
+    while True:
+        night_start = tz.localize(datetime.combine(day, closing))
+        if night_start >= end:
+            return
+        yield night_start, tz.localize(datetime.combine(day + timedelta(days=1), opening))
+        day += timedelta(days=1)
+
+
+def busy_intervals(condition: Q, start: datetime, end: datetime) -> Iterator[Interval]:
+    """
+    Lists the intervals during which a set of resources is busy or the establishment is closed, sorted by start
+
+    The occupancies are fetched with a single query, and merged with the occurrences of the series and the closed
+    hours, which are already sorted.
+    """
+    occupancies = Occupancy.objects.filter(
+        condition,
+        deleted=False,
+        # An occupancy can not last more than the max duration, see Occupancy.clean
+        start_datetime__gt=start - max_duration(),
+        start_datetime__lt=end,
+        end_datetime__gt=start,
+    ).order_by('start_datetime').values_list('start_datetime', 'end_datetime')
+    occurrences = [(o.start_datetime, o.end_datetime) for o in expand_series(start, end, condition)]
+    return merge(occupancies.iterator(), occurrences, closed_hours(start, end), key=lambda interval: interval[0])
+
+
+def free_slots(condition: Q, start: datetime, end: datetime, duration: timedelta) -> List[Interval]:
+    """
+    Finds the common free slots of several resources, during the opening hours
+
+    The busy intervals are swept once, in order: a slot is the gap between the end of all the intervals seen so far and
+    the start of the next one.
+
+    :param condition: The occupancies keeping the resources busy, see `busy_condition`
+    :param start: Start of the time window
+    :param end: End of the time window
+    :param duration: Minimum duration of a slot
+    :return: The free slots, sorted
+    """
+    slots = []
+    free_from = start
+    for busy_start, busy_end in busy_intervals(condition, start, end):
+        if busy_start >= end:
+            break
+        if busy_start - free_from >= duration:
+            slots.append((free_from, busy_start))
+        free_from = max(free_from, busy_end)
+    if end - free_from >= duration:
+        slots.append((free_from, end))
+    return slots
@@ -0,0 +1,58 @@
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, IntegerRangeField, RangeBoundary, RangeOperators
+from django.db.models import Func, Q
+
+
+class TsTzRange(Func):
+    function = 'TSTZRANGE'
+    output_field = DateTimeRangeField()
+
+
+class Int4Range(Func):
+    function = 'INT4RANGE'
+    output_field = IntegerRangeField()
+
+
+class OverlapExclusionConstraint(ExclusionConstraint):
+    """
+    Prevents two non deleted occupancies of the same resource from overlapping in time
+
+    The resource id is compared as a single value integer range, which lets PostgreSQL use its built-in GiST operator
+    classes without requiring the `btree_gist` extension.
+
+    The constraint is only created on PostgreSQL, as other databases do not support exclusion constraints. On those, the
+    overlap checks done in `Occupancy.clean` are the only protection.
+    """
+
+    def __init__(self, *, name, field):
+        self.field = field
+        super().__init__(
+            name=name,
+            expressions=[
+                (Int4Range(field, field, RangeBoundary(inclusive_upper=True)), RangeOperators.OVERLAPS),
+                (TsTzRange('start_datetime', 'end_datetime', RangeBoundary()), RangeOperators.OVERLAPS),
+            ],
+            condition=Q(deleted=False),
+        )
+
+    def constraint_sql(self, model, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return None
+        return super().constraint_sql(model, schema_editor)
+
+    def create_sql(self, model, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return None
+        return super().create_sql(model, schema_editor)
+
+    def remove_sql(self, model, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return None
+        return super().remove_sql(model, schema_editor)
+
+    def deconstruct(self):
+        path, args, kwargs = super().deconstruct()
+        return path, args, {'name': self.name, 'field': self.field}
+
+    def __eq__(self, other):
+        return isinstance(other, OverlapExclusionConstraint) and self.name == other.name and self.field == other.field
@@ -0,0 +1,27 @@
+from django.db import transaction
+from django.db.models import QuerySet
+
+from scolendar.groups import deferred_group_reorganization
+
+
+def delete_all_or_none(queryset: QuerySet, ids: list) -> bool:
+    """
+    Deletes the rows of a list endpoint at once, or none of them
+
+    The ids are checked with a single `IN` query, then the rows are deleted with one `QuerySet.delete` in a
+    transaction. The groups of the subjects which lose students are distributed once per subject, after the commit.
+
+    :param queryset: The rows which can be deleted
+    :param ids: The ids of the rows to delete, as posted
+    :return: False, with nothing deleted, if an id does not match any row
+    :raise ValueError: if the ids are not a list of integers, with nothing deleted
+    """
+    if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        raise ValueError('Expected a list of ids')
+    ids = set(ids)
+    with deferred_group_reorganization(), transaction.atomic():
+        rows = queryset.filter(pk__in=ids)
+        if len(ids) != len(rows.select_for_update().values_list('pk', flat=True)):
+            return False
+        rows.delete()
+    return True
@@ -20,6 +20,8 @@ error_codes = [
     "LastGroupInSubject",
     "ClassroomAlreadyOccupied",
     "ClassOrGroupAlreadyOccupied",
+    "TeacherAlreadyOccupied",
+    "InvalidTimeSlot",
     "InvalidOccupancyType",
     "EndBeforeStart",
     "TeacherDoesNotTeach",
@@ -1,30 +1,69 @@
+import threading
+from contextlib import contextmanager
+from typing import Iterable
+
+from django.db import transaction
+
+from scolendar.membership import refresh_memberships
 from scolendar.models import StudentSubject, Subject
+from scolendar.timeline_cache import invalidate_scopes
+
+_reorganization = threading.local()
 
 
-def attribute_student_groups(subject: Subject) -> None:
+def _reorganization_state():
+    if not hasattr(_reorganization, 'depth'):
+        _reorganization.depth = 0
+        _reorganization.deferred = set()
+        _reorganization.pending = set()
+    return _reorganization
+
+
+def attribute_student_groups(subject: Subject) -> int:
     """
     Automatically distribute students in groups
 
     The algorithm is quite basic:
-    - We get all the students registered for the subject
+    - We get all the students registered for the subject, in alphabetical order, with a single query
     - Calculate the group sizes
     - Distribute the students in alphabetical order in the appropriate number of groups
 
+    Only the rows whose group changes are written back, with a single `bulk_update` which does not run
+    `StudentSubject.clean` nor send any signal. The membership index and the timelines of the students who changed
+    group are refreshed after the commit.
+
     :param subject: The subject where we need to distribute students in groups
-    :return: None
+    :return: The number of students who changed group
     """
-    student_subjects = StudentSubject.objects.filter(subject=subject)
+    student_subjects = list(
+        StudentSubject.objects.filter(subject_id=subject.id)
+        .order_by('student__last_name', 'student__first_name', 'student_id')
+        .only('id', 'student_id', 'group_number')
+    )
     nb_students_in_subject = len(student_subjects)
     computed_group_size = nb_students_in_subject // subject.group_count + 1
     counter = 0
     current_group = 1
+    moved = []
     for ss in student_subjects:
         if counter > computed_group_size:
             counter = 0
             current_group += 1
-        ss.group_number = current_group
+        if ss.group_number != current_group:
+            ss.group_number = current_group
+            moved.append(ss)
         counter += 1
-        ss.save()
+    if moved:
+        with transaction.atomic():
+            StudentSubject.objects.bulk_update(moved, ['group_number'], batch_size=500)
+        student_ids = [ss.student_id for ss in moved]
+
+        def refresh():
+            refresh_memberships(student_ids)
+            invalidate_scopes(('student', student_id) for student_id in student_ids)
+
+        transaction.on_commit(refresh)
+    return len(moved)
 
 
 def group_size(group_number: int) -> int:
@@ -35,3 +74,56 @@ def group_size(group_number: int) -> int:
     :return: The group size
     """
     return len(StudentSubject.objects.filter(group_number=group_number))
+
+
+def reorganize_pending_groups(subject_ids: Iterable[int]) -> None:
+    """
+    Distributes the students in groups once for each of several subjects, unless it was already done since they were
+    scheduled
+
+    :param subject_ids: The ids of the subjects scheduled along with this callback
+    """
+    state = _reorganization_state()
+    subject_ids = state.pending.intersection(subject_ids)
+    state.pending -= subject_ids
+    for subject in Subject.objects.filter(id__in=subject_ids):
+        attribute_student_groups(subject)
+
+
+def schedule_group_reorganization(subject_ids: Iterable[int]) -> None:
+    """
+    Marks subjects whose groups have to be distributed again
+
+    Each subject is reorganized once, when the current transaction commits (right away in autocommit mode). Inside
+    `deferred_group_reorganization`, the subjects are only scheduled when the outermost block exits.
+
+    :param subject_ids: The ids of the subjects whose students changed
+    """
+    state = _reorganization_state()
+    if state.depth:
+        state.deferred.update(subject_ids)
+        return
+    subject_ids = set(subject_ids)
+    if subject_ids:
+        # A subject is reorganized by the first callback scheduling it to run, the next ones skip it. Each callback only
+        # handles its own subjects: the callbacks of a rolled back transaction are dropped, and so must be its subjects.
+        state.pending.update(subject_ids)
+        transaction.on_commit(lambda: reorganize_pending_groups(subject_ids))
+
+
+@contextmanager
+def deferred_group_reorganization():
+    """
+    Coalesces the group reorganizations requested inside the block, for requests and scripts saving many students
+
+    Every subject marked inside the block is reorganized once, after the block exits and its transaction commits.
+    """
+    state = _reorganization_state()
+    state.depth += 1
+    try:
+        yield
+    finally:
+        state.depth -= 1
+        if not state.depth:
+            subject_ids, state.deferred = state.deferred, set()
+            schedule_group_reorganization(subject_ids)
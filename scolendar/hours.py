@@ -0,0 +1,112 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from django.db.models import Q, Sum
+
+from scolendar.models import Occupancy, StudentSubject, occupancy_list
+from scolendar.series import expand_series
+from scolendar.services import occupancy_types
+
+# Hours of one occupancy type (by its `occupancy_types` name) per subject, then per group (None for the whole class)
+SubjectHours = Dict[int, Dict[Optional[int], Dict[str, float]]]
+
+
+def empty_hours() -> Dict[str, float]:
+    return OrderedDict((occupancy_types[t], 0.) for t in occupancy_list)
+
+
+def add_hours(total: Dict[str, float], hours: Dict[str, float]) -> Dict[str, float]:
+    for name, value in hours.items():
+        total[name] += value
+    return total
+
+
+def total_hours(hours: Dict[str, float]) -> float:
+    return sum(hours.values(), 0.)
+
+
+def subject_hours(subject_ids: Iterable[int]) -> SubjectHours:
+    """
+    Computes the scheduled hours of subjects, per group and occupancy type, with a grouped query and the series
+
+    The durations of the occupancies (soft deleted ones excepted) are summed in the database, one conditional sum per
+    occupancy type, for each (subject, group) pair. The occurrences of the series are added to them, without the
+    overridden ones (counted as occupancies) and the cancelled ones. The sessions of the whole class have no group.
+
+    :param subject_ids: The subjects to compute the hours of
+    """
+    subject_ids = list(subject_ids)
+    rows = Occupancy.objects.filter(deleted=False, subject_id__in=subject_ids) \
+        .values('subject_id', 'group_number') \
+        .annotate(**{occupancy_types[t]: Sum('duration', filter=Q(occupancy_type=t)) for t in occupancy_list}) \
+        .order_by()
+    hours = {}
+    for row in rows:
+        hours.setdefault(row['subject_id'], {})[row['group_number']] = OrderedDict(
+            (occupancy_types[t], row[occupancy_types[t]].total_seconds() / 3600. if row[occupancy_types[t]] else 0.)
+            for t in occupancy_list
+        )
+    for o in expand_series(subject_id__in=subject_ids):
+        group = hours.setdefault(o.subject_id, {}).setdefault(o.group_number, empty_hours())
+        group[occupancy_types[o.occupancy_type]] += o.duration.total_seconds() / 3600.
+    return hours
+
+
+def group_hours(hours: SubjectHours, subject_id: int, group_number: Optional[int]) -> Dict[str, float]:
+    """
+    Gets the hours attended by a group of a subject: the sessions of the whole class, and the ones of the group
+
+    :param hours: The hours of the subject, see `subject_hours`
+    :param subject_id: The id of the subject
+    :param group_number: The number of the group, None for a student who is not in any group yet
+    """
+    per_group = hours.get(subject_id, {})
+    result = add_hours(empty_hours(), per_group.get(None, {}))
+    if group_number is not None:
+        add_hours(result, per_group.get(group_number, {}))
+    return result
+
+
+def subject_total_hours(hours: SubjectHours, subject_id: int) -> Dict[str, float]:
+    """
+    Gets the hours scheduled for a subject, all groups included
+    """
+    result = empty_hours()
+    for group in hours.get(subject_id, {}).values():
+        add_hours(result, group)
+    return result
+
+
+def students_hours(student_subjects: Iterable[StudentSubject]) -> Dict[int, List[dict]]:
+    """
+    Computes the hours attended by students, per subject and occupancy type
+
+    A student attends the sessions of the whole class, and only the ones of their own group. The hours of all the
+    subjects are computed at once (see `subject_hours`).
+
+    :param student_subjects: The subjects of the students, with their subject loaded
+    :return: The entries of each student, with the `name` and `group` of the subject, its `hours` per occupancy type
+        and their `total_hours`
+    """
+    student_subjects = list(student_subjects)
+    hours = subject_hours({ss.subject_id for ss in student_subjects})
+    result = {}
+    for ss in student_subjects:
+        subject = group_hours(hours, ss.subject_id, ss.group_number)
+        result.setdefault(ss.student_id, []).append({
+            'name': ss.subject.name,
+            'group': ss.group_number,
+            'total_hours': total_hours(subject),
+            'hours': subject,
+        })
+    return result
+
+
+def student_total(subjects: List[dict]) -> Dict[str, float]:
+    """
+    Sums the hours of the subjects of a student, see `students_hours`
+    """
+    result = empty_hours()
+    for subject in subjects:
+        add_hours(result, subject['hours'])
+    return result
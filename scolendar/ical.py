@@ -0,0 +1,243 @@
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from django.core.cache import caches
+from django.db.models import Max, Min, Q, QuerySet
+from django.utils.timezone import now
+from ics import Calendar, Event
+from ics.attendee import Organizer, Attendee
+from ics.grammar.parse import string_to_container
+
+from scolendar.models import ICalFeedChange, Occupancy, OccupancySeries
+from scolendar.series import ical_datetime_line, ical_timezone, occupancy_uid, series_ical_lines, series_uid
+
+ICAL_CACHE = 'ical'
+
+calendar_header = 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:ics.py - http://git.io/lLljaA\r\n'
+calendar_footer = 'END:VCALENDAR'
+
+# Scope of the changes shown in every feed, such as the rename of a teacher, subject, class or classroom
+ALL_FEEDS = ('all', 0)
+
+
+def _cache():
+    return caches[ICAL_CACHE]
+
+
+def occupancy_key(occupancy_id: int, version: str = '') -> str:
+    return f'ical:{version}:occupancy:{occupancy_id}'
+
+
+def series_key(series_id: int, version: str = '') -> str:
+    return f'ical:{version}:series:{series_id}'
+
+
+def fragments_version(changes: Dict[Tuple[str, int], datetime] = None) -> str:
+    """
+    Gets the version of the cached fragments, which changes with the names they show (see `ALL_FEEDS`)
+
+    :param changes: The changes already read with `feed_changes`, they are read here otherwise
+    """
+    if changes is None:
+        changes = feed_changes([ALL_FEEDS])
+    date = changes.get(ALL_FEEDS)
+    return date.isoformat() if date else ''
+
+
+def _organizer(occ) -> Organizer:
+    return Organizer(
+        common_name=f'{occ.teacher.first_name} {occ.teacher.last_name}',
+        email=occ.teacher.email,
+    )
+
+
+def _attendees(occ) -> list:
+    if occ.group_number:
+        attendee_name = f'{occ.subject.name} - Groupe {occ.group_number}'
+    else:
+        attendee_name = f'{occ.subject._class.name}'
+    return [
+        Attendee(
+            common_name=attendee_name,
+            email='',
+        )
+    ]
+
+
+def with_related(occupancy_list: QuerySet) -> QuerySet:
+    """
+    Joins the rows an occupancy VEVENT is built from, and aggregates its creation and last edit dates in the same query
+    """
+    return occupancy_list.select_related('subject___class', 'teacher', 'classroom').annotate(
+        created=Min('occupancymodification__modification_date',
+                    filter=Q(occupancymodification__modification_type='INSERT')),
+        last_modified=Max('occupancymodification__modification_date',
+                          filter=Q(occupancymodification__modification_type='EDIT')),
+    )
+
+
+def occupancy_event(occ: Occupancy) -> Event:
+    """
+    Builds the VEVENT of an occupancy, loaded through `with_related`
+
+    The UID is derived from the id, so that calendar clients update the event instead of duplicating it when the feed is
+    built again. An occupancy overriding an occurrence of a series shares the series UID and is identified by its
+    RECURRENCE-ID.
+    """
+    e = Event(
+        name=occ.name,
+        uid=occupancy_uid(occ.id),
+        begin=occ.start_datetime,
+        duration=occ.duration,
+        # Serialized as the required DTSTAMP
+        created=occ.created or occ.last_modified or now(),
+        location=occ.classroom.name,
+        organizer=_organizer(occ),
+        attendees=_attendees(occ),
+    )
+    if occ.series_id:
+        e.uid = series_uid(occ.series_id)
+        e.extra.append(ical_datetime_line('RECURRENCE-ID', occ.series_start))
+    if occ.last_modified:
+        e.last_modified = occ.last_modified
+    return e
+
+
+def series_event(series: OccupancySeries, cancelled: Iterable = ()) -> Event:
+    """
+    Builds the recurring VEVENT of a series
+
+    :param series: The series, with its subject, class, teacher and classroom loaded
+    :param cancelled: The start datetimes of the occurrences cancelled by a deleted override
+    """
+    e = Event(
+        name=series.name,
+        uid=series_uid(series.id),
+        # Serialized as the required DTSTAMP
+        created=series.modification_date,
+        location=series.classroom.name,
+        organizer=_organizer(series),
+        attendees=_attendees(series),
+    )
+    e.extra.extend(series_ical_lines(series, cancelled))
+    return e
+
+
+def _cancelled_occurrences(occupancy_list: QuerySet) -> Dict[int, list]:
+    cancelled = defaultdict(list)
+    for series_id, series_start in occupancy_list.filter(series__isnull=False, deleted=True) \
+            .values_list('series_id', 'series_start'):
+        cancelled[series_id].append(series_start)
+    return cancelled
+
+
+def series_timezone(series_list: QuerySet) -> str:
+    """
+    Builds the VTIMEZONE referred to by the recurring events of some series, over the time they span
+    """
+    bounds = series_list.aggregate(start=Min('start_datetime'), end=Max('end_datetime'))
+    return ical_timezone(bounds['start'], bounds['end'])
+
+
+def build_calendar(occupancy_list: QuerySet, series_list: QuerySet) -> str:
+    """
+    Builds a whole feed through `ics.Calendar`, serializing every event
+
+    The feed endpoint assembles cached fragments instead (see `feed_fragments`), this is kept as a reference.
+    """
+    calendar = Calendar()
+    for occ in with_related(occupancy_list.filter(deleted=False)):
+        calendar.events.add(occupancy_event(occ))
+    cancelled = _cancelled_occurrences(occupancy_list)
+    for series in series_list.select_related('subject___class', 'teacher', 'classroom'):
+        calendar.events.add(series_event(series, cancelled[series.id]))
+    if series_list.exists():
+        calendar.extra.append(string_to_container(series_timezone(series_list))[0])
+    return str(calendar)
+
+
+def feed_fragments(occupancy_list: QuerySet, series_list: QuerySet, version: str = None) -> Iterator[str]:
+    """
+    Streams a feed made of the cached VEVENT fragments of its occupancies and series, inside a VCALENDAR envelope
+
+    Only the ids are fetched to look up the fragments. The rows of the missing fragments are then loaded with one query
+    per model, serialized and cached. A fragment is dropped when its occupancy or series changes (see `invalidate`),
+    and all of them are left behind when a name they show changes (see `fragments_version`). When there are series,
+    the VTIMEZONE their local times refer to is added.
+
+    :param occupancy_list: The occupancies shown in the feed, including the deleted overrides of a series
+    :param series_list: The series shown in the feed
+    :param version: The version of the fragments, when already known
+    :return: The successive pieces of the feed
+    """
+    if version is None:
+        version = fragments_version()
+    occupancy_ids = list(occupancy_list.filter(deleted=False).values_list('id', flat=True))
+    series_ids = list(series_list.values_list('id', flat=True))
+    keys = [occupancy_key(i, version) for i in occupancy_ids] + [series_key(i, version) for i in series_ids]
+    fragments = _cache().get_many(keys)
+
+    generated = {}
+    missing = [i for i in occupancy_ids if occupancy_key(i, version) not in fragments]
+    if missing:
+        for occ in with_related(Occupancy.objects.filter(id__in=missing)):
+            generated[occupancy_key(occ.id, version)] = str(occupancy_event(occ))
+    missing = [i for i in series_ids if series_key(i, version) not in fragments]
+    if missing:
+        cancelled = _cancelled_occurrences(Occupancy.objects.filter(series_id__in=missing))
+        for series in OccupancySeries.objects.filter(id__in=missing).select_related('subject___class', 'teacher',
+                                                                                    'classroom'):
+            generated[series_key(series.id, version)] = str(series_event(series, cancelled[series.id]))
+    if generated:
+        _cache().set_many(generated)
+        fragments.update(generated)
+
+    yield calendar_header
+    if series_ids:
+        # The recurring events are described in local time
+        yield series_timezone(series_list) + '\r\n'
+    for key in keys:
+        if key in fragments:
+            yield fragments[key] + '\r\n'
+    yield calendar_footer
+
+
+def feed_scopes(teacher_id: int, class_id: int) -> List[Tuple[str, int]]:
+    """
+    Lists the scopes of the feeds showing an occupancy or a series: the feed of its teacher, and the one of its class
+    """
+    return [('teacher', teacher_id), ('class', class_id)]
+
+
+def touch_feeds(scopes: Iterable[Tuple[str, int]]):
+    """
+    Records a change of the feeds of some scopes which leaves no modification behind, e.g. a hard deletion, or a
+    rename for `ALL_FEEDS`
+    """
+    for scope, scope_id in set(scopes):
+        ICalFeedChange.objects.update_or_create(scope=scope, scope_id=scope_id)
+
+
+def feed_changes(scopes: Iterable[Tuple[str, int]]) -> Dict[Tuple[str, int], datetime]:
+    """
+    Gets the date of the last change recorded by `touch_feeds` for some scopes, with one query
+    """
+    condition = reduce(or_, (Q(scope=scope, scope_id=scope_id) for scope, scope_id in scopes))
+    return {(scope, scope_id): date for scope, scope_id, date in
+            ICalFeedChange.objects.filter(condition).values_list('scope', 'scope_id', 'date')}
+
+
+def invalidate(occupancy_ids: Iterable[int] = (), series_ids: Iterable[int] = ()):
+    """
+    Drops the fragments of changed occupancies and series
+
+    An occupancy overriding an occurrence of a series also changes the fragment of the series, so its series id has to
+    be given too. Only the fragments of the current version are dropped, the older ones are never read again.
+    """
+    version = fragments_version()
+    keys = [occupancy_key(i, version) for i in occupancy_ids] + [series_key(i, version) for i in series_ids if i]
+    if keys:
+        _cache().delete_many(keys)
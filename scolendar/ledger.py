@@ -0,0 +1,213 @@
+from collections import Counter
+from itertools import chain
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from scolendar.models import Occupancy, OccupancySeries, TeacherServiceLedger
+from scolendar.series import expand_series
+from scolendar.timeline_cache import week_bounds, week_start
+
+LedgerKey = Tuple[int, int, str, object]
+
+# The fields of an occupancy read to find and fill its ledger row
+_ledger_fields = ('teacher_id', 'subject_id', 'occupancy_type', 'start_datetime', 'duration', 'deleted')
+
+
+def ledger_key(o: Occupancy) -> Optional[LedgerKey]:
+    """
+    Gets the ledger row an occupancy counts in: its teacher, subject, occupancy type and week
+
+    :return: None if the occupancy does not count in any service (soft deleted, or without teacher)
+    """
+    if o.deleted or not o.teacher_id:
+        return None
+    return o.teacher_id, o.subject_id, o.occupancy_type, week_start(o.start_datetime)
+
+
+def _seconds(o: Occupancy) -> int:
+    return int(o.duration.total_seconds())
+
+
+def record_service(key: LedgerKey, seconds: int):
+    """
+    Adds a (possibly negative) duration to a row of the ledger
+
+    The row is incremented in place, and created on the first positive change. Rows falling to zero are deleted.
+    """
+    if not seconds:
+        return
+    teacher_id, subject_id, occupancy_type, week = key
+    rows = TeacherServiceLedger.objects.filter(teacher_id=teacher_id, subject_id=subject_id,
+                                               occupancy_type=occupancy_type, week=week)
+    with transaction.atomic():
+        if rows.update(seconds=F('seconds') + seconds):
+            if seconds < 0:
+                rows.filter(seconds__lte=0).delete()
+            return
+        if seconds < 0:
+            # The row is already gone, e.g. when the teacher or the subject is deleted with its occupancies
+            return
+        try:
+            with transaction.atomic():
+                TeacherServiceLedger.objects.create(teacher_id=teacher_id, subject_id=subject_id,
+                                                    occupancy_type=occupancy_type, week=week, seconds=seconds)
+        except IntegrityError:
+            # Created concurrently since the update
+            rows.update(seconds=F('seconds') + seconds)
+
+
+def replaced_occurrence(o: Optional[Occupancy]) -> Optional[Occupancy]:
+    """
+    Gets the occurrence of a series replaced (or cancelled) by an overriding occupancy
+
+    :return: The occurrence as an unsaved occupancy, None if the occupancy overrides nothing or its series is deleted
+    """
+    if o is None or not o.series_id:
+        return None
+    series = OccupancySeries.objects.filter(id=o.series_id, deleted=False).first()
+    if series is None:
+        return None
+    return Occupancy(subject_id=series.subject_id, teacher_id=series.teacher_id, occupancy_type=series.occupancy_type,
+                     start_datetime=o.series_start, duration=series.duration)
+
+
+def update_ledger(previous: Optional[Occupancy], current: Optional[Occupancy]):
+    """
+    Moves the service of an occupancy in the ledger, after it was inserted, edited, soft deleted or deleted
+
+    An occupancy overriding an occurrence of a series takes its place: the occurrence leaves the ledger when the
+    override is inserted (deleted or not), and comes back when the override is deleted.
+
+    :param previous: The occupancy as it was before the change, None when it was inserted
+    :param current: The occupancy as it is after the change, None when it was deleted
+    """
+    changes = Counter()
+    for o, sign in ((previous, -1), (current, 1), (replaced_occurrence(previous), 1),
+                    (replaced_occurrence(current), -1)):
+        key = ledger_key(o) if o is not None else None
+        if key is not None:
+            changes[key] += sign * _seconds(o)
+    for key, seconds in changes.items():
+        record_service(key, seconds)
+
+
+def series_ledger_keys(series: OccupancySeries) -> Set[LedgerKey]:
+    """
+    Lists the ledger rows all the occurrences of a series count in, the overridden ones included
+    """
+    if series.deleted or not series.teacher_id:
+        return set()
+    return {(series.teacher_id, series.subject_id, series.occupancy_type, week_start(start))
+            for start in series.occurrence_starts()}
+
+
+def refresh_ledger(keys: Iterable[LedgerKey]):
+    """
+    Sets some rows of the ledger to the service recomputed from the occupancies and the series
+
+    Used when a series is saved or deleted, as its occurrences are not stored one by one. The occupancies and the
+    series of the rows are fetched with one query each, over the weeks of the rows.
+    """
+    keys = set(keys)
+    if not keys:
+        return
+    teacher_ids = {key[0] for key in keys}
+    subject_ids = {key[1] for key in keys}
+    start = week_bounds(min(key[3] for key in keys))[0]
+    end = week_bounds(max(key[3] for key in keys))[1]
+    occupancies = Occupancy.objects.filter(deleted=False, teacher_id__in=teacher_ids, subject_id__in=subject_ids,
+                                           start_datetime__gte=start, start_datetime__lt=end)
+    occurrences = [o for o in expand_series(start, end, teacher_id__in=teacher_ids, subject_id__in=subject_ids)
+                   if o.start_datetime >= start]
+    expected = compute_ledger(chain(occupancies.only(*_ledger_fields).iterator(), occurrences))
+    with transaction.atomic():
+        for key in keys:
+            teacher_id, subject_id, occupancy_type, week = key
+            rows = TeacherServiceLedger.objects.filter(teacher_id=teacher_id, subject_id=subject_id,
+                                                       occupancy_type=occupancy_type, week=week)
+            seconds = expected.get(key, 0)
+            if not seconds:
+                rows.delete()
+            elif not rows.update(seconds=seconds):
+                TeacherServiceLedger.objects.create(teacher_id=teacher_id, subject_id=subject_id,
+                                                    occupancy_type=occupancy_type, week=week, seconds=seconds)
+
+
+def compute_ledger(occupancies: Iterable[Occupancy]) -> Dict[LedgerKey, int]:
+    """
+    Sums the service of occupancies per ledger row
+    """
+    totals = Counter()
+    for o in occupancies:
+        key = ledger_key(o)
+        if key is not None:
+            totals[key] += _seconds(o)
+    return {key: seconds for key, seconds in totals.items() if seconds}
+
+
+def bulk_record_services(occupancies: Iterable[Occupancy]):
+    """
+    Adds the service of many new occupancies to the ledger, with one change per ledger row
+    """
+    for key, seconds in compute_ledger(occupancies).items():
+        record_service(key, seconds)
+
+
+def _stored_ledger() -> Dict[LedgerKey, int]:
+    return {
+        (teacher_id, subject_id, occupancy_type, week): seconds
+        for teacher_id, subject_id, occupancy_type, week, seconds in TeacherServiceLedger.objects.values_list(
+            'teacher_id', 'subject_id', 'occupancy_type', 'week', 'seconds').iterator()
+    }
+
+
+def _expected_ledger() -> Dict[LedgerKey, int]:
+    # The occurrences of the series which are overridden or cancelled are left out by expand_series
+    occupancies = Occupancy.objects.filter(deleted=False).only(*_ledger_fields)
+    return compute_ledger(chain(occupancies.iterator(), expand_series()))
+
+
+def _drift(stored: Dict[LedgerKey, int], expected: Dict[LedgerKey, int]) -> Dict[LedgerKey, Tuple[int, int]]:
+    return {key: (stored.get(key, 0), expected.get(key, 0)) for key in stored.keys() | expected.keys()
+            if stored.get(key, 0) != expected.get(key, 0)}
+
+
+def ledger_drift() -> Dict[LedgerKey, Tuple[int, int]]:
+    """
+    Compares the ledger with the service recomputed from the occupancies and the occurrences of the series
+
+    :return: The stored and expected seconds of the rows which differ
+    """
+    return _drift(_stored_ledger(), _expected_ledger())
+
+
+def rebuild_ledger() -> Dict[LedgerKey, Tuple[int, int]]:
+    """
+    Rebuilds the ledger from scratch, from the occupancies and the series, in a single transaction
+
+    :return: The drift found before the rebuild, see `ledger_drift`
+    """
+    with transaction.atomic():
+        stored = _stored_ledger()
+        expected = _expected_ledger()
+        TeacherServiceLedger.objects.all().delete()
+        TeacherServiceLedger.objects.bulk_create([
+            TeacherServiceLedger(teacher_id=teacher_id, subject_id=subject_id, occupancy_type=occupancy_type,
+                                 week=week, seconds=seconds)
+            for (teacher_id, subject_id, occupancy_type, week), seconds in expected.items()
+        ], batch_size=500)
+    return _drift(stored, expected)
+
+
+def fill_ledger(sender, using='default', **kwargs):
+    """
+    Builds the ledger when it is empty while there are occupancies, e.g. the first time it is migrated
+
+    Connected to `post_migrate`.
+    """
+    if using != 'default' or TeacherServiceLedger.objects.exists():
+        return
+    if Occupancy.objects.filter(deleted=False).exists() or OccupancySeries.objects.filter(deleted=False).exists():
+        rebuild_ledger()
@@ -0,0 +1,47 @@
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from scolendar import ical
+from scolendar.models import Occupancy, OccupancySeries, Teacher
+
+
+class Command(BaseCommand):
+    help = 'Compares building an iCal feed through ics.Calendar with assembling it from cached VEVENT fragments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--teacher', type=int, default=None,
+                            help='Id of the teacher whose feed is built (default: the one with the most occupancies)')
+        parser.add_argument('--iterations', type=int, default=20, help='Number of builds per path (default: 20)')
+
+    def handle(self, *args, **options):
+        teacher_id = options['teacher']
+        if teacher_id is None:
+            teacher_id = Teacher.objects.annotate(occupancy_count=Count('occupancy')) \
+                .order_by('-occupancy_count').values_list('id', flat=True).first()
+        if teacher_id is None:
+            raise CommandError('There is no teacher to build a feed for')
+        occupancy_list = Occupancy.objects.filter(teacher_id=teacher_id)
+        series_list = OccupancySeries.objects.filter(teacher_id=teacher_id, deleted=False)
+        iterations = options['iterations']
+
+        def clear():
+            ical.invalidate(occupancy_list.values_list('id', flat=True), series_list.values_list('id', flat=True))
+
+        def run(name, build, before=None):
+            elapsed = 0
+            size = 0
+            for _ in range(iterations):
+                if before:
+                    before()
+                start = default_timer()
+                size = len(build())
+                elapsed += default_timer() - start
+            self.stdout.write(f'{name:<24}{elapsed / iterations * 1000:>10.2f} ms{size:>12} bytes')
+
+        self.stdout.write(f'Teacher {teacher_id}: {occupancy_list.count()} occupancies, {series_list.count()} series, '
+                          f'{iterations} iterations')
+        run('ics.Calendar', lambda: ical.build_calendar(occupancy_list, series_list))
+        run('fragments (cold)', lambda: ''.join(ical.feed_fragments(occupancy_list, series_list)), before=clear)
+        run('fragments (warm)', lambda: ''.join(ical.feed_fragments(occupancy_list, series_list)))
@@ -0,0 +1,26 @@
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand
+
+from scolendar.accounts import generate_password, hash_passwords, hashing_workers
+
+
+class Command(BaseCommand):
+    help = 'Measures the speedup of hashing account passwords in a pool of processes, for each pool size.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=200, help='Number of passwords to hash (default: 200)')
+        parser.add_argument('--max-workers', type=int, default=hashing_workers(),
+                            help='Largest pool size to measure (default: the number of cores)')
+
+    def handle(self, *args, **options):
+        passwords = [generate_password() for _ in range(options['accounts'])]
+        self.stdout.write(f'{len(passwords)} passwords, {hashing_workers()} cores')
+        serial = None
+        for workers in range(1, options['max_workers'] + 1):
+            start = default_timer()
+            hash_passwords(passwords, workers)
+            elapsed = default_timer() - start
+            serial = serial or elapsed
+            self.stdout.write(f'{workers:>3} worker{"s" if workers > 1 else " "}{elapsed:>10.2f} s'
+                              f'{serial / elapsed:>8.2f}x{serial / elapsed / workers:>8.0%} efficiency')
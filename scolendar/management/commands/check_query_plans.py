@@ -0,0 +1,92 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from conf.conf import max_duration
+from scolendar.membership import get_membership, membership_filter
+from scolendar.models import Occupancy, Teacher, Classroom, Class, Subject, Student
+from scolendar.timeline import get_occupancies
+
+sequential_scan_patterns = {
+    'postgresql': r'Seq Scan on {table}\b',
+    'sqlite': r'\bSCAN (TABLE )?{table}\b(?! USING (COVERING )?INDEX)',
+}
+
+
+def canonical_queries(start, end) -> dict:
+    """
+    Builds the query run by each occupancy endpoint for a given time window
+
+    The first existing resource of each kind is used, or an arbitrary id if there is none, as the plan does not depend
+    on the query returning rows.
+
+    :param start: Start of the time window
+    :param end: End of the time window
+    :return: A dictionary of querysets, indexed by the endpoint they belong to
+    """
+
+    def first_id(model) -> int:
+        return model.objects.order_by('id').values_list('id', flat=True).first() or 1
+
+    teacher_id = first_id(Teacher)
+    classroom_id = first_id(Classroom)
+    subject_id = first_id(Subject)
+    # A student without subjects would have an empty timeline, which has no plan
+    membership = get_membership(first_id(Student)) or frozenset([(subject_id, None), (subject_id, 1)])
+    conflicts = Occupancy.objects.filter(
+        deleted=False,
+        start_datetime__gt=start - max_duration(),
+        start_datetime__lt=end,
+        end_datetime__gt=start,
+    )
+    return {
+        'occupancies': get_occupancies(start, end),
+        'teachers/<id>/occupancies': get_occupancies(start, end, teacher_id=teacher_id),
+        'classrooms/<id>/occupancies': get_occupancies(start, end, classroom_id=classroom_id),
+        'classes/<id>/occupancies': get_occupancies(start, end, subject___class_id=first_id(Class)),
+        'students/<id>/occupancies': get_occupancies(start, end, membership_filter(membership)),
+        'subjects/<id>/occupancies': get_occupancies(start, end, subject_id=subject_id),
+        'subjects/<id>/groups/<n>/occupancies': get_occupancies(start, end, subject_id=subject_id, group_number=1),
+        'Occupancy.clean (classroom)': conflicts.filter(classroom_id=classroom_id),
+        'Occupancy.clean (teacher)': conflicts.filter(teacher_id=teacher_id),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN on the canonical occupancy queries of each endpoint and flags sequential scans.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Size of the time window, in days (default: 7)')
+        parser.add_argument('--disable-seqscan', action='store_true',
+                            help='PostgreSQL only: penalize sequential scans, to check that an index path exists even '
+                                 'when the table is too small for the planner to use it')
+
+    def handle(self, *args, **options):
+        pattern = sequential_scan_patterns.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f'Query plans can not be checked on {connection.vendor}')
+        seq_scan = re.compile(pattern.format(table=re.escape(Occupancy._meta.db_table)))
+
+        start = now()
+        end = start + timedelta(days=options['days'])
+        flagged = []
+        with transaction.atomic():
+            if options['disable_seqscan'] and connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for endpoint, queryset in canonical_queries(start, end).items():
+                plan = queryset.explain()
+                if seq_scan.search(plan):
+                    flagged.append(endpoint)
+                    self.stdout.write(self.style.ERROR(f'SEQ SCAN  {endpoint}'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'OK        {endpoint}'))
+                if options['verbosity'] > 1 or endpoint in flagged:
+                    self.stdout.write(plan)
+
+        if flagged:
+            raise CommandError(f'{len(flagged)} quer{"ies" if len(flagged) > 1 else "y"} use a sequential scan on '
+                               f'{Occupancy._meta.db_table}')
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from scolendar.ledger import ledger_drift, rebuild_ledger
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the teacher service ledger from the occupancies and the series, and reports the rows which had ' \
+           'drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report the drift, without rebuilding the ledger (fails if there is any)')
+
+    def handle(self, *args, **options):
+        drift = ledger_drift() if options['check'] else rebuild_ledger()
+        for (teacher_id, subject_id, occupancy_type, week), (stored, expected) in sorted(drift.items()):
+            self.stdout.write(f'teacher {teacher_id:<6} subject {subject_id:<6} {occupancy_type:<5} week of {week}: '
+                              f'{stored / 3600.:>8.2f} h stored, {expected / 3600.:>8.2f} h expected')
+        if not options['check']:
+            self.stdout.write(f'{len(drift)} ledger rows had drifted, the ledger was rebuilt')
+        elif drift:
+            raise CommandError(f'{len(drift)} ledger rows have drifted')
+        else:
+            self.stdout.write('The ledger is up to date')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from scolendar import timeline_cache
+
+
+class Command(BaseCommand):
+    help = 'Prints the hit and miss counters of the timeline cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Resets the counters after printing them')
+
+    def handle(self, *args, **options):
+        stats = timeline_cache.stats()
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total if total else 0
+        self.stdout.write(f'hits: {stats["hits"]}\nmisses: {stats["misses"]}\nhit ratio: {ratio:.1%}')
+        if options['reset']:
+            timeline_cache.reset_stats()
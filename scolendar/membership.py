@@ -0,0 +1,79 @@
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+from django.core.cache import caches
+from django.db.models import Q
+
+from scolendar.models import StudentSubject
+from scolendar.timeline_cache import TIMELINE_CACHE
+
+# The (subject id, group number) pairs of a student, the group number being None until the groups are distributed
+Membership = FrozenSet[Tuple[int, Optional[int]]]
+
+
+def _cache():
+    return caches[TIMELINE_CACHE]
+
+
+def _key(student_id: int) -> str:
+    return f'membership:student:{student_id}'
+
+
+def compute_memberships(student_ids: Iterable[int]) -> Dict[int, Membership]:
+    """
+    Gets the subjects and groups of students, with a single query
+    """
+    memberships = {student_id: set() for student_id in student_ids}
+    rows = StudentSubject.objects.filter(student_id__in=list(memberships)) \
+        .values_list('student_id', 'subject_id', 'group_number')
+    for student_id, subject_id, group_number in rows:
+        memberships[student_id].add((subject_id, group_number))
+    return {student_id: frozenset(pairs) for student_id, pairs in memberships.items()}
+
+
+def refresh_memberships(student_ids: Iterable[int]) -> Dict[int, Membership]:
+    """
+    Stores the current subjects and groups of students in the membership index
+
+    Called whenever the groups of a subject are distributed, and when a student joins or leaves a subject.
+    """
+    memberships = compute_memberships(student_ids)
+    _cache().set_many({_key(student_id): list(pairs) for student_id, pairs in memberships.items()})
+    return memberships
+
+
+def get_membership(student_id: int) -> Membership:
+    """
+    Gets the subjects and groups of a student from the membership index, filling it on a miss
+    """
+    pairs = _cache().get(_key(student_id))
+    if pairs is None:
+        return refresh_memberships([student_id])[student_id]
+    return frozenset(tuple(pair) for pair in pairs)
+
+
+def membership_filter(membership: Membership) -> Q:
+    """
+    Builds the condition selecting the occupancies (or series) attended by a student
+
+    The sessions of the whole class of each subject are kept, and only the sessions of the student's own group
+    otherwise. The subjects are gathered by group number, so that the condition has one term per group number
+    rather than one per subject.
+    """
+    subjects = set()
+    groups = defaultdict(set)
+    for subject_id, group_number in membership:
+        subjects.add(subject_id)
+        if group_number is not None:
+            groups[group_number].add(subject_id)
+    condition = Q(subject_id__in=sorted(subjects), group_number__isnull=True)
+    for group_number, subject_ids in sorted(groups.items()):
+        condition |= Q(subject_id__in=sorted(subject_ids), group_number=group_number)
+    return condition
+
+
+def student_filter(student_id: int) -> Q:
+    """
+    Builds the condition selecting the occupancies (or series) of a student's timeline, see `membership_filter`
+    """
+    return membership_filter(get_membership(student_id))
@@ -0,0 +1,14 @@
+from scolendar.groups import deferred_group_reorganization
+
+
+class GroupReorganizationMiddleware:
+    """
+    Reorganizes the groups of each subject whose students changed during a request once, after the response is built
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with deferred_group_reorganization():
+            return self.get_response(request)
@@ -1,17 +1,23 @@
 import binascii
 import os
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import Group as BaseGroup, User
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.utils.timezone import now
+from django.db import IntegrityError, models, transaction
+from django.db.models import Q
+from django.utils.timezone import localtime, now
 from django.utils.translation import gettext as _
+from pytz import timezone
+from recurrence.fields import RecurrenceField
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.models import Token
 
+from conf.conf import max_duration
+from .constraints import OverlapExclusionConstraint
+from .search import SearchableModel, index_objects
 from .validators import start_datetime_validator, max_duration_validator, phone_number_validator, \
     class_name_validator, end_datetime_validator
 
@@ -27,20 +33,47 @@ occupancy_type_list = [(x, _(x)) for x in occupancy_list]
 modification_list = ['INSERT', 'EDIT', 'DELETE']
 modification_types_list = [(x, _(x)) for x in modification_list]
 
+conflict_messages = {
+    'ClassroomAlreadyOccupied': _('Cette salle est déjà réservée'),
+    'TeacherAlreadyOccupied': _('L\'enseignant est déjà occupé'),
+    'ClassOrGroupAlreadyOccupied': _('Cette classe ou ce groupe est déjà occupé'),
+}
 
-class Class(BaseGroup):  # registered
+overlap_constraint_messages = {
+    'occupancy_classroom_overlap': _('Cette salle est déjà réservée'),
+    'occupancy_teacher_overlap': _('L\'enseignant est déjà occupé'),
+}
+
+
+class Class(BaseGroup, SearchableModel):  # registered
     level = models.CharField(max_length=2, verbose_name=_('Niveau'), choices=level_list)
 
     def clean(self):
         class_name_validator(self.name)
         super(Class, self).clean()
 
+    def search_values(self):
+        return [self.name]
+
+    def save(self, *args, **kwargs):
+        previous_name = Class.objects.filter(id=self.id).values_list('name', flat=True).first() if self.id else None
+        super(Class, self).save(*args, **kwargs)
+        if previous_name is not None and previous_name != self.name:
+            # The students and subjects are searched by the name of their class
+            for model in (Student, Subject):
+                objects = list(model.objects.filter(_class=self))
+                for obj in objects:
+                    obj._class = self
+                    obj.refresh_search_text()
+                model.objects.bulk_update(objects, ['search_text'], batch_size=500)
+                index_objects(objects)
+
     class Meta:
         verbose_name = _('Classe')
         verbose_name_plural = _('Classes')
 
 
-class Subject(models.Model):  # registered
+class Subject(SearchableModel):  # registered
     _class = models.ForeignKey(Class, on_delete=models.CASCADE, verbose_name=_('Classe'))
     name = models.CharField(max_length=255, verbose_name=_('Matière'))
     group_count = models.PositiveIntegerField(
@@ -55,23 +88,22 @@ class Subject(models.Model):  # registered
     def __str__(self):
         return f'{self._class}: {self.name}'
 
+    def search_values(self):
+        return [self.name, self._class.name]
+
     def save(self, *args, **kwargs):
-        from scolendar.groups import attribute_student_groups
+        from scolendar.groups import deferred_group_reorganization, schedule_group_reorganization
         try:
             old_instance = Subject.objects.get(id=self.id)
             super(Subject, self).save(*args, **kwargs)
             if old_instance.group_count != self.group_count:
-                attribute_student_groups(self)
+                schedule_group_reorganization([self.id])
         except Subject.DoesNotExist:
             super(Subject, self).save(*args, **kwargs)
-            from django.db.models.signals import post_save
-            from scolendar.signals import student_group_reorganization_on_student_subject
-            post_save.disconnect(receiver=student_group_reorganization_on_student_subject, sender=StudentSubject)
-            for student in Student.objects.filter(_class=self._class):
-                student_subject = StudentSubject(student=student, subject=self)
-                student_subject.save()
-            attribute_student_groups(self)
-            post_save.connect(receiver=student_group_reorganization_on_student_subject, sender=StudentSubject)
+            with deferred_group_reorganization():
+                for student in Student.objects.filter(_class=self._class):
+                    student_subject = StudentSubject(student=student, subject=self)
+                    student_subject.save()
 
     class Meta:
         verbose_name = _('Matière')
@@ -79,9 +111,12 @@ class Subject(models.Model):  # registered
         unique_together = [('_class', 'name',), ]
 
 
-class Student(User):  # registered
+class Student(User, SearchableModel):  # registered
     _class = models.ForeignKey(Class, on_delete=models.CASCADE, verbose_name=_('Classe'))
 
+    def search_values(self):
+        return [self.first_name, self.last_name, self._class.name]
+
     def save(self, *args, **kwargs):
         try:
             old_instance = Student.objects.get(id=self.id)
@@ -146,23 +181,29 @@ class StudentClassTemp(models.Model):  # should not be registered
     class_to_add = models.ForeignKey(Class, on_delete=models.CASCADE, related_name='class_to_add')
 
 
-class Classroom(models.Model):  # registered
+class Classroom(SearchableModel):  # registered
     name = models.CharField(max_length=255, verbose_name=_('Nom'), unique=True)
     capacity = models.IntegerField(verbose_name=_('Capacité'))
 
     def __str__(self):
         return self.name
 
+    def search_values(self):
+        return [self.name]
+
     class Meta:
         verbose_name = _('Salle')
         verbose_name_plural = _('Salles')
         unique_together = [('name', 'capacity',), ]
 
 
-class Teacher(User):  # registered
+class Teacher(User, SearchableModel):  # registered
     phone_number = models.CharField(max_length=31, verbose_name=_('Téléphone'), validators=[phone_number_validator, ])
     rank = models.CharField(max_length=4, verbose_name=_('Grade'), choices=rank_list)
 
+    def search_values(self):
+        return [self.first_name, self.last_name, self.phone_number]
+
     class Meta:
         verbose_name = _('Intervenant')
         verbose_name_plural = _('Intervenants')
@@ -179,6 +220,94 @@ class TeacherSubject(models.Model):  # registered
         unique_together = [('teacher', 'subject')]
 
 
+class OccupancySeries(models.Model):  # registered
+    classroom = models.ForeignKey(Classroom, on_delete=models.CASCADE, verbose_name=_('Salle'))
+    group_number = models.PositiveIntegerField(verbose_name=_('Numéro du groupe'), blank=True, null=True)
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, verbose_name=_('Matière'))
+    teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, verbose_name=_('Interevenant'), blank=True)
+    start_datetime = models.DateTimeField(verbose_name=_('Date et Heure de la première séance'), default=now,
+                                          validators=[start_datetime_validator])
+    duration = models.DurationField(verbose_name=_('Durée'), default=timedelta(days=0, hours=1, minutes=0, seconds=0),
+                                    validators=[max_duration_validator])
+    end_datetime = models.DateTimeField(verbose_name=_('Date et Heure de fin de la dernière séance'), editable=False)
+    recurrences = RecurrenceField(verbose_name=_('Récurrence'))
+    occupancy_type = models.CharField(max_length=4, verbose_name=_('Type'), choices=occupancy_type_list, default='CM')
+    name = models.CharField(max_length=255, verbose_name=_('Nom'))
+    description = models.TextField(verbose_name=_('Description'), default='')
+    deleted = models.BooleanField(verbose_name=_('Supprimé'), default=False)
+    modification_date = models.DateTimeField(verbose_name=_('Date de modification'), auto_now=True)
+
+    def __str__(self):
+        return f'{self.subject}: {self.name}'
+
+    def occurrence_starts(self, after: datetime = None, before: datetime = None) -> list:
+        """
+        Expands the recurrence rule into the start datetimes of the occurrences
+
+        The rule is expanded on naive local datetimes, so that the occurrences keep the same local time across
+        daylight saving time changes.
+
+        :param after: Only keep the occurrences starting after this datetime (included)
+        :param before: Only keep the occurrences starting before this datetime (excluded)
+        :return: The sorted list of aware start datetimes
+        """
+        tz = timezone(settings.TIME_ZONE)
+        rule_set = self.recurrences.to_dateutil_rruleset(localtime(self.start_datetime, tz).replace(tzinfo=None))
+        if after is None and before is None:
+            starts = list(rule_set)
+        else:
+            after = localtime(after or self.start_datetime, tz).replace(tzinfo=None)
+            before = localtime(before or self.end_datetime, tz).replace(tzinfo=None)
+            starts = rule_set.between(after, before, inc=True)
+        starts = [tz.localize(start) for start in starts]
+        if starts and before is not None and tz.localize(before) == starts[-1]:
+            starts.pop()
+        return starts
+
+    def clean(self):
+        super(OccupancySeries, self).clean()
+        for rule in self.recurrences.rrules:
+            if rule.count is None and rule.until is None:
+                raise ValidationError(_('La récurrence doit avoir une date de fin ou un nombre de séances'))
+        if self.deleted:
+            return
+        max_duration_validator(self.duration)
+        from scolendar.occupancies import find_conflicts
+        overridden = set(self.overrides.values_list('series_start', flat=True)) if self.id else set()
+        occurrences = [Occupancy(
+            classroom_id=self.classroom_id,
+            group_number=self.group_number,
+            subject=self.subject,
+            teacher_id=self.teacher_id,
+            start_datetime=start,
+            end_datetime=start + self.duration,
+        ) for start in self.occurrence_starts() if start not in overridden]
+        conflicts = find_conflicts(occurrences, exclude_series_id=self.id)
+        if conflicts:
+            raise ValidationError(conflict_messages[next(iter(conflicts.values()))])
+
+    def save(self, *args, **kwargs):
+        from scolendar.ledger import refresh_ledger, series_ledger_keys
+        self.clean()
+        starts = self.occurrence_starts()
+        self.end_datetime = (starts[-1] if starts else self.start_datetime) + self.duration
+        old_instance = OccupancySeries.objects.filter(id=self.id).first() if self.id else None
+        super(OccupancySeries, self).save(*args, **kwargs)
+        # The occurrences are not stored, the weeks they count in (before and after the change) are recomputed
+        keys = series_ledger_keys(self)
+        if old_instance is not None:
+            keys |= series_ledger_keys(old_instance)
+        refresh_ledger(keys)
+
+    class Meta:
+        verbose_name = _('Série d\'occupations')
+        verbose_name_plural = _('Séries d\'occupations')
+        indexes = [
+            models.Index(fields=['start_datetime', 'end_datetime'], name='occupancy_series_range',
+                         condition=Q(deleted=False)),
+        ]
+
+
 class Occupancy(models.Model):  # registered
     classroom = models.ForeignKey(Classroom, on_delete=models.CASCADE, verbose_name=_('Salle'))
     group_number = models.PositiveIntegerField(verbose_name=_('Numéro du groupe'), blank=True, null=True)
@@ -193,53 +322,75 @@ class Occupancy(models.Model):  # registered
     name = models.CharField(max_length=255, verbose_name=_('Nom'))
     description = models.TextField(verbose_name=_('Description'), default='')
     deleted = models.BooleanField(verbose_name=_('Supprimé'), default=False)
+    series = models.ForeignKey(OccupancySeries, on_delete=models.CASCADE, verbose_name=_('Série'), blank=True,
+                               null=True, related_name='overrides')
+    series_start = models.DateTimeField(verbose_name=_('Date et Heure de la séance remplacée'), blank=True, null=True)
 
     def clean(self):
         super(Occupancy, self).clean()
-
-        def check(occupancies, error_message):
-            for occ in occupancies:
-                if occ.id == self.id:
-                    continue
-                latest_start = max(self.start_datetime, occ.start_datetime)
-                earliest_end = min(self.end_datetime, occ.end_datetime)
-                delta = (earliest_end - latest_start).days + 1
-                overlap = max(0, delta)
-                if overlap > 0:
-                    raise ValidationError(error_message)
+        if self.series_id and not self.series_start:
+            raise ValidationError(_('La séance remplacée doit être précisée'))
+        if self.deleted:
+            return
+        max_duration_validator(self.duration)
+        start_datetime = self.start_datetime
+        end_datetime = self.start_datetime + self.duration
+
+        # An occupancy can not last more than the max duration, so bounding start_datetime on both sides turns each
+        # check into a single range probe on the (resource, start_datetime) indexes.
+        overlapping = Occupancy.objects.filter(
+            deleted=False,
+            start_datetime__gt=start_datetime - max_duration(),
+            start_datetime__lt=end_datetime,
+            end_datetime__gt=start_datetime,
+        )
+        if self.id:
+            overlapping = overlapping.exclude(id=self.id)
 
         def check_room_occupied():
-            if self.classroom:
-                occupancies = Occupancy.objects.filter(classroom=self.classroom, deleted=False,
-                                                       start_datetime__day=self.start_datetime.day)
-                check(occupancies, _('Cette salle est déjà réservée'))
+            if self.classroom_id:
+                if overlapping.filter(classroom_id=self.classroom_id).exists():
+                    raise ValidationError(_('Cette salle est déjà réservée'))
 
         def check_teacher_occupied():
-            occupancies = Occupancy.objects.filter(teacher=self.teacher, deleted=False,
-                                                   start_datetime__day=self.start_datetime.day)
-            check(occupancies, _('L\'enseignant est déjà occupé'))
+            if self.teacher_id:
+                if overlapping.filter(teacher_id=self.teacher_id).exists():
+                    raise ValidationError(_('L\'enseignant est déjà occupé'))
 
         def check_group_occupied():
+            class_id = self.subject._class_id
             if self.group_number:
-                occupancies = Occupancy.objects.filter(group_number=self.group_number, deleted=False,
-                                                       start_datetime__day=self.start_datetime.day)
-                check(occupancies, _('Ce groupe est déjà occupé'))
+                occupancies = overlapping.filter(
+                    Q(subject___class_id=class_id, group_number__isnull=True) |
+                    Q(subject_id=self.subject_id, group_number=self.group_number)
+                )
+                if occupancies.exists():
+                    raise ValidationError(_('Ce groupe est déjà occupé'))
             else:
-                occupancies = Occupancy.objects.filter(subject___class=self.subject._class, deleted=False,
-                                                       start_datetime__day=self.start_datetime.day)
-                check(occupancies, _('Cette classe est déjà occupée'))
+                if overlapping.filter(subject___class_id=class_id).exists():
+                    raise ValidationError(_('Cette classe est déjà occupée'))
 
         # TODO check if one student is in another group which is occupied
         check_room_occupied()
         check_teacher_occupied()
         check_group_occupied()
 
+        from scolendar.occupancies import find_conflicts
+        self.end_datetime = end_datetime
+        exclude_occurrence = (self.series_id, self.series_start) if self.series_id else None
+        conflicts = find_conflicts([self], occupancies=False, exclude_occurrence=exclude_occurrence)
+        if conflicts:
+            raise ValidationError(conflict_messages[conflicts[0]])
+
     def save(self, *args, **kwargs):
+        from scolendar.ledger import update_ledger
         self.end_datetime = self.start_datetime + self.duration
         self.clean()
         try:
             old_instance = Occupancy.objects.get(id=self.id)
-            super(Occupancy, self).save(*args, **kwargs)
+            # Read by the modification signal, to invalidate the timelines the occupancy was moved out of
+            self.previous_instance = old_instance
+            self._save_without_overlap(*args, **kwargs)
             if not old_instance.deleted and not self.deleted:
                 occupancy_modification = OccupancyModification(
                     occupancy=self,
@@ -258,8 +409,9 @@ class Occupancy(models.Model):  # registered
                     previous_duration=old_instance.duration,
                 )
                 occupancy_modification.save()
+            update_ledger(old_instance, self)
         except Occupancy.DoesNotExist:
-            super(Occupancy, self).save(*args, **kwargs)
+            self._save_without_overlap(*args, **kwargs)
             occupancy_modification = OccupancyModification(
                 occupancy=self,
                 modification_type='INSERT',
@@ -267,11 +419,38 @@ class Occupancy(models.Model):  # registered
                 new_duration=self.duration,
             )
             occupancy_modification.save()
+            update_ledger(None, self)
+
+    def _save_without_overlap(self, *args, **kwargs):
+        try:
+            with transaction.atomic():
+                super(Occupancy, self).save(*args, **kwargs)
+        except IntegrityError as e:
+            for constraint, message in overlap_constraint_messages.items():
+                if constraint in str(e):
+                    raise ValidationError(message)
+            raise
 
     class Meta:
         verbose_name = _('Occupation')
         verbose_name_plural = _('Occupations')
-        unique_together = [('classroom', 'subject', 'teacher', 'start_datetime')]
+        unique_together = [('classroom', 'subject', 'teacher', 'start_datetime'), ('series', 'series_start')]
+        indexes = [
+            models.Index(fields=['start_datetime', 'end_datetime'], name='occupancy_range',
+                         condition=Q(deleted=False)),
+            models.Index(fields=['classroom', 'start_datetime', 'end_datetime'], name='occupancy_classroom_range',
+                         condition=Q(deleted=False)),
+            models.Index(fields=['teacher', 'start_datetime', 'end_datetime'], name='occupancy_teacher_range',
+                         condition=Q(deleted=False)),
+            models.Index(fields=['subject', 'start_datetime', 'end_datetime'], name='occupancy_subject_range',
+                         condition=Q(deleted=False)),
+            models.Index(fields=['subject', 'group_number', 'start_datetime'], name='occupancy_group_range',
+                         condition=Q(deleted=False)),
+        ]
+        constraints = [
+            OverlapExclusionConstraint(name='occupancy_classroom_overlap', field='classroom'),
+            OverlapExclusionConstraint(name='occupancy_teacher_overlap', field='teacher'),
+        ]
 
 
 class OccupancyModification(models.Model):
@@ -284,6 +463,46 @@ class OccupancyModification(models.Model):
     modification_date = models.DateTimeField(verbose_name=_('Date de modification'), auto_now=True)
 
 
+class TeacherServiceLedger(models.Model):
+    """
+    Service of a teacher for a subject and an occupancy type, during a week
+
+    Kept up to date by `Occupancy.save`, see `scolendar.ledger`. The duration is stored in seconds, so that it can be
+    incremented in place on every database.
+    """
+    teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, verbose_name=_('Interevenant'))
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, verbose_name=_('Matière'))
+    occupancy_type = models.CharField(max_length=4, verbose_name=_('Type'), choices=occupancy_type_list)
+    week = models.DateField(verbose_name=_('Semaine'))
+    seconds = models.BigIntegerField(verbose_name=_('Durée (secondes)'), default=0)
+
+    @property
+    def hours(self) -> float:
+        return self.seconds / 3600.
+
+    class Meta:
+        verbose_name = _('Service d\'un intervenant')
+        verbose_name_plural = _('Services des intervenants')
+        unique_together = [('teacher', 'subject', 'occupancy_type', 'week')]
+
+
+class ICalFeedChange(models.Model):
+    """
+    Date of the last change of the iCal feeds of a scope which leaves no modification behind, such as a hard deletion
+
+    The scope is a teacher or a class, as in `scolendar.timeline_cache`. Only moves forward, so that the
+    `Last-Modified` date of a feed never goes back (see `scolendar.ical.touch_feeds`).
+    """
+    scope = models.CharField(max_length=8, verbose_name=_('Portée'))
+    scope_id = models.PositiveIntegerField(verbose_name=_('Identifiant'))
+    date = models.DateTimeField(verbose_name=_('Date de modification'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('Modification d\'un calendrier')
+        verbose_name_plural = _('Modifications des calendriers')
+        unique_together = [('scope', 'scope_id')]
+
+
 class ICalToken(models.Model):
     key = models.CharField(_("Key"), max_length=40, primary_key=True)
     user = models.OneToOneField(
@@ -0,0 +1,252 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Q
+
+from scolendar.ledger import bulk_record_services
+from scolendar.models import Occupancy, OccupancyModification, Classroom, Subject, Teacher, occupancy_list
+from scolendar.series import expand_series
+from scolendar.timeline import parse_timestamp
+from scolendar.timeline_cache import invalidate_occupancies
+from scolendar.validators import start_datetime_validator, end_datetime_validator, max_duration_validator
+
+conflict_codes = {
+    'classroom': 'ClassroomAlreadyOccupied',
+    'teacher': 'TeacherAlreadyOccupied',
+    'class': 'ClassOrGroupAlreadyOccupied',
+    'class_any': 'ClassOrGroupAlreadyOccupied',
+    'group': 'ClassOrGroupAlreadyOccupied',
+}
+
+
+def _resource_keys(classroom_id, teacher_id, class_id, subject_id, group_number) -> Tuple[list, list]:
+    """
+    Gets the resources an occupancy holds, and the ones it can not share with another occupancy
+
+    A whole class occupancy conflicts with any occupancy of the class, while a group occupancy only conflicts with the
+    whole class occupancies and the occupancies of the same group.
+
+    :return: The keys held by the occupancy, and the keys it has to check
+    """
+    held = [('classroom', classroom_id), ('teacher', teacher_id), ('class_any', class_id)]
+    checked = [('classroom', classroom_id), ('teacher', teacher_id)]
+    if group_number:
+        held.append(('group', subject_id, group_number))
+        checked += [('class', class_id), ('group', subject_id, group_number)]
+    else:
+        held.append(('class', class_id))
+        checked.append(('class_any', class_id))
+    return held, checked
+
+
+def _parse_entry(entry, classrooms: dict, teachers: dict, subjects: dict) -> Occupancy:
+    """
+    Builds an unsaved occupancy from an entry of the bulk creation request
+
+    :raise KeyError, TypeError, ValueError, OverflowError, OSError: if the entry is malformed (the last two for
+        timestamps out of range)
+    :raise LookupError: if one of the ids does not exist
+    :raise ValidationError: if the occupancy does not respect the timings, with the error code as message
+    """
+    occupancy_type = entry['occupancy_type']
+    if occupancy_type not in occupancy_list:
+        raise ValidationError('InvalidOccupancyType')
+    subject = subjects.get(int(entry['subject_id']))
+    classroom = classrooms.get(int(entry['classroom_id']))
+    teacher = teachers.get(int(entry['teacher_id']))
+    if subject is None or classroom is None or teacher is None:
+        raise LookupError
+    group_number = entry.get('group_number', None)
+    if group_number is not None:
+        group_number = int(group_number)
+        if not 1 <= group_number <= subject.group_count:
+            raise LookupError
+    start_datetime = parse_timestamp(entry['start'])
+    end_datetime = parse_timestamp(entry['end'])
+    if end_datetime <= start_datetime:
+        raise ValidationError('EndBeforeStart')
+    try:
+        start_datetime_validator(start_datetime)
+        end_datetime_validator(end_datetime)
+        max_duration_validator(end_datetime - start_datetime)
+    except ValidationError:
+        raise ValidationError('InvalidTimeSlot')
+    return Occupancy(
+        classroom=classroom,
+        group_number=group_number,
+        subject=subject,
+        teacher=teacher,
+        start_datetime=start_datetime,
+        duration=end_datetime - start_datetime,
+        end_datetime=end_datetime,
+        occupancy_type=occupancy_type,
+        name=str(entry['name']),
+        description=str(entry.get('description', '')),
+    )
+
+
+def _occupancy_keys(o: Occupancy) -> Tuple[list, list]:
+    return _resource_keys(o.classroom_id, o.teacher_id, o.subject._class_id, o.subject_id, o.group_number)
+
+
+def find_conflicts(candidates: List[Occupancy], occupancies: bool = True, exclude_series_id: Optional[int] = None,
+                   exclude_occurrence: Optional[Tuple[int, datetime]] = None) -> Dict[int, str]:
+    """
+    Checks the conflicts of occupancies about to be written, between themselves and with the existing ones
+
+    The existing occupancies and series occurrences overlapping the candidates are fetched with one range query each,
+    then a single sweep over all the intervals sorted by start datetime finds the conflicts. When two candidates
+    conflict, the one starting first is kept.
+
+    :param candidates: The occupancies to check, with their `end_datetime` set
+    :param occupancies: Whether to check the stored occupancies, or only the series occurrences
+    :param exclude_series_id: The id of a series whose occurrences are ignored, when the candidates are its occurrences
+    :param exclude_occurrence: The series id and start datetime of an occurrence overridden by a candidate
+    :return: The positions of the conflicting candidates, with their error code
+    """
+    if not candidates:
+        return {}
+    window_start = min(o.start_datetime for o in candidates)
+    window_end = max(o.end_datetime for o in candidates)
+    resources = Q(classroom_id__in={o.classroom_id for o in candidates}) | \
+        Q(teacher_id__in={o.teacher_id for o in candidates}) | \
+        Q(subject___class_id__in={o.subject._class_id for o in candidates})
+
+    existing = []
+    if occupancies:
+        rows = Occupancy.objects.filter(
+            resources,
+            deleted=False,
+            start_datetime__lt=window_end,
+            end_datetime__gt=window_start,
+        ).exclude(
+            id__in=[o.id for o in candidates if o.id],
+        ).values_list('start_datetime', 'end_datetime', 'classroom_id', 'teacher_id', 'subject___class_id',
+                      'subject_id', 'group_number')
+        for start_datetime, end_datetime, *resource_ids in rows:
+            existing.append((start_datetime, end_datetime, None, _resource_keys(*resource_ids)))
+    series_filter = resources & ~Q(id=exclude_series_id) if exclude_series_id else resources
+    for o in expand_series(window_start, window_end, series_filter, exclude_occurrence=exclude_occurrence):
+        existing.append((o.start_datetime, o.end_datetime, None, _occupancy_keys(o)))
+    new = [(o.start_datetime, o.end_datetime, position, _occupancy_keys(o)) for position, o in enumerate(candidates)]
+
+    conflicts = {}
+    _sweep(existing + new, conflicts, between_candidates=False)
+    _sweep([interval for interval in new if interval[2] not in conflicts], conflicts, between_candidates=True)
+    return conflicts
+
+
+def _sweep(intervals: list, conflicts: Dict[int, str], between_candidates: bool):
+    """
+    Finds the overlapping intervals holding the same resource, in a single pass over the intervals sorted by start
+
+    :param intervals: The (start, end, candidate position, resource keys) tuples. The position is None for the
+    existing occupancies, which are never rejected.
+    :param conflicts: The conflicts found so far, updated in place
+    :param between_candidates: Whether to check the candidates against each other (the one starting first is kept),
+    or against the existing occupancies
+    """
+    intervals.sort(key=lambda interval: (interval[0], interval[2] is not None, interval[2] or 0))
+    active = defaultdict(list)
+    for start_datetime, end_datetime, position, (held, checked) in intervals:
+        for key in checked:
+            active[key] = [(end, other) for end, other in active[key]
+                           if end > start_datetime and other not in conflicts]
+            for _, other in active[key]:
+                if between_candidates or other is None:
+                    rejected = position
+                elif position is None:
+                    rejected = other
+                else:
+                    continue
+                if rejected is not None:
+                    conflicts.setdefault(rejected, conflict_codes[key[0]])
+            if position in conflicts:
+                break
+        else:
+            for key in held:
+                active[key].append((end_datetime, position))
+
+
+def bulk_create_occupancies(entries: list) -> Tuple[List[int], List[dict]]:
+    """
+    Creates many occupancies at once
+
+    All the ids are resolved with one query per model, and the conflicts are checked with a single sweep (see
+    `find_conflicts`) and one query for the unique keys still held by soft deleted occupancies. The valid occupancies
+    and their `INSERT` modification records are then written with `bulk_create`, in a single transaction.
+    `bulk_create` sends no signal, so the service ledger and the timeline cache are updated here.
+
+    :param entries: The occupancies to create, as received by the endpoint
+    :return: The ids of the created occupancies, and the errors of the rejected entries (with their index and code)
+    """
+    errors = []
+
+    def ids(key: str) -> set:
+        values = set()
+        for entry in entries:
+            try:
+                values.add(int(entry[key]))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return values
+
+    classrooms = Classroom.objects.in_bulk(ids('classroom_id'))
+    teachers = Teacher.objects.in_bulk(ids('teacher_id'))
+    subjects = Subject.objects.in_bulk(ids('subject_id'))
+
+    candidates = []
+    for index, entry in enumerate(entries):
+        try:
+            candidates.append((index, _parse_entry(entry, classrooms, teachers, subjects)))
+        except (KeyError, TypeError, ValueError, AttributeError, OverflowError, OSError):
+            errors.append({'index': index, 'code': 'MalformedData'})
+        except LookupError:
+            errors.append({'index': index, 'code': 'InvalidID'})
+        except ValidationError as e:
+            errors.append({'index': index, 'code': e.message})
+
+    conflicts = find_conflicts([o for _, o in candidates])
+    # Soft deleted occupancies do not conflict, but still hold their unique key
+    if candidates:
+        taken = set(Occupancy.objects.filter(
+            classroom_id__in={o.classroom_id for _, o in candidates},
+            start_datetime__in={o.start_datetime for _, o in candidates},
+        ).values_list('classroom_id', 'subject_id', 'teacher_id', 'start_datetime'))
+        for position, (_, o) in enumerate(candidates):
+            if (o.classroom_id, o.subject_id, o.teacher_id, o.start_datetime) in taken:
+                conflicts.setdefault(position, 'ClassroomAlreadyOccupied')
+    created = []
+    for position, (index, o) in enumerate(candidates):
+        if position in conflicts:
+            errors.append({'index': index, 'code': conflicts[position]})
+        else:
+            created.append(o)
+
+    with transaction.atomic():
+        Occupancy.objects.bulk_create(created)
+        if created and not connection.features.can_return_rows_from_bulk_insert:
+            # The ids are not returned by every database, but the unique constraint lets us find them back
+            keys = Occupancy.objects.filter(
+                classroom_id__in={o.classroom_id for o in created},
+                start_datetime__gte=min(o.start_datetime for o in created),
+                start_datetime__lte=max(o.start_datetime for o in created),
+            ).values_list('classroom_id', 'subject_id', 'teacher_id', 'start_datetime', 'id')
+            ids_by_key = {tuple(key): pk for *key, pk in keys}
+            for o in created:
+                o.id = ids_by_key[(o.classroom_id, o.subject_id, o.teacher_id, o.start_datetime)]
+        OccupancyModification.objects.bulk_create([
+            OccupancyModification(
+                occupancy=o,
+                modification_type='INSERT',
+                new_start_datetime=o.start_datetime,
+                new_duration=o.duration,
+            ) for o in created
+        ])
+        bulk_record_services(created)
+        transaction.on_commit(lambda: invalidate_occupancies((o, [o.start_datetime]) for o in created))
+    errors.sort(key=lambda error: error['index'])
+    return [o.id for o in created], errors
@@ -1,35 +1,211 @@
+import base64
+import binascii
+import hashlib
+import json
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
 
 DEFAULT_PAGE = 1
 
+COUNT_MODES = ['exact', 'estimate', 'none', ]
+COUNT_CACHE_TIMEOUT = 60
+
+
+def estimate_count(queryset) -> int:
+    """
+    Counts the rows of a listing cheaply, for the totals which do not have to be exact
+
+    The number of rows of a whole table is read from the PostgreSQL planner statistics. The other counts (filtered
+    listings, other databases, tables never analyzed) are exact, but cached for `COUNT_CACHE_TIMEOUT` seconds per
+    query.
+    """
+    connection = connections[queryset.db]
+    if not queryset.query.where and connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] > 0:
+            return row[0]
+    key = f'count:{queryset.model._meta.label}:{hashlib.md5(str(queryset.query).encode()).hexdigest()}'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, COUNT_CACHE_TIMEOUT)
+    return count
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Page number pagination, with a keyset (cursor) mode for deep listings
+
+    When the `cursor` query parameter is given (empty for the first page), the rows are fetched after the last row of
+    the previous page, on the ordering of the queryset completed by the primary key, instead of with an `OFFSET`.
+    The pages stay stable when rows are inserted between two requests. The `next_cursor` of the response is passed
+    back to get the next page, it is None on the last page. The `page` parameter keeps working without `cursor`.
+
+    The `count` query parameter chooses how the total is computed: `exact` (the default) counts the rows, `estimate`
+    uses `estimate_count`, and `none` skips the count (the total is None). Without an exact count, the pages are
+    sliced without checking the number of pages first.
+    """
+    cursor_query_param = 'cursor'
+    cursor_query_description = 'Position returned as `next_cursor` by the previous page, empty for the first page.'
+    count_query_param = 'count'
+    count_query_description = 'How the total is computed: `exact` (default), `estimate` or `none`.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.next_cursor = None
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        self.count_mode = request.query_params.get(self.count_query_param)
+        if self.count_mode not in COUNT_MODES:
+            self.count_mode = 'exact'
+        ordering = self.get_ordering(queryset)
+        # The primary key breaks the ties, so that the rows do not move between pages
+        queryset = queryset.order_by(*ordering)
+        if not self.cursor_mode and self.count_mode == 'exact':
+            page = super().paginate_queryset(queryset, request, view)
+            self.count = self.page.paginator.count
+            return page
+        self.count = self.get_count(queryset)
+        page_size = self.get_page_size(request)
+        if not self.cursor_mode:
+            try:
+                page_number = int(request.query_params.get(self.page_query_param, DEFAULT_PAGE))
+            except ValueError:
+                raise NotFound('Invalid page')
+            if page_number < 1:
+                raise NotFound('Invalid page')
+            rows = list(queryset[(page_number - 1) * page_size:page_number * page_size])
+            if not rows and page_number != DEFAULT_PAGE:
+                raise NotFound('Invalid page')
+            return rows
+        position = self.decode_cursor(request.query_params[self.cursor_query_param], len(ordering))
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+        page_size = self.get_page_size(request)
+        rows = list(queryset[:page_size + 1])
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_cursor = self.encode_cursor([self.get_value(rows[-1], field) for field in ordering])
+        return rows
+
+    def get_count(self, queryset):
+        """
+        Counts the rows of a listing the way the `count` query parameter asks
+        """
+        mode = getattr(self, 'count_mode', 'exact')
+        if mode == 'none':
+            return None
+        if mode == 'estimate':
+            return estimate_count(queryset)
+        return queryset.count()
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode and self.count_mode == 'exact':
+            return super().get_paginated_response(data)
+        fields = [('count', self.count)]
+        if self.cursor_mode:
+            fields.append(('next_cursor', self.next_cursor))
+        return Response(OrderedDict(fields + [('results', data)]))
+
+    def get_schema_fields(self, view):
+        import coreapi
+        import coreschema
+        return super().get_schema_fields(view) + [
+            coreapi.Field(
+                name=self.cursor_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.String(title='Cursor', description=self.cursor_query_description),
+            ),
+            coreapi.Field(
+                name=self.count_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.Enum(COUNT_MODES, title='Count', description=self.count_query_description),
+            ),
+        ]
+
+    @staticmethod
+    def get_ordering(queryset):
+        ordering = [str(field) for field in queryset.query.order_by]
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            ordering.append('pk')
+        return ordering
+
+    @staticmethod
+    def get_value(row, field: str):
+        value = row
+        for attribute in field.lstrip('-').split('__'):
+            value = getattr(value, attribute)
+        return value
+
+    @staticmethod
+    def after(ordering, position) -> Q:
+        """
+        Builds the condition selecting the rows after a position, e.g. `(a > x) OR (a = x AND b > y)` for `(a, b)`
+        """
+        conditions = []
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {f.lstrip('-'): v for f, v in zip(ordering[:i], position[:i])}
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': position[i]}))
+        return reduce(or_, conditions)
+
+    @staticmethod
+    def encode_cursor(position) -> str:
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str, length: int):
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound('Invalid cursor')
+        if not isinstance(position, list) or len(position) != length:
+            raise NotFound('Invalid cursor')
+        return position
+
 
-class StudentResultSetPagination(PageNumberPagination):
+class StudentResultSetPagination(KeysetPagination):
     page = DEFAULT_PAGE
     page_size = 10
     max_page_size = 1000
     page_query_param = 'page'
 
 
-class TeacherResultSetPagination(PageNumberPagination):
+class TeacherResultSetPagination(KeysetPagination):
     page = DEFAULT_PAGE
     page_size = 10
     max_page_size = 1000
     page_query_param = 'page'
 
 
-class ClassroomResultSetPagination(PageNumberPagination):
+class ClassroomResultSetPagination(KeysetPagination):
     page_size = 10
     max_page_size = 1000
     page_query_param = 'page'
 
 
-class ClassResultSetPagination(PageNumberPagination):
+class ClassResultSetPagination(KeysetPagination):
     page_size = 10
     max_page_size = 1000
     page_query_param = 'page'
 
 
-class SubjectResultSetPagination(PageNumberPagination):
+class SubjectResultSetPagination(KeysetPagination):
     page_size = 10
     max_page_size = 1000
     page_query_param = 'page'
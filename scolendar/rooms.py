@@ -0,0 +1,92 @@
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import date, datetime
+from itertools import accumulate
+from typing import Dict, List, Tuple
+
+from conf.conf import max_duration
+from scolendar.models import Classroom, Occupancy
+from scolendar.series import expand_series
+from scolendar.timeline_cache import ROOM_INDEX_SCOPE, get_week_events, week_bounds, weeks_between
+
+# The busy intervals of each classroom starting during a week, as timestamps: their sorted starts, and the latest end
+# reached by the intervals up to each of them
+RoomWeek = Dict[int, Tuple[List[int], List[int]]]
+
+
+def load_room_week(monday: date) -> list:
+    """
+    Computes the busy intervals of all the classrooms for one week, with a single query for the occupancies
+
+    The occurrences of the series are included, and the soft deleted occupancies left out. An interval belongs to the
+    week it starts in.
+
+    :return: The (classroom id, starts, reaches) entries of the week, see `RoomWeek`
+    """
+    start, end = week_bounds(monday)
+    intervals = defaultdict(list)
+    rows = Occupancy.objects.filter(deleted=False, start_datetime__gte=start, start_datetime__lt=end) \
+        .values_list('classroom_id', 'start_datetime', 'end_datetime')
+    for classroom_id, start_datetime, end_datetime in rows.iterator():
+        intervals[classroom_id].append((int(start_datetime.timestamp()), int(end_datetime.timestamp())))
+    for o in expand_series(start, end):
+        if o.start_datetime >= start:
+            intervals[o.classroom_id].append((int(o.start_datetime.timestamp()), int(o.end_datetime.timestamp())))
+    entries = []
+    for classroom_id, pairs in sorted(intervals.items()):
+        pairs.sort()
+        entries.append((classroom_id, [s for s, _ in pairs], list(accumulate((e for _, e in pairs), max))))
+    return entries
+
+
+def room_weeks(start: datetime, end: datetime) -> List[RoomWeek]:
+    """
+    Gets the room index of the weeks whose intervals may overlap a time window, from the timeline cache
+
+    The index of a week is dropped along with the cached timelines whenever an occupancy or a series changes (see
+    `timeline_cache.resource_scopes`), and loaded again in bulk on the next search.
+    """
+    # An occupancy starting in the previous week may still be running, see Occupancy.clean for the max duration
+    mondays = weeks_between(start - max_duration(), end)
+    return [
+        {classroom_id: (starts, reaches) for classroom_id, starts, reaches in
+         get_week_events(*ROOM_INDEX_SCOPE, monday, lambda monday=monday: load_room_week(monday))}
+        for monday in mondays
+    ]
+
+
+def is_free(weeks: List[RoomWeek], classroom_id: int, start: int, end: int) -> bool:
+    """
+    Checks that a classroom is not occupied during a time interval, with a binary search in each week
+
+    :param weeks: The room index, see `room_weeks`
+    :param classroom_id: The id of the classroom
+    :param start: Start timestamp of the interval
+    :param end: End timestamp of the interval
+    """
+    for week in weeks:
+        intervals = week.get(classroom_id)
+        if intervals is None:
+            continue
+        starts, reaches = intervals
+        # The intervals starting before the end are all the ones which can overlap, the last reach is where they end
+        i = bisect_left(starts, end)
+        if i and reaches[i - 1] > start:
+            return False
+    return True
+
+
+def free_classrooms(start: datetime, end: datetime, capacity: int = 0) -> List[Classroom]:
+    """
+    Finds the classrooms which are free during a time interval and can hold a number of people
+
+    :param start: Start of the interval
+    :param end: End of the interval
+    :param capacity: The number of people to hold
+    :return: The classrooms, the ones fitting the number of people the most tightly first
+    """
+    weeks = room_weeks(start, end)
+    start_timestamp, end_timestamp = int(start.timestamp()), int(end.timestamp())
+    classrooms = Classroom.objects.filter(capacity__gte=capacity).only('id', 'name', 'capacity') \
+        .order_by('capacity', 'name')
+    return [c for c in classrooms if is_free(weeks, c.id, start_timestamp, end_timestamp)]
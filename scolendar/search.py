@@ -0,0 +1,262 @@
+import json
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Set
+
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connections, models, transaction
+from django.db.models import Case, DecimalField, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+from django.utils.translation import gettext as _
+
+# Decimals of the ranks. They are rounded the same way on every database and returned as double precision floats,
+# so that a rank read back from a pagination cursor compares equal to the rank of its row.
+RANK_DIGITS = 3
+
+
+def normalize(text: str) -> str:
+    """
+    Lowercases a text and strips its accents, the way the search column is stored
+    """
+    decomposed = unicodedata.normalize('NFKD', str(text or ''))
+    return ' '.join(''.join(c for c in decomposed if not unicodedata.combining(c)).lower().split())
+
+
+def trigrams(text: str) -> Set[str]:
+    """
+    Gets the trigrams of a normalized text, the same way as PostgreSQL's `pg_trgm`
+
+    Each word is padded with two spaces before and one after.
+    """
+    result = set()
+    for word in ''.join(c if c.isalnum() else ' ' for c in text).split():
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+class SearchableModel(models.Model):
+    """
+    Keeps an unaccented, lowercased copy of the searched columns of a model, updated on save
+
+    The subclasses list their searched values in `search_values`. Rows written without `save` (bulk inserts and
+    updates) have to call `refresh_search_text` themselves.
+    """
+    search_text = models.TextField(verbose_name=_('Texte de recherche'), default='', editable=False)
+
+    def search_values(self) -> List[str]:
+        raise NotImplementedError
+
+    def refresh_search_text(self) -> str:
+        self.search_text = normalize(' '.join(str(v) for v in self.search_values() if v))
+        return self.search_text
+
+    def save(self, *args, **kwargs):
+        self.refresh_search_text()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'search_text' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'search_text']
+        return super().save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+
+
+class NgramIndex:
+    """
+    In-process inverted index of the trigrams of the search column of a model, for the databases without `pg_trgm`
+
+    The index is loaded with a single query on the first search, then kept up to date by the signals of this process
+    when their transaction commits (see `index_objects` and `unindex_objects`). Rows written by another process are
+    only found once it is reloaded.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._texts = None
+        self._postings = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _substrings(text: str) -> Set[str]:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def _load(self):
+        self._texts = {}
+        self._postings = {}
+        for pk, text in self.model._default_manager.values_list('pk', 'search_text').iterator():
+            self._add(pk, text)
+
+    def _add(self, pk: int, text: str):
+        self._texts[pk] = text
+        for substring in self._substrings(text):
+            self._postings.setdefault(substring, set()).add(pk)
+
+    def _remove(self, pk: int):
+        text = self._texts.pop(pk, None)
+        if text is None:
+            return
+        for substring in self._substrings(text):
+            postings = self._postings.get(substring)
+            postings.discard(pk)
+            if not postings:
+                del self._postings[substring]
+
+    def update(self, pk: int, text: str):
+        with self._lock:
+            if self._texts is not None:
+                self._remove(pk)
+                self._add(pk, text)
+
+    def remove(self, pk: int):
+        with self._lock:
+            if self._texts is not None:
+                self._remove(pk)
+
+    def reload(self):
+        with self._lock:
+            self._texts = None
+
+    def search(self, terms: List[str]) -> Dict[int, float]:
+        """
+        Finds the rows whose search column contains every term
+
+        :return: The rank of every matching row, by primary key
+        """
+        with self._lock:
+            if self._texts is None:
+                self._load()
+            candidates = None
+            for term in terms:
+                for substring in self._substrings(term):
+                    postings = self._postings.get(substring, set())
+                    candidates = set(postings) if candidates is None else candidates & postings
+            if candidates is None:
+                # Every term is shorter than a trigram
+                candidates = self._texts.keys()
+            texts = {pk: self._texts[pk] for pk in candidates if all(term in self._texts[pk] for term in terms)}
+        query = trigrams(' '.join(terms))
+        return {pk: similarity(query, trigrams(text)) for pk, text in texts.items()}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _uses_trigram_index(model) -> bool:
+    return connections[model.objects.db].vendor == 'postgresql'
+
+
+def ngram_index(model) -> NgramIndex:
+    with _indexes_lock:
+        if model not in _indexes:
+            _indexes[model] = NgramIndex(model)
+        return _indexes[model]
+
+
+def index_objects(objects: Iterable[SearchableModel]):
+    """
+    Updates the in-process index after rows were saved, or bulk written with their `search_text` set
+
+    The index is updated once the current transaction commits, so that the rows of a rolled back one are never found.
+    """
+    entries = [(type(obj), obj.pk, obj.search_text) for obj in objects if not _uses_trigram_index(type(obj))]
+
+    def update():
+        for model, pk, text in entries:
+            ngram_index(model).update(pk, text)
+
+    if entries:
+        transaction.on_commit(update)
+
+
+def unindex_objects(objects: Iterable[SearchableModel]):
+    entries = [(type(obj), obj.pk) for obj in objects if not _uses_trigram_index(type(obj))]
+
+    def remove():
+        for model, pk in entries:
+            ngram_index(model).remove(pk)
+
+    if entries:
+        transaction.on_commit(remove)
+
+
+def _keys(queryset, pks: List[int]):
+    """
+    Gets the right-hand side of a `pk__in` lookup on many primary keys
+
+    SQLite limits the number of parameters of a query, so the keys are passed there as a single JSON array.
+    """
+    if connections[queryset.db].vendor != 'sqlite':
+        return pks
+    return RawSQL('SELECT value FROM json_each(%s)', [json.dumps(pks)])
+
+
+def search(queryset, query: str):
+    """
+    Filters a queryset of a searchable model by a query, and annotates the similarity of each row as `search_rank`
+
+    A row matches when its search column contains every word of the query, regardless of case and accents. On
+    PostgreSQL, the containment is answered by the `pg_trgm` GIN index of the column and ranked with
+    `similarity()`. Elsewhere, the in-process `NgramIndex` finds and ranks the rows, and all of them are returned, so
+    that the pagination reaches every match.
+
+    :param queryset: The rows to search, of a `SearchableModel`
+    :param query: The search entered by the user
+    """
+    terms = normalize(query).split()
+    if not terms:
+        return queryset.annotate(search_rank=Value(0., output_field=FloatField()))
+    if _uses_trigram_index(queryset.model):
+        for term in terms:
+            queryset = queryset.filter(search_text__contains=term)
+        # similarity() is a single precision float, which a double precision cursor would not match exactly
+        rank = Cast(TrigramSimilarity('search_text', ' '.join(terms)),
+                    DecimalField(max_digits=RANK_DIGITS + 1, decimal_places=RANK_DIGITS))
+        return queryset.annotate(search_rank=Cast(rank, FloatField()))
+    ranks = ngram_index(queryset.model).search(terms)
+    if not ranks:
+        return queryset.none().annotate(search_rank=Value(0., output_field=FloatField()))
+    # Rows sharing a rank are grouped, to keep the query short
+    buckets = {}
+    for pk, rank in ranks.items():
+        buckets.setdefault(round(rank, RANK_DIGITS), []).append(pk)
+    return queryset.filter(pk__in=_keys(queryset, list(ranks))).annotate(search_rank=Case(
+        *[When(Q(pk__in=_keys(queryset, pks)), then=Value(rank)) for rank, pks in buckets.items()],
+        default=Value(0.),
+        output_field=FloatField(),
+    ))
+
+
+def install_search_indexes(sender, using='default', **kwargs):
+    """
+    Fills the search column of the rows which do not have it yet, and creates the trigram GIN indexes on PostgreSQL
+
+    Connected to `post_migrate`, as the migrations are generated when the application is deployed.
+    """
+    searchable = [model for model in sender.get_models() if issubclass(model, SearchableModel)]
+    for model in searchable:
+        stale = []
+        for obj in model._default_manager.using(using).filter(search_text=''):
+            if obj.refresh_search_text():
+                stale.append(obj)
+        model._default_manager.using(using).bulk_update(stale, ['search_text'], batch_size=500)
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for model in searchable:
+            table = model._meta.db_table
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {connection.ops.quote_name(f"{table}_search_trgm")} ON '
+                f'{connection.ops.quote_name(table)} USING gin (search_text gin_trgm_ops)'
+            )
@@ -1,12 +1,10 @@
-import random
-import string
 from datetime import datetime
 
 from django.conf import settings
 from pytz import timezone
 from rest_framework import serializers
 
-from conf.auth import MIN_PASSWORD_LENGTH
+from scolendar.accounts import prepare_accounts
 from scolendar.models import Student, Class, Teacher, Classroom, Occupancy, Subject, TeacherSubject
 
 
@@ -33,9 +31,7 @@ class TeacherCreationSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         ret = super().to_representation(instance)
-        ret['password'] = ''.join(
-            random.SystemRandom().choice(string.ascii_uppercase + string.ascii_lowercase + string.digits) for _ in
-            range(MIN_PASSWORD_LENGTH))
+        ret['password'] = getattr(self, 'initial_password', None)
         return ret
 
     def save(self, **kwargs):
@@ -53,8 +49,6 @@ class TeacherCreationSerializer(serializers.ModelSerializer):
         dt = datetime.now(tz=timezone(settings.TIME_ZONE))
         dt_str = dt.strftime("%y%j%H%S")
         username = f"{self.validated_data['last_name'][0].lower()}{dt_str}"
-        password = self.data['password']
-
         teacher = Teacher(
             email=email,
             username=username,
@@ -64,7 +58,7 @@ class TeacherCreationSerializer(serializers.ModelSerializer):
             last_name=last_name,
         )
 
-        teacher.set_password(password)
+        self.initial_password, = prepare_accounts([teacher])
         teacher.save()
 
         return teacher
@@ -166,9 +160,7 @@ class StudentCreationSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         ret = super().to_representation(instance)
-        ret['password'] = ''.join(
-            random.SystemRandom().choice(string.ascii_uppercase + string.ascii_lowercase + string.digits) for _ in
-            range(MIN_PASSWORD_LENGTH))
+        ret['password'] = getattr(self, 'initial_password', None)
         return ret
 
     def save(self, **kwargs):
@@ -177,13 +169,11 @@ class StudentCreationSerializer(serializers.ModelSerializer):
         dt = datetime.now(tz=timezone(settings.TIME_ZONE))
         dt_str = dt.strftime("%y%j%H%S")
         username = f"{self.validated_data['last_name'][0].lower()}{dt_str}"
-        password = self.data['password']
-
         _class = Class.objects.get(id=self.validated_data['class_id'])
 
         student = Student(email=email, username=username, _class=_class)
 
-        student.set_password(password)
+        self.initial_password, = prepare_accounts([student])
         student.save()
 
         return student
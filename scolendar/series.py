@@ -0,0 +1,160 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.utils.timezone import localtime
+from ics.grammar.parse import ContentLine
+from ics.utils import timedelta_to_duration
+from pytz import timezone, utc
+from recurrence import Recurrence, serialize
+
+from conf.conf import max_duration
+from scolendar.models import Occupancy, OccupancySeries
+
+
+def expand_series(start: Optional[datetime] = None, end: Optional[datetime] = None, *args,
+                  exclude_occurrence: Optional[Tuple[int, datetime]] = None, **filters) -> List[Occupancy]:
+    """
+    Expands the occupancy series overlapping a time window into their occurrences
+
+    Only the series overlapping the window are fetched, and only the occurrences inside the window are generated. The
+    occurrences replaced by an overriding occupancy (deleted or not) are skipped, the override being stored as a
+    regular occupancy.
+
+    :param start: Only keep the occurrences ending after this datetime
+    :param end: Only keep the occurrences starting before this datetime
+    :param args: Q objects restricting the series
+    :param exclude_occurrence: The series id and start datetime of an additional occurrence to skip
+    :param filters: Lookups restricting the series to a resource (teacher, classroom, subject, ...)
+    :return: The occurrences, as unsaved occupancies sorted by start datetime
+    """
+    series = OccupancySeries.objects.filter(*args, deleted=False, **filters)
+    if start:
+        series = series.filter(end_datetime__gt=start)
+    if end:
+        series = series.filter(start_datetime__lt=end)
+    series = list(series.select_related('subject___class', 'teacher', 'classroom'))
+    if not series:
+        return []
+
+    overrides = Occupancy.objects.filter(series__in=series)
+    if start:
+        overrides = overrides.filter(series_start__gt=start - max_duration())
+    if end:
+        overrides = overrides.filter(series_start__lt=end)
+    overridden = set(overrides.values_list('series_id', 'series_start'))
+    if exclude_occurrence:
+        overridden.add(exclude_occurrence)
+
+    occurrences = []
+    for s in series:
+        for occurrence_start in s.occurrence_starts(start - s.duration if start else None, end):
+            if (s.id, occurrence_start) in overridden:
+                continue
+            if start and occurrence_start + s.duration <= start:
+                continue
+            occurrences.append(Occupancy(
+                series=s,
+                series_start=occurrence_start,
+                classroom=s.classroom,
+                group_number=s.group_number,
+                subject=s.subject,
+                teacher=s.teacher,
+                start_datetime=occurrence_start,
+                duration=s.duration,
+                end_datetime=occurrence_start + s.duration,
+                occupancy_type=s.occupancy_type,
+                name=s.name,
+                description=s.description,
+            ))
+    occurrences.sort(key=lambda o: o.start_datetime)
+    return occurrences
+
+
+def series_uid(series_id: int) -> str:
+    return f'series-{series_id}@scolendar'
+
+
+def occupancy_uid(occupancy_id: int) -> str:
+    return f'occupancy-{occupancy_id}@scolendar'
+
+
+def ical_datetime_line(name: str, dt: datetime) -> ContentLine:
+    """
+    Builds an iCal property holding a local datetime
+
+    Recurring events are described in local time, so that their occurrences keep the same local time across daylight
+    saving time changes.
+    """
+    return ContentLine(name, params={'TZID': [settings.TIME_ZONE]},
+                       value=localtime(dt, timezone(settings.TIME_ZONE)).strftime('%Y%m%dT%H%M%S'))
+
+
+def _ical_offset(offset: timedelta) -> str:
+    minutes = int(offset.total_seconds()) // 60
+    return f'{"-" if minutes < 0 else "+"}{abs(minutes) // 60:02}{abs(minutes) % 60:02}'
+
+
+def ical_timezone(start: datetime, end: datetime) -> str:
+    """
+    Builds the VTIMEZONE of the application timezone, which the TZID of the local datetimes refers to
+
+    The transitions of the tz database between the two datetimes are listed one by one, along with the last one before
+    the start.
+
+    :param start: The earliest datetime the calendar shows
+    :param end: The latest datetime the calendar shows
+    :return: The VTIMEZONE component
+    """
+    tz = timezone(settings.TIME_ZONE)
+    lines = ['BEGIN:VTIMEZONE', f'TZID:{settings.TIME_ZONE}']
+    transitions = getattr(tz, '_utc_transition_times', None)
+    if not transitions:
+        # A fixed offset
+        offset = _ical_offset(tz.utcoffset(start.replace(tzinfo=None)))
+        lines += ['BEGIN:STANDARD', 'DTSTART:19700101T000000', f'TZOFFSETFROM:{offset}', f'TZOFFSETTO:{offset}',
+                  f'TZNAME:{tz.tzname(start.replace(tzinfo=None))}', 'END:STANDARD']
+    else:
+        start = start.astimezone(utc).replace(tzinfo=None)
+        end = end.astimezone(utc).replace(tzinfo=None)
+        first = max(bisect_right(transitions, start) - 1, 1)
+        for i in range(first, len(transitions)):
+            if transitions[i] > end:
+                break
+            previous_offset = tz._transition_info[i - 1][0]
+            offset, dst, name = tz._transition_info[i]
+            component = 'DAYLIGHT' if dst else 'STANDARD'
+            lines += [
+                f'BEGIN:{component}',
+                # The transition is given in the local time in use before it
+                f'DTSTART:{(transitions[i] + previous_offset).strftime("%Y%m%dT%H%M%S")}',
+                f'TZOFFSETFROM:{_ical_offset(previous_offset)}',
+                f'TZOFFSETTO:{_ical_offset(offset)}',
+                f'TZNAME:{name}',
+                f'END:{component}',
+            ]
+    lines.append('END:VTIMEZONE')
+    return '\r\n'.join(lines)
+
+
+def series_ical_lines(series: OccupancySeries, cancelled: Iterable[datetime] = ()) -> List[ContentLine]:
+    """
+    Builds the iCal properties describing the recurrence of a series, for a native recurring VEVENT
+
+    :param series: The series to describe
+    :param cancelled: The start datetimes of the occurrences cancelled by a deleted override
+    :return: The DTSTART, DURATION, RRULE, EXRULE, RDATE and EXDATE properties
+    """
+    lines = [
+        ical_datetime_line('DTSTART', series.start_datetime),
+        ContentLine('DURATION', value=timedelta_to_duration(series.duration)),
+    ]
+    rules = Recurrence(rrules=series.recurrences.rrules, exrules=series.recurrences.exrules)
+    for line in serialize(rules).splitlines():
+        name, value = line.split(':', 1)
+        lines.append(ContentLine(name, value=value))
+    lines += [ical_datetime_line('RDATE', rdate) for rdate in series.recurrences.rdates]
+    lines += [ical_datetime_line('EXDATE', exdate) for exdate in series.recurrences.exdates]
+    lines += [ical_datetime_line('EXDATE', start) for start in cancelled]
+    return lines
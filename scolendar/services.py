@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from django.db.models import Q, Sum
+
+from conf.conf import get_service_coefficients
+from scolendar.models import Teacher, TeacherServiceLedger, occupancy_list
+
+occupancy_types = {
+    'CM': 'cm',
+    'TD': 'td',
+    'TP': 'tp',
+    'PROJ': 'projet',
+    'ADM': 'administration',
+    'EXT': 'external',
+}
+
+
+def weighted_total(entries: Iterable[dict], coefficients: Dict[str, float]) -> float:
+    """
+    Weights the hours of service entries by the coefficient of their occupancy type
+
+    The types without a coefficient (e.g. `EXT`) do not count in the total.
+
+    :param entries: Service entries, with the hours of each occupancy type under its `occupancy_types` name
+    :param coefficients: The coefficients of the occupancy types, see `get_service_coefficients`
+    """
+    return sum((entry[occupancy_types[t]] * coefficient
+                for entry in entries for t, coefficient in coefficients.items() if t in occupancy_types), 0.)
+
+
+def teacher_services(teacher_ids: Optional[Iterable[int]] = None) -> Dict[int, List[dict]]:
+    """
+    Gets the service hours of teachers, per class and occupancy type, with a single grouped query
+
+    The hours are read from the service ledger (see `scolendar.ledger`), which holds the durations of the occupancies
+    (soft deleted ones excepted) and of the occurrences of the series already summed per week. They are summed again
+    in the database, one conditional sum per occupancy type, for each (teacher, class) pair.
+
+    :param teacher_ids: The teachers to compute the services of, all of them when None
+    :return: The service entries of each teacher who has occupancies, sorted by class name
+    """
+    ledger = TeacherServiceLedger.objects.all()
+    if teacher_ids is not None:
+        ledger = ledger.filter(teacher_id__in=list(teacher_ids))
+    rows = ledger.values('teacher_id', 'subject___class__name').annotate(**{
+        occupancy_types[t]: Sum('seconds', filter=Q(occupancy_type=t)) for t in occupancy_list
+    }).order_by('teacher_id', 'subject___class__name')
+    services = {}
+    for row in rows:
+        entry = OrderedDict([('class', row['subject___class__name'])])
+        for t in occupancy_list:
+            entry[occupancy_types[t]] = (row[occupancy_types[t]] or 0) / 3600.
+        services.setdefault(row['teacher_id'], []).append(entry)
+    return services
+
+
+def teacher_service(teacher_id: int) -> dict:
+    """
+    Gets the service of a teacher
+
+    :return: The weighted total (`total_services`) and the entries per class (`services`) of the teacher
+    """
+    services = teacher_services([teacher_id]).get(teacher_id, [])
+    return {'total_services': weighted_total(services, get_service_coefficients()), 'services': services}
+
+
+def service_report() -> List[dict]:
+    """
+    Gets the service of every teacher of the department, sorted by name, with two queries
+
+    The teachers without any occupancy are listed with an empty service.
+    """
+    services = teacher_services()
+    coefficients = get_service_coefficients()
+    return [{
+        'id': teacher['id'],
+        'first_name': teacher['first_name'],
+        'last_name': teacher['last_name'],
+        'rank': teacher['rank'],
+        'total_services': weighted_total(services.get(teacher['id'], []), coefficients),
+        'services': services.get(teacher['id'], []),
+    } for teacher in Teacher.objects.order_by('last_name', 'first_name', 'id').values(
+        'id', 'first_name', 'last_name', 'rank')]
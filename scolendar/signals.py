@@ -1,8 +1,21 @@
-from django.db import IntegrityError
-from django.db.models.signals import post_save, post_delete
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
 
-from .models import Student, StudentClassTemp, Subject, StudentSubject
+from .models import Student, StudentClassTemp, Subject, StudentSubject, OccupancyModification, OccupancySeries, \
+    Occupancy, Teacher, Class, Classroom
+from . import ical
+from .groups import schedule_group_reorganization
+from .ledger import refresh_ledger, series_ledger_keys, update_ledger
+from .membership import refresh_memberships
+from .search import index_objects, unindex_objects
+from .timeline_cache import displayed_values_changed, invalidate_all, invalidate_occupancies, invalidate_scopes, \
+    series_scopes
+from .tokens import token_cache
+
+User = get_user_model()
 
 
 @receiver(post_save, sender=Student)
@@ -28,33 +41,150 @@ def attribute_group_to_student(instance, created=False, **kwargs):
                     student=instance,
                 )
                 student_subject.save()
-                from scolendar.groups import attribute_student_groups
-                attribute_student_groups(subject)
             except IntegrityError:
                 continue
     return instance
 
 
-@receiver(post_delete, sender=Student)
 @receiver(post_delete, sender=StudentSubject)
 def student_group_reorganization(sender, instance, **kwargs):
-    if sender is Student:
-        subjects = Subject.objects.filter(_class=instance._class)
-    elif sender is StudentSubject:
-        subjects = Subject.objects.filter(id=instance.id)
-    else:
-        return instance
-    for s in subjects:
-        from scolendar.groups import attribute_student_groups
-        attribute_student_groups(s)
+    # Deleting a student deletes its enrolments, which reorganizes exactly the subjects it was in
+    schedule_group_reorganization([instance.subject_id])
     return instance
 
 
 @receiver(post_save, sender=StudentSubject)
 def student_group_reorganization_on_student_subject(instance, created=False, **kwargs):
     if created:
-        subjects = Subject.objects.filter(id=instance.id)
-        for s in subjects:
-            from scolendar.groups import attribute_student_groups
-            attribute_student_groups(s)
+        schedule_group_reorganization([instance.subject_id])
+    return instance
+
+
+@receiver(post_save, sender=OccupancyModification)
+def occupancy_modification_cache_invalidation(instance, created=False, **kwargs):
+    if created:
+        occupancy = instance.occupancy
+        datetimes = [instance.previous_start_datetime, instance.new_start_datetime, occupancy.series_start]
+        changes = [(occupancy, datetimes)]
+        previous_instance = getattr(occupancy, 'previous_instance', None)
+        if previous_instance:
+            changes.append((previous_instance, datetimes + [previous_instance.series_start]))
+        transaction.on_commit(lambda: invalidate_occupancies(changes))
+        occupancy_ids = [occupancy.id]
+        series_ids = [o.series_id for o, _ in changes]
+        transaction.on_commit(lambda: ical.invalidate(occupancy_ids, series_ids))
+    return instance
+
+
+@receiver(post_delete, sender=Occupancy)
+def occupancy_deletion_cache_invalidation(instance, **kwargs):
+    # Hard deletions leave no modification behind. The subject is loaded right away, as it may be deleted too.
+    if instance.subject:
+        ical.touch_feeds(ical.feed_scopes(instance.teacher_id, instance.subject._class_id))
+        changes = [(instance, [instance.start_datetime, instance.series_start])]
+        transaction.on_commit(lambda: invalidate_occupancies(changes))
+        occupancy_ids, series_ids = [instance.id], [instance.series_id]
+        transaction.on_commit(lambda: ical.invalidate(occupancy_ids, series_ids))
+    return instance
+
+
+@receiver(post_delete, sender=Occupancy)
+def occupancy_deletion_ledger_update(instance, **kwargs):
+    # Soft deletions go through Occupancy.save, hard ones are removed from the service ledger here
+    update_ledger(instance, None)
+    return instance
+
+
+@receiver(pre_delete, sender=OccupancySeries)
+def series_deletion_ledger_keys(instance, **kwargs):
+    # Listed before the deletion, as the occurrences can not be expanded afterwards
+    instance.ledger_keys = series_ledger_keys(instance)
+    return instance
+
+
+@receiver(post_delete, sender=OccupancySeries)
+def series_deletion_ledger_update(instance, **kwargs):
+    # The overrides deleted along with the series brought their occurrences back, they are all recomputed here
+    refresh_ledger(getattr(instance, 'ledger_keys', ()))
+    return instance
+
+
+@receiver(pre_save, sender=OccupancySeries)
+@receiver(post_save, sender=OccupancySeries)
+@receiver(post_delete, sender=OccupancySeries)
+def series_cache_invalidation(sender, instance, **kwargs):
+    if kwargs.get('signal') is pre_save:
+        # The series may be moved to another classroom, teacher or subject
+        try:
+            instance = OccupancySeries.objects.get(id=instance.id)
+        except OccupancySeries.DoesNotExist:
+            return instance
+    # The scopes are listed right away, as the subject may be deleted along with the series
+    scopes = series_scopes(instance)
+    if kwargs.get('signal') is post_delete:
+        ical.touch_feeds(ical.feed_scopes(instance.teacher_id, instance.subject._class_id))
+    transaction.on_commit(lambda: invalidate_scopes(scopes))
+    series_ids = [instance.id]
+    transaction.on_commit(lambda: ical.invalidate(series_ids=series_ids))
+    return instance
+
+
+@receiver(post_save, sender=StudentSubject)
+@receiver(post_delete, sender=StudentSubject)
+def timeline_cache_student_invalidation(instance, **kwargs):
+    student_id = instance.student_id
+    transaction.on_commit(lambda: refresh_memberships([student_id]))
+    transaction.on_commit(lambda: invalidate_scopes([('student', student_id)]))
+    return instance
+
+
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=Teacher)
+@receiver(pre_save, sender=Subject)
+@receiver(pre_save, sender=Class)
+@receiver(pre_save, sender=Classroom)
+def timeline_cache_name_invalidation(instance, update_fields=None, **kwargs):
+    # The cached events and iCal fragments hold the names of their teacher, subject, class and classroom
+    if displayed_values_changed(instance, update_fields):
+        ical.touch_feeds([ical.ALL_FEEDS])
+        transaction.on_commit(invalidate_all)
+    return instance
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Student)
+@receiver(post_save, sender=Teacher)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Student)
+@receiver(post_delete, sender=Teacher)
+def token_cache_user_invalidation(instance, **kwargs):
+    user_id = instance.id
+    transaction.on_commit(lambda: token_cache.invalidate_user(user_id))
+    return instance
+
+
+@receiver(post_delete, sender=Token)
+def token_cache_token_invalidation(instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: token_cache.invalidate(key))
+    return instance
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_save, sender=Teacher)
+@receiver(post_save, sender=Class)
+@receiver(post_save, sender=Classroom)
+@receiver(post_save, sender=Subject)
+def search_index_update(instance, **kwargs):
+    index_objects([instance])
+    return instance
+
+
+@receiver(post_delete, sender=Student)
+@receiver(post_delete, sender=Teacher)
+@receiver(post_delete, sender=Class)
+@receiver(post_delete, sender=Classroom)
+@receiver(post_delete, sender=Subject)
+def search_index_removal(instance, **kwargs):
+    unindex_objects([instance])
     return instance
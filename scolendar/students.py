@@ -0,0 +1,216 @@
+import codecs
+import csv
+import json
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+
+from scolendar.accounts import bulk_insert_users, credentials, prepare_accounts
+from scolendar.groups import deferred_group_reorganization, schedule_group_reorganization
+from scolendar.models import Class, Student, StudentClassTemp, StudentSubject, Subject
+
+User = get_user_model()
+
+IMPORT_CHUNK_SIZE = 500
+READ_SIZE = 64 * 1024
+
+
+class MalformedImport(ValueError):
+    """
+    Raised when the body of an import turns out to be malformed, with the result of the rows read before the error
+    """
+
+    def __init__(self, created: List[dict], skipped: List[int], failed: List[dict]):
+        super().__init__('Malformed import')
+        self.created, self.skipped, self.failed = created, skipped, failed
+
+
+def iter_csv_rows(stream) -> Iterator[dict]:
+    """
+    Reads the students of a CSV file line by line
+
+    The first line holds the column names (`first_name`, `last_name`, `class_id` and optionally `username`, `email` and
+    `password`).
+    """
+    return csv.DictReader(codecs.iterdecode(iter(stream.readline, b''), 'utf-8-sig'))
+
+
+def iter_json_rows(stream) -> Iterator:
+    """
+    Reads the items of a JSON array chunk by chunk, without loading the whole array
+
+    :raise ValueError: if the stream is not a JSON array
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n' + (',' if started else ''):
+            position += 1
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('Expected a JSON array')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The item is cut by the end of the chunk, or malformed
+                if eof:
+                    raise ValueError('Malformed JSON array')
+            else:
+                yield item
+                position = end
+                continue
+        if eof:
+            raise ValueError('Unterminated JSON array')
+        chunk = stream.read(READ_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + text_decoder.decode(chunk, final=eof)
+        position = 0
+
+
+def _username(first_name: str, last_name: str) -> str:
+    return f'{first_name.lower().replace(" ", "")}.{last_name.lower().replace(" ", "")}'
+
+
+def _parse_row(row, classes: dict) -> Tuple[Student, Optional[str]]:
+    """
+    Builds an unsaved student from a row of the import
+
+    :return: The student, and the password chosen in the row (None to generate one)
+    :raise ValidationError: if the row is invalid, with the error code as message
+    """
+    if not isinstance(row, dict):
+        raise ValidationError('MalformedData')
+    first_name = str(row.get('first_name') or '').strip()
+    last_name = str(row.get('last_name') or '').strip()
+    if not first_name or not last_name:
+        raise ValidationError('MalformedData')
+    try:
+        _class = classes.get(int(row.get('class_id')))
+    except (TypeError, ValueError):
+        raise ValidationError('MalformedData')
+    if _class is None:
+        raise ValidationError('InvalidID')
+    student = Student(
+        username=str(row.get('username') or _username(first_name, last_name)),
+        email=str(row.get('email') or f'{first_name}{last_name}@etu.univ-amu.fr'),
+        first_name=first_name,
+        last_name=last_name,
+        _class=_class,
+    )
+    password = row.get('password') or None
+    if password:
+        try:
+            validate_password(password, student)
+        except ValidationError:
+            raise ValidationError('PasswordTooSimple')
+    return student, password
+
+
+def _create_chunk(students: List[Student], passwords: List[Optional[str]], subjects_by_class: dict) -> List[dict]:
+    """
+    Writes a chunk of students with a few bulk queries, in a single transaction
+
+    A student is made of a user row, a student row, its class membership and its enrolment in every subject of its
+    class. The passwords are hashed in parallel beforehand (see `prepare_accounts`).
+
+    :return: The initial credentials of the students
+    """
+    passwords = prepare_accounts(students, passwords)
+    with transaction.atomic():
+        bulk_insert_users(students)
+        User.groups.through.objects.bulk_create([
+            User.groups.through(user_id=student.id, group_id=student._class_id) for student in students
+        ])
+        # Student.save leaves this row behind, the next save of the student expects it
+        StudentClassTemp.objects.bulk_create([
+            StudentClassTemp(student_id=student.id, class_to_remove=None, class_to_add_id=student._class_id)
+            for student in students
+        ])
+        StudentSubject.objects.bulk_create([
+            StudentSubject(student_id=student.id, subject_id=subject_id)
+            for student in students for subject_id in subjects_by_class.get(student._class_id, [])
+        ], batch_size=IMPORT_CHUNK_SIZE)
+    return credentials(students, passwords)
+
+
+def import_students(rows: Iterable) -> Tuple[List[dict], List[int], List[dict]]:
+    """
+    Creates many students at once, reading the rows chunk by chunk
+
+    The classes and their subjects are fetched once. Each chunk is checked against the existing usernames with one
+    query, then written with `bulk_create` (see `_create_chunk`). The groups of every affected subject are distributed
+    once, at the end of the import.
+
+    Each chunk is committed on its own. A chunk failing in the database is rolled back and its rows are reported with
+    the `Unknown` code, the next chunks are still imported.
+
+    :param rows: The students to create, as dictionaries
+    :return: The credentials of the created students (id, username and initial password), the indexes of the rows
+    skipped because the username is already taken, and the errors of the failed rows (with their index and code)
+    :raise MalformedImport: if the rows can not be read to the end, the rows read before being imported
+    """
+    classes = {c.id: c for c in Class.objects.all()}
+    subjects_by_class = {}
+    for subject_id, class_id in Subject.objects.values_list('id', '_class_id'):
+        subjects_by_class.setdefault(class_id, []).append(subject_id)
+
+    created, skipped, failed = [], [], []
+    seen_usernames = set()
+    affected_classes = set()
+    rows = enumerate(rows)
+    malformed = False
+    with deferred_group_reorganization():
+        while not malformed:
+            chunk = []
+            try:
+                for item in islice(rows, IMPORT_CHUNK_SIZE):
+                    chunk.append(item)
+            except (ValueError, csv.Error):
+                malformed = True
+            if not chunk:
+                break
+            parsed = []
+            for index, row in chunk:
+                try:
+                    parsed.append((index, *_parse_row(row, classes)))
+                except ValidationError as e:
+                    failed.append({'index': index, 'code': e.message})
+            taken = set(User.objects.filter(username__in=[student.username for _, student, _ in parsed])
+                        .values_list('username', flat=True))
+            indexes, students, passwords = [], [], []
+            for index, student, password in parsed:
+                if student.username in taken or student.username in seen_usernames:
+                    skipped.append(index)
+                    continue
+                seen_usernames.add(student.username)
+                indexes.append(index)
+                students.append(student)
+                passwords.append(password)
+            if not students:
+                continue
+            try:
+                created += _create_chunk(students, passwords, subjects_by_class)
+            except DatabaseError:
+                failed += [{'index': index, 'code': 'Unknown'} for index in indexes]
+                continue
+            affected_classes.update(student._class_id for student in students)
+        schedule_group_reorganization(
+            subject_id for class_id in affected_classes for subject_id in subjects_by_class.get(class_id, [])
+        )
+    if malformed:
+        raise MalformedImport(created, skipped, failed)
+    return created, skipped, failed
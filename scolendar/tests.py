@@ -1 +1,824 @@
-# Create your tests here.
+import json
+from datetime import datetime, timedelta
+from unittest import mock
+
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date, parse_http_date
+from django.utils.timezone import make_aware
+from recurrence import Recurrence, Rule, WEEKLY
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from conf.conf import get_service_coefficients
+from scolendar import accounts, groups, students
+from scolendar.availability import busy_condition, free_slots
+from scolendar.ical import ICAL_CACHE, feed_fragments
+from scolendar.hours import group_hours, subject_hours, subject_total_hours
+from scolendar.ledger import ledger_drift, rebuild_ledger
+from scolendar.models import Class, Classroom, ICalToken, Occupancy, OccupancyModification, OccupancySeries, Student, \
+    StudentSubject, Subject, Teacher, TeacherServiceLedger
+from scolendar.occupancies import bulk_create_occupancies
+from scolendar.rooms import free_classrooms
+from scolendar.search import ngram_index, search
+from scolendar.series import expand_series
+from scolendar.timeline import get_next_occupancy
+from scolendar.timeline_cache import TIMELINE_CACHE
+from scolendar.services import service_report, teacher_service
+
+# A monday, during the opening hours
+MONDAY = make_aware(datetime(2030, 1, 7, 10))
+
+
+class ScheduleTestMixin:
+    """
+    Creates a class with a subject, two teachers and two classrooms, and helpers to schedule occupancies
+    """
+
+    def setUp(self):
+        super().setUp()
+        self._class = Class.objects.create(name='L3 Informatique', level='L3')
+        self.subject = Subject.objects.create(name='Algorithmique', _class=self._class, group_count=2)
+        self.teacher = Teacher(username='teacher', first_name='Ada', last_name='Lovelace', rank='PROF')
+        self.teacher.save()
+        self.other_teacher = Teacher(username='other', first_name='Alan', last_name='Turing', rank='PROF')
+        self.other_teacher.save()
+        self.classroom = Classroom.objects.create(name='B12', capacity=30)
+        self.other_classroom = Classroom.objects.create(name='B13', capacity=60)
+
+    def admin_client(self) -> APIClient:
+        admin = User.objects.create(username='admin', is_staff=True)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer ' + Token.objects.create(user=admin).key)
+        return client
+
+    def occupancy(self, start=MONDAY, hours=2, **kwargs) -> Occupancy:
+        fields = {
+            'classroom': self.classroom,
+            'subject': self.subject,
+            'teacher': self.teacher,
+            'name': 'Cours',
+            'occupancy_type': 'CM',
+        }
+        fields.update(kwargs)
+        o = Occupancy(start_datetime=start, duration=timedelta(hours=hours), **fields)
+        o.save()
+        return o
+
+    def series(self, count=6, start=MONDAY + timedelta(hours=4), hours=2, **kwargs) -> OccupancySeries:
+        fields = {
+            'classroom': self.classroom,
+            'subject': self.subject,
+            'teacher': self.teacher,
+            'name': 'Cours',
+            'occupancy_type': 'CM',
+        }
+        fields.update(kwargs)
+        s = OccupancySeries(start_datetime=start, duration=timedelta(hours=hours),
+                            recurrences=Recurrence(rrules=[Rule(WEEKLY, count=count)]), **fields)
+        s.save()
+        return s
+
+    def override(self, series: OccupancySeries, index: int, shift=timedelta(days=1), **kwargs) -> Occupancy:
+        series_start = series.occurrence_starts()[index]
+        fields = {'classroom': series.classroom, 'teacher': series.teacher}
+        fields.update(kwargs)
+        return self.occupancy(start=series_start + shift, hours=series.duration.total_seconds() / 3600, series=series,
+                              series_start=series_start, **fields)
+
+
+class SeriesTests(ScheduleTestMixin, TestCase):
+    def test_expansion(self):
+        s = self.series(count=6)
+        starts = s.occurrence_starts()
+        self.override(s, 1)
+        self.override(s, 2, deleted=True)
+        occurrences = expand_series(teacher=self.teacher)
+        self.assertEqual([o.start_datetime for o in occurrences], [starts[0], *starts[3:]])
+        self.assertTrue(all(o.series_id == s.id and o.duration == s.duration for o in occurrences))
+        # Only the occurrences overlapping the window are generated
+        window = expand_series(starts[3], starts[4] + timedelta(minutes=1), teacher=self.teacher)
+        self.assertEqual([o.start_datetime for o in window], starts[3:5])
+        self.assertEqual(expand_series(teacher=self.teacher, exclude_occurrence=(s.id, starts[0]))[0].start_datetime,
+                         starts[3])
+        self.assertEqual(expand_series(teacher=self.other_teacher), [])
+
+
+class LedgerTests(ScheduleTestMixin, TestCase):
+    def ledger_hours(self, teacher=None) -> float:
+        rows = TeacherServiceLedger.objects.filter(teacher=teacher or self.teacher)
+        return sum(row.seconds for row in rows) / 3600.
+
+    def test_occupancies(self):
+        o = self.occupancy()
+        self.assertEqual(self.ledger_hours(), 2.)
+        o.duration = timedelta(hours=3)
+        o.save()
+        self.assertEqual(self.ledger_hours(), 3.)
+        o.teacher = self.other_teacher
+        o.save()
+        self.assertEqual((self.ledger_hours(), self.ledger_hours(self.other_teacher)), (0., 3.))
+        o.deleted = True
+        o.save()
+        self.assertEqual(self.ledger_hours(self.other_teacher), 0.)
+        self.assertEqual(ledger_drift(), {})
+
+    def test_series(self):
+        s = self.series(count=6)
+        self.assertEqual(self.ledger_hours(), 12.)
+        s.duration = timedelta(hours=1)
+        s.save()
+        self.assertEqual(self.ledger_hours(), 6.)
+        s.deleted = True
+        s.save()
+        self.assertEqual(self.ledger_hours(), 0.)
+        self.assertEqual(ledger_drift(), {})
+
+    def test_series_overrides(self):
+        s = self.series(count=6)
+        moved = self.override(s, 0, teacher=self.other_teacher)
+        self.assertEqual((self.ledger_hours(), self.ledger_hours(self.other_teacher)), (10., 2.))
+        cancelled = self.override(s, 1, deleted=True)
+        self.assertEqual(self.ledger_hours(), 8.)
+        self.assertEqual(ledger_drift(), {})
+        cancelled.delete()
+        self.assertEqual(self.ledger_hours(), 10.)
+        moved.deleted = True
+        moved.save()
+        self.assertEqual((self.ledger_hours(), self.ledger_hours(self.other_teacher)), (10., 0.))
+        self.assertEqual(ledger_drift(), {})
+        s.delete()
+        self.assertEqual(self.ledger_hours(), 0.)
+        self.assertEqual(ledger_drift(), {})
+
+    def test_drift(self):
+        self.occupancy()
+        self.series(count=3)
+        TeacherServiceLedger.objects.all().delete()
+        drift = ledger_drift()
+        self.assertEqual(sum(expected for _, expected in drift.values()) / 3600., 8.)
+        self.assertEqual(rebuild_ledger(), drift)
+        self.assertEqual(ledger_drift(), {})
+        self.assertEqual(self.ledger_hours(), 8.)
+
+
+class ServiceTests(ScheduleTestMixin, TestCase):
+    def test_series_count_in_service(self):
+        self.occupancy()
+        self.assertEqual(teacher_service(self.teacher.id)['services'][0]['cm'], 2.)
+        s = self.series(count=3)
+        self.override(s, 2, deleted=True)
+        service = teacher_service(self.teacher.id)
+        self.assertEqual(service['services'][0]['cm'], 6.)
+        self.assertEqual(service['total_services'], 6. * get_service_coefficients()['CM'])
+        report = {teacher['id']: teacher for teacher in service_report()}
+        self.assertEqual(report[self.teacher.id]['total_services'], service['total_services'])
+        self.assertEqual(report[self.other_teacher.id]['services'], [])
+
+
+class HoursTests(ScheduleTestMixin, TestCase):
+    def test_series_hours(self):
+        self.occupancy(group_number=1, occupancy_type='TD')
+        s = self.series(count=4)
+        self.override(s, 0)
+        self.override(s, 1, deleted=True)
+        hours = subject_hours([self.subject.id])
+        self.assertEqual(subject_total_hours(hours, self.subject.id)['cm'], 6.)
+        self.assertEqual(group_hours(hours, self.subject.id, 1)['td'], 2.)
+        self.assertEqual(group_hours(hours, self.subject.id, 2)['cm'], 6.)
+        self.assertEqual(group_hours(hours, self.subject.id, 2)['td'], 0.)
+
+
+class BulkCreateTests(ScheduleTestMixin, TestCase):
+    def entry(self, at=MONDAY, hours=2, **kwargs) -> dict:
+        entry = {
+            'subject_id': self.subject.id,
+            'classroom_id': self.classroom.id,
+            'teacher_id': self.teacher.id,
+            'start': int(at.timestamp()),
+            'end': int((at + timedelta(hours=hours)).timestamp()),
+            'name': 'Cours',
+            'occupancy_type': 'CM',
+        }
+        entry.update(kwargs)
+        return entry
+
+    def test_partial_failures(self):
+        self.occupancy(start=MONDAY + timedelta(days=1))
+        deleted = self.occupancy(start=MONDAY + timedelta(days=2))
+        deleted.deleted = True
+        deleted.save()
+        self.series(count=2, start=MONDAY + timedelta(days=3))
+        entries = [
+            self.entry(),
+            self.entry(at=MONDAY + timedelta(hours=1), classroom_id=self.other_classroom.id,
+                       teacher_id=self.other_teacher.id),
+            self.entry(at=MONDAY + timedelta(days=1), classroom_id=self.other_classroom.id),
+            self.entry(at=MONDAY + timedelta(days=2)),
+            self.entry(at=MONDAY + timedelta(days=3), classroom_id=self.other_classroom.id,
+                       teacher_id=self.other_teacher.id),
+            self.entry(at=MONDAY + timedelta(days=4), teacher_id=0),
+            self.entry(at=MONDAY + timedelta(hours=9)),
+            self.entry(occupancy_type='XX'),
+            self.entry(at=MONDAY + timedelta(days=5), end=int(MONDAY.timestamp())),
+            self.entry(start=10 ** 20),
+            self.entry(at=MONDAY + timedelta(days=4), name=None, group_number='x'),
+            'not an entry',
+            self.entry(at=MONDAY + timedelta(days=4), group_number=1, occupancy_type='TD'),
+        ]
+        created, errors = bulk_create_occupancies(entries)
+        self.assertEqual(errors, [
+            {'index': 1, 'code': 'ClassOrGroupAlreadyOccupied'},
+            {'index': 2, 'code': 'TeacherAlreadyOccupied'},
+            {'index': 3, 'code': 'ClassroomAlreadyOccupied'},
+            {'index': 4, 'code': 'ClassOrGroupAlreadyOccupied'},
+            {'index': 5, 'code': 'InvalidID'},
+            {'index': 6, 'code': 'InvalidTimeSlot'},
+            {'index': 7, 'code': 'InvalidOccupancyType'},
+            {'index': 8, 'code': 'EndBeforeStart'},
+            {'index': 9, 'code': 'MalformedData'},
+            {'index': 10, 'code': 'MalformedData'},
+            {'index': 11, 'code': 'MalformedData'},
+        ])
+        self.assertEqual(len(created), 2)
+        modifications = OccupancyModification.objects.filter(occupancy_id__in=created)
+        self.assertEqual(sorted(modifications.values_list('modification_type', flat=True)), ['INSERT', 'INSERT'])
+        self.assertEqual(ledger_drift(), {})
+
+
+class TimelineCacheTests(ScheduleTestMixin, TransactionTestCase):
+    # The cache is invalidated once the transactions are committed
+    def setUp(self):
+        super().setUp()
+        caches[TIMELINE_CACHE].clear()
+        self.client = self.admin_client()
+
+    def timeline(self, weeks=1) -> list:
+        response = self.client.get(f'/api/teachers/{self.teacher.id}/occupancies', {
+            'start': int((MONDAY - timedelta(hours=10)).timestamp()),
+            'end': int((MONDAY + timedelta(weeks=weeks)).timestamp()),
+        })
+        self.assertEqual(response.status_code, 200)
+        return [event for day in response.json()['days'] for event in day['occupancies']]
+
+    def count_queries(self, weeks: int) -> int:
+        caches[TIMELINE_CACHE].clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.timeline(weeks)
+        return len(queries)
+
+    def test_cold_weeks_fetched_at_once(self):
+        for week in range(20):
+            self.occupancy(start=MONDAY + timedelta(weeks=week))
+        self.series(count=20)
+        self.assertEqual(len(self.timeline(20)), 40)
+        self.assertEqual(self.count_queries(2), self.count_queries(20))
+
+    def test_occupancy_changes(self):
+        o = self.occupancy()
+        self.assertEqual([event['id'] for event in self.timeline()], [o.id])
+        other = self.occupancy(start=MONDAY + timedelta(days=1))
+        self.assertEqual([event['id'] for event in self.timeline()], [o.id, other.id])
+        o.teacher = self.other_teacher
+        o.save()
+        self.assertEqual([event['id'] for event in self.timeline()], [other.id])
+        other.delete()
+        self.assertEqual(self.timeline(), [])
+        s = self.series(count=2)
+        self.assertEqual([event['series_id'] for event in self.timeline()], [s.id])
+
+    def test_renames(self):
+        self.occupancy()
+        self.assertEqual(self.timeline()[0]['teacher_name'], 'Ada Lovelace')
+        self.teacher.last_name = 'Byron'
+        self.teacher.save()
+        self.subject.name = 'Algorithmique avancée'
+        self.subject.save()
+        event = self.timeline()[0]
+        self.assertEqual((event['teacher_name'], event['subject_name']), ('Ada Byron', 'Algorithmique avancée'))
+        User.objects.filter(id=self.teacher.id).update(last_name='King')
+        self.teacher.refresh_from_db()
+        self.teacher.save(update_fields=['last_login'])
+        self.assertEqual(self.timeline()[0]['teacher_name'], 'Ada Byron')
+        self.classroom.name = 'Amphi A'
+        self.classroom.save()
+        self.assertEqual(self.timeline()[0]['classroom_name'], 'Amphi A')
+
+
+class NextOccupancyTests(ScheduleTestMixin, TestCase):
+    def test_next_occupancy(self):
+        self.assertIsNone(get_next_occupancy(MONDAY, teacher=self.teacher))
+        later = self.occupancy(start=MONDAY + timedelta(weeks=3))
+        self.assertEqual(get_next_occupancy(MONDAY, teacher=self.teacher).id, later.id)
+        s = self.series(count=4)
+        self.override(s, 0, deleted=True)
+        o = get_next_occupancy(MONDAY, teacher=self.teacher)
+        self.assertEqual((o.series_id, o.start_datetime), (s.id, s.occurrence_starts()[1]))
+        self.assertIsNone(get_next_occupancy(MONDAY, teacher=self.other_teacher))
+
+
+class ICalTests(ScheduleTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches[ICAL_CACHE].clear()
+
+    def feed(self) -> str:
+        return ''.join(feed_fragments(Occupancy.objects.filter(teacher=self.teacher),
+                                      OccupancySeries.objects.filter(teacher=self.teacher)))
+
+    def events(self, feed: str) -> list:
+        return [event.split('END:VEVENT')[0] for event in feed.split('BEGIN:VEVENT')[1:]]
+
+    def test_series_events(self):
+        s = self.series(count=4)
+        self.override(s, 1)
+        self.override(s, 2, deleted=True)
+        feed = self.feed()
+        self.assertIn('BEGIN:VTIMEZONE\r\nTZID:Europe/Paris', feed)
+        self.assertLess(feed.index('END:VTIMEZONE'), feed.index('BEGIN:VEVENT'))
+        events = self.events(feed)
+        self.assertEqual(len(events), 2)
+        for event in events:
+            self.assertIn('DTSTAMP:', event)
+            self.assertIn(f'UID:series-{s.id}@scolendar', event)
+        self.assertEqual(sum('RECURRENCE-ID;TZID=Europe/Paris:' in event for event in events), 1)
+        self.assertEqual(sum('EXDATE;TZID=Europe/Paris:' in event for event in events), 1)
+
+    def test_stable_uids(self):
+        o = self.occupancy()
+        s = self.series(count=3)
+        self.override(s, 1)
+        first = self.feed()
+        caches[ICAL_CACHE].clear()
+        second = self.feed()
+        uids = sorted(line for line in first.split('\r\n') if line.startswith('UID:'))
+        self.assertEqual(uids, sorted(line for line in second.split('\r\n') if line.startswith('UID:')))
+        self.assertEqual(uids, [f'UID:occupancy-{o.id}@scolendar'] + [f'UID:series-{s.id}@scolendar'] * 2)
+
+
+class ICalFeedTests(ScheduleTestMixin, TransactionTestCase):
+    # The fragments are dropped once the transactions are committed
+    def setUp(self):
+        super().setUp()
+        caches[ICAL_CACHE].clear()
+        self.url = f'/api/feeds/ical/{ICalToken.objects.create(user=self.teacher).key}'
+        self.last_change = MONDAY - timedelta(days=30)
+
+    def later(self):
+        """
+        Moves the clock a minute forward, as the conditional GET dates are compared to the second
+        """
+        self.last_change += timedelta(minutes=1)
+        return mock.patch('django.utils.timezone.now', return_value=self.last_change)
+
+    def get(self, response=None, **headers):
+        if response is not None:
+            headers = {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}
+        return self.client.get(self.url, **headers)
+
+    def events(self, response) -> int:
+        return b''.join(response.streaming_content).count(b'BEGIN:VEVENT')
+
+    def test_conditional_get(self):
+        with self.later():
+            o = self.occupancy()
+            other = self.occupancy(start=MONDAY + timedelta(days=1))
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Last-Modified'], http_date(self.last_change.timestamp()))
+        self.assertEqual(self.events(response), 2)
+        self.assertEqual(self.get(response).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        with self.later():
+            o.name = 'Cours magistral'
+            o.save()
+        edited = self.get(response)
+        self.assertEqual(edited.status_code, 200)
+        self.assertIn(b'Cours magistral', b''.join(edited.streaming_content))
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        with self.later():
+            o.deleted = True
+            o.save()
+        deleted = self.get(edited)
+        self.assertEqual(deleted.status_code, 200)
+        self.assertGreater(parse_http_date(deleted['Last-Modified']), parse_http_date(edited['Last-Modified']))
+        self.assertEqual(self.events(deleted), 1)
+
+        with self.later():
+            other.delete()
+        hard_deleted = self.get(deleted)
+        self.assertEqual(hard_deleted.status_code, 200)
+        self.assertEqual(self.events(hard_deleted), 0)
+        self.assertEqual(self.get(hard_deleted).status_code, 304)
+
+    def test_series_deletions(self):
+        with self.later():
+            s = self.series()
+        response = self.get()
+        self.assertEqual(self.events(response), 1)
+        with self.later():
+            s.deleted = True
+            s.save()
+        deleted = self.get(response)
+        self.assertEqual(deleted.status_code, 200)
+        self.assertEqual(self.events(deleted), 0)
+        with self.later():
+            s.delete()
+        self.assertEqual(self.get(deleted).status_code, 200)
+
+    def test_renames(self):
+        with self.later():
+            self.occupancy()
+            self.series()
+        response = self.get()
+        self.assertIn(b'LOCATION:B12', b''.join(response.streaming_content))
+        with self.later():
+            self.classroom.name = 'Amphi A'
+            self.classroom.save()
+        renamed = self.get(response)
+        self.assertEqual(renamed.status_code, 200)
+        self.assertNotEqual(renamed['ETag'], response['ETag'])
+        feed = b''.join(renamed.streaming_content)
+        self.assertEqual(feed.count(b'LOCATION:Amphi A'), 2)
+        self.assertNotIn(b'B12', feed)
+        # Saving without changing a shown value keeps the feed
+        with self.later():
+            self.teacher.save(update_fields=['last_login'])
+        self.assertEqual(self.get(renamed).status_code, 304)
+
+
+class HashPasswordsTests(TestCase):
+    def test_pool_reused(self):
+        self.assertEqual(len(accounts.hash_passwords(['a', 'b'], workers=2)), 2)
+        self.assertNotIn(2, accounts._pools)
+        passwords = ['first', 'second', 'third']
+        encoded = accounts.hash_passwords(passwords, workers=2)
+        self.assertTrue(all(map(check_password, passwords, encoded)))
+        pool = accounts._pools[2]
+        accounts.hash_passwords(passwords, workers=2)
+        self.assertIs(accounts._pools[2], pool)
+
+
+class SearchTests(ScheduleTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        ngram_index(Classroom).reload()
+        ngram_index(Teacher).reload()
+
+    def test_every_match_returned(self):
+        Classroom.objects.bulk_create(
+            [Classroom(name=f'Salle {i}', capacity=20, search_text=f'salle {i}') for i in range(1500)])
+        self.assertEqual(search(Classroom.objects.all(), 'salle').count(), 1500)
+
+    def test_index_updated_on_commit(self):
+        self.assertEqual(search(Teacher.objects.all(), 'dupont').count(), 0)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            accounts.bulk_insert_users([Teacher(username='jean.dupont', first_name='Jean', last_name='Dupont')])
+            raise RuntimeError
+        self.assertNotIn('dupont', ' '.join(ngram_index(Teacher)._texts.values()))
+        accounts.bulk_insert_users([Teacher(username='jean.dupont', first_name='Jean', last_name='Dupont')])
+        self.assertEqual(search(Teacher.objects.all(), 'dupont').count(), 1)
+
+
+class KeysetPaginationTests(ScheduleTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        ngram_index(Classroom).reload()
+        self.client = self.admin_client()
+
+    def pages(self, params: dict) -> list:
+        pages, cursor = [], ''
+        while cursor is not None:
+            response = self.client.get('/api/classrooms', {**params, 'cursor': cursor})
+            self.assertEqual(response.status_code, 200)
+            pages.append([classroom['id'] for classroom in response.json()['classrooms']])
+            cursor = response.json()['next_cursor']
+        return pages
+
+    def test_search_rank_ties(self):
+        # Rooms whose names have the same length share a rank
+        for i in range(12):
+            Classroom.objects.create(name=f'Salle {i:02}', capacity=20)
+            Classroom.objects.create(name=f'Salle annexe {i:02}', capacity=20)
+        pages = self.pages({'query': 'salle'})
+        ids = [pk for page in pages for pk in page]
+        self.assertEqual([len(page) for page in pages], [10, 10, 4])
+        self.assertEqual(ids, list(search(Classroom.objects.all(), 'salle').order_by('-search_rank', 'name', 'pk')
+                                   .values_list('id', flat=True)))
+
+    def test_listing(self):
+        pages = self.pages({})
+        self.assertEqual([pk for page in pages for pk in page], [self.classroom.id, self.other_classroom.id])
+
+
+class BulkInsertUsersTests(ScheduleTestMixin, TestCase):
+    def test_child_rows(self):
+        # Fails if the private QuerySet._insert used by bulk_insert_users changes
+        inserted = accounts.bulk_insert_users([
+            Student(username=f'student.{i}', first_name='Grace', last_name=f'Hopper {i}', _class=self._class)
+            for i in range(3)
+        ])
+        student = Student.objects.get(username='student.1')
+        self.assertEqual((student.id, student.last_name, student._class), (inserted[1].id, 'Hopper 1', self._class))
+        self.assertEqual(User.objects.get(id=student.id).username, 'student.1')
+        self.assertEqual(Student.objects.count(), 3)
+
+
+class StudentImportTests(ScheduleTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = self.admin_client()
+
+    def post(self, body, content_type='application/json'):
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        return self.client.post('/api/students/import', body, content_type=content_type)
+
+    def row(self, first_name: str, **kwargs) -> dict:
+        return {'first_name': first_name, 'last_name': 'Hopper', 'class_id': self._class.id, **kwargs}
+
+    def test_csv(self):
+        body = f'first_name,last_name,class_id,password\nGrace,Hopper,{self._class.id},\n' \
+               f'Barbara,Liskov,{self._class.id},Xk9!mQ2#vLp7\n'
+        response = self.post(body, 'text/csv')
+        self.assertEqual(response.status_code, 201)
+        created = response.json()['created']
+        self.assertEqual([c['username'] for c in created], ['grace.hopper', 'barbara.liskov'])
+        self.assertEqual(created[1]['password'], 'Xk9!mQ2#vLp7')
+        for credentials in created:
+            student = Student.objects.get(id=credentials['id'])
+            self.assertTrue(check_password(credentials['password'], student.password))
+            self.assertTrue(StudentSubject.objects.filter(student=student, subject=self.subject).exists())
+        self.assertEqual((response.json()['skipped'], response.json()['failed']), ([], []))
+
+    def test_bad_rows(self):
+        response = self.post([
+            self.row('Grace'),
+            {'first_name': 'Ada'},
+            self.row('Alan', class_id=self._class.id + 100),
+            self.row('Edsger', password='123'),
+            self.row('Donald', class_id='first'),
+            'Barbara',
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['created']), 1)
+        self.assertEqual(response.json()['failed'], [
+            {'index': 1, 'code': 'MalformedData'},
+            {'index': 2, 'code': 'InvalidID'},
+            {'index': 3, 'code': 'PasswordTooSimple'},
+            {'index': 4, 'code': 'MalformedData'},
+            {'index': 5, 'code': 'MalformedData'},
+        ])
+        self.assertEqual(Student.objects.count(), 1)
+
+    def test_duplicate_usernames(self):
+        response = self.post([
+            self.row('Grace'),
+            self.row('Grace'),
+            self.row('Ada', username=self.teacher.username),
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([c['username'] for c in response.json()['created']], ['grace.hopper'])
+        self.assertEqual(response.json()['skipped'], [1, 2])
+
+    def test_failed_chunk(self):
+        bulk_create = StudentSubject.objects.bulk_create
+
+        def fail_on_ada(objs, *args, **kwargs):
+            objs = list(objs)
+            if any(o.student.first_name == 'Ada' for o in objs):
+                raise IntegrityError
+            return bulk_create(objs, *args, **kwargs)
+
+        with mock.patch.object(students, 'IMPORT_CHUNK_SIZE', 2), \
+                mock.patch.object(StudentSubject.objects, 'bulk_create', fail_on_ada):
+            response = self.post([self.row('Grace'), self.row('Alan'), self.row('Ada'), self.row('Edsger'),
+                                  self.row('Barbara')])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([c['username'] for c in response.json()['created']],
+                         ['grace.hopper', 'alan.hopper', 'barbara.hopper'])
+        self.assertEqual(response.json()['failed'], [{'index': 2, 'code': 'Unknown'}, {'index': 3, 'code': 'Unknown'}])
+        self.assertFalse(User.objects.filter(username__in=['ada.hopper', 'edsger.hopper']).exists())
+
+    def test_malformed_body(self):
+        with mock.patch.object(students, 'IMPORT_CHUNK_SIZE', 2):
+            response = self.post('[' + ', '.join(json.dumps(self.row(name)) for name in ('Grace', 'Alan', 'Ada')) +
+                                 ', {"first_name": ')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['code'], 'MalformedData')
+        self.assertEqual(len(response.json()['created']), 3)
+        self.assertEqual(Student.objects.count(), 3)
+
+
+class StudentsTestMixin(ScheduleTestMixin):
+    """
+    Adds a second subject to the class, and students following both subjects
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.other_subject = Subject.objects.create(name='Réseaux', _class=self._class, group_count=2)
+        self.students = []
+        with groups.deferred_group_reorganization():
+            for i in range(6):
+                student = Student(username=f'student.{i}', first_name='Grace', last_name=f'Hopper {i}',
+                                  _class=self._class)
+                student.save()
+                self.students.append(student)
+
+    def count_reorganizations(self):
+        """
+        Counts the group reorganizations run inside the block, by subject id
+        """
+        return mock.patch.object(groups, 'attribute_student_groups', wraps=groups.attribute_student_groups)
+
+    @staticmethod
+    def reorganized(counter) -> list:
+        return sorted(call.args[0].id for call in counter.call_args_list)
+
+
+class DeletionTests(StudentsTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = self.admin_client()
+
+    def delete(self, body):
+        return self.client.delete('/api/students', json.dumps(body), content_type='application/json')
+
+    def test_all_or_nothing(self):
+        ids = [student.id for student in self.students[:2]]
+        response = self.delete(ids + [max(ids) + 100])
+        self.assertEqual((response.status_code, response.json()['code']), (404, 'InvalidID'))
+        for body in (['abc'], ids + ['abc'], {'id': ids[0]}, ids[0], [True]):
+            response = self.delete(body)
+            self.assertEqual((response.status_code, response.json()['code']), (422, 'MalformedData'))
+        self.assertEqual(Student.objects.count(), 6)
+        self.assertEqual(self.delete(ids).status_code, 200)
+        self.assertEqual(Student.objects.count(), 4)
+
+    def test_one_reorganization_per_subject(self):
+        with self.count_reorganizations() as counter:
+            response = self.delete([student.id for student in self.students[:4]])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.reorganized(counter), sorted([self.subject.id, self.other_subject.id]))
+        self.assertEqual(StudentSubject.objects.filter(subject=self.subject).count(), 2)
+
+
+def at(hours: float) -> datetime:
+    """
+    Gets a time of the test week, in hours from the monday at midnight
+    """
+    return MONDAY + timedelta(hours=hours - 10)
+
+
+class AvailabilityTests(ScheduleTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # The teacher is busy from 10 to 12, from 12 to 13:30, then from 14 to 16 every monday
+        self.occupancy(at(10))
+        self.occupancy(at(12), hours=1.5, classroom=self.other_classroom)
+        self.series(start=at(14))
+        self.condition = busy_condition([self.teacher.id])
+
+    def test_short_gaps(self):
+        self.assertEqual(free_slots(self.condition, at(9), at(17), timedelta(hours=1)),
+                         [(at(9), at(10)), (at(16), at(17))])
+        self.assertEqual(free_slots(self.condition, at(9), at(17), timedelta(minutes=30)),
+                         [(at(9), at(10)), (at(13.5), at(14)), (at(16), at(17))])
+
+    def test_window(self):
+        self.assertEqual(free_slots(self.condition, at(11), at(16.5), timedelta(minutes=30)),
+                         [(at(13.5), at(14)), (at(16), at(16.5))])
+        self.assertEqual(free_slots(self.condition, at(11), at(11.5), timedelta(minutes=1)), [])
+        # The closed hours keep everyone busy
+        self.assertEqual(free_slots(self.condition, at(19), at(33), timedelta(hours=1)),
+                         [(at(19), at(20)), (at(32), at(33))])
+        # The other teacher is free whenever the establishment is open
+        self.assertEqual(free_slots(busy_condition([self.other_teacher.id]), at(9), at(17), timedelta(hours=1)),
+                         [(at(9), at(17))])
+
+    def test_endpoint(self):
+        response = self.admin_client().get('/api/availability', {
+            'start': int(at(11).timestamp()),
+            'end': int(at(17).timestamp()),
+            'duration': 3600,
+            'teacher_id': self.teacher.id,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['slots'], [{'start': int(at(16).timestamp()), 'end': int(at(17).timestamp())}])
+
+
+class FreeClassroomsTests(ScheduleTestMixin, TransactionTestCase):
+    # The room index is dropped once the transactions are committed
+    def setUp(self):
+        super().setUp()
+        caches[TIMELINE_CACHE].clear()
+
+    def free(self, start: datetime, end: datetime, capacity=0) -> list:
+        return [c.id for c in free_classrooms(start, end, capacity)]
+
+    def test_capacity(self):
+        self.assertEqual(self.free(at(10), at(12)), [self.classroom.id, self.other_classroom.id])
+        self.assertEqual(self.free(at(10), at(12), 40), [self.other_classroom.id])
+        self.assertEqual(self.free(at(10), at(12), 100), [])
+        response = self.admin_client().get('/api/classrooms/free', {
+            'start': int(at(10).timestamp()),
+            'end': int(at(12).timestamp()),
+            'capacity': 40,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c['id'] for c in response.json()['classrooms']], [self.other_classroom.id])
+
+    def test_occupied(self):
+        self.occupancy(at(10))
+        self.assertEqual(self.free(at(11), at(11.5)), [self.other_classroom.id])
+        self.assertEqual(self.free(at(11.5), at(13)), [self.other_classroom.id])
+        self.assertEqual(self.free(at(12), at(13)), [self.classroom.id, self.other_classroom.id])
+        # An occupancy of the previous week can not overlap, it is shorter than the max duration
+        self.assertEqual(self.free(at(10 + 24 * 7), at(12 + 24 * 7)), [self.classroom.id, self.other_classroom.id])
+
+    def test_series(self):
+        s = self.series(start=at(14), classroom=self.other_classroom)
+        next_week = timedelta(weeks=1)
+        self.assertEqual(self.free(at(15) + next_week, at(16) + next_week), [self.classroom.id])
+        # A cancelled occurrence frees the classroom, a moved one occupies it at its new time
+        self.override(s, 1, shift=timedelta(0), deleted=True)
+        self.assertEqual(self.free(at(15) + next_week, at(16) + next_week),
+                         [self.classroom.id, self.other_classroom.id])
+        self.override(s, 2)
+        self.assertEqual(self.free(at(15) + 2 * next_week, at(16) + 2 * next_week),
+                         [self.classroom.id, self.other_classroom.id])
+        self.assertEqual(self.free(at(15 + 24) + 2 * next_week, at(16 + 24) + 2 * next_week), [self.classroom.id])
+
+
+class GroupReorganizationTests(StudentsTestMixin, TransactionTestCase):
+    def enroll(self, count: int) -> None:
+        for i in range(count):
+            Student(username=f'new.{i}', first_name='Ada', last_name=f'Byron {i}', _class=self._class).save()
+
+    def test_once_after_commit(self):
+        with self.count_reorganizations() as counter:
+            with transaction.atomic():
+                self.enroll(3)
+                StudentSubject.objects.filter(student=self.students[0]).delete()
+                self.assertEqual(counter.call_count, 0)
+        self.assertEqual(self.reorganized(counter), sorted([self.subject.id, self.other_subject.id]))
+        self.assertEqual(StudentSubject.objects.filter(subject=self.subject).count(), 8)
+
+    def test_none_after_rollback(self):
+        with self.count_reorganizations() as counter:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.enroll(3)
+                raise RuntimeError
+            with transaction.atomic():
+                with self.assertRaises(RuntimeError), transaction.atomic():
+                    self.enroll(3)
+                    raise RuntimeError
+            self.assertEqual(counter.call_count, 0)
+            # The subjects of the rolled back transactions are not reorganized along with the next commit
+            StudentSubject.objects.get(student=self.students[0], subject=self.other_subject).delete()
+        self.assertEqual(self.reorganized(counter), [self.other_subject.id])
+        self.assertEqual(Student.objects.count(), 6)
+
+
+class StudentTimelineTests(StudentsTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        caches[TIMELINE_CACHE].clear()
+        self.client = self.admin_client()
+
+    def timeline(self, student: Student) -> list:
+        response = self.client.get(f'/api/students/{student.id}/occupancies', {
+            'start': int(at(0).timestamp()),
+            'end': int(at(24).timestamp()),
+        })
+        self.assertEqual(response.status_code, 200)
+        return [event for day in response.json()['days'] for event in day['occupancies']]
+
+    def test_own_groups(self):
+        lecture = self.occupancy(at(8))
+        tutorial = self.occupancy(at(10), occupancy_type='TD', group_number=1)
+        practical = self.occupancy(at(12), occupancy_type='TP', group_number=2)
+        other_tutorial = self.occupancy(at(14), occupancy_type='TD', group_number=1, subject=self.other_subject)
+        series = self.series(start=at(16), occupancy_type='TP', group_number=2)
+        groups_by_student = {
+            (ss.student_id, ss.subject_id): ss.group_number for ss in StudentSubject.objects.all()
+        }
+        for student in self.students:
+            group = groups_by_student[student.id, self.subject.id]
+            expected = [lecture.id, tutorial.id] if group == 1 else [lecture.id, practical.id]
+            if groups_by_student[student.id, self.other_subject.id] == 1:
+                expected.append(other_tutorial.id)
+            events = self.timeline(student)
+            self.assertEqual([event['id'] for event in events if not event.get('series_id')], expected)
+            self.assertEqual([event['series_id'] for event in events if event.get('series_id')],
+                             [] if group == 1 else [series.id])
+        # Both groups have students, so each one misses the sessions of the other
+        self.assertEqual({group for (_, subject_id), group in groups_by_student.items()
+                          if subject_id == self.subject.id}, {1, 2})
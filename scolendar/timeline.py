@@ -0,0 +1,193 @@
+from datetime import date, datetime, timedelta
+from heapq import merge
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import QuerySet
+from pytz import timezone
+
+from scolendar import timeline_cache
+from scolendar.models import Occupancy
+from scolendar.series import expand_series
+
+# How far the series are searched for the next occupancy when no stored occupancy bounds the search
+NEXT_OCCUPANCY_HORIZON = timedelta(days=366)
+
+
+def parse_timestamp(timestamp) -> Optional[datetime]:
+    """
+    Converts a timestamp received as a query parameter into an aware datetime
+
+    :param timestamp: The timestamp (in seconds), as a string or an integer. Can be None or empty.
+    :return: The matching datetime in the application timezone, or None if no timestamp was given
+    """
+    if not timestamp:
+        return None
+    return datetime.fromtimestamp(int(timestamp), tz=timezone(settings.TIME_ZONE))
+
+
+def get_occupancies(start: Optional[datetime] = None, end: Optional[datetime] = None, *args, **filters) -> QuerySet:
+    """
+    Builds the single query used to fetch the occupancies of a timeline
+
+    The related subject, class, teacher and classroom are joined in the same query, so that serializing the
+    occupancies does not trigger any additional query.
+
+    :param start: Only keep the occupancies starting after this datetime
+    :param end: Only keep the occupancies ending before this datetime
+    :param args: Q objects restricting the occupancies
+    :param filters: Lookups restricting the occupancies to a resource (teacher, classroom, subject, ...)
+    :return: The ordered queryset of occupancies
+    """
+    occupancies = Occupancy.objects.filter(*args, deleted=False, **filters)
+    if start:
+        occupancies = occupancies.filter(start_datetime__gte=start)
+    if end:
+        occupancies = occupancies.filter(end_datetime__lte=end)
+    return occupancies.select_related('subject___class', 'teacher', 'classroom').order_by('start_datetime')
+
+
+def get_timeline(start: Optional[datetime] = None, end: Optional[datetime] = None, *args,
+                 **filters) -> Iterable[Occupancy]:
+    """
+    Merges the stored occupancies of a timeline with the occurrences of the matching occupancy series
+
+    :param start: Only keep the occupancies starting after this datetime
+    :param end: Only keep the occupancies ending before this datetime
+    :param args: Q objects restricting the occupancies and the series
+    :param filters: Lookups restricting the occupancies to a resource (teacher, classroom, subject, ...)
+    :return: The occupancies, sorted by start datetime
+    """
+    occurrences = [
+        o for o in expand_series(start, end, *args, **filters)
+        if (not start or o.start_datetime >= start) and (not end or o.end_datetime <= end)
+    ]
+    return merge(get_occupancies(start, end, *args, **filters), occurrences, key=lambda o: o.start_datetime)
+
+
+def get_next_occupancy(after: datetime, *args, **filters) -> Optional[Occupancy]:
+    """
+    Finds the first occupancy (or series occurrence) of a timeline starting after a datetime
+
+    Only the first stored occupancy is fetched, and the series are only expanded until it starts (or over
+    `NEXT_OCCUPANCY_HORIZON` when there is none).
+
+    :param after: Only consider the occupancies starting after this datetime
+    :param args: Q objects restricting the occupancies and the series
+    :param filters: Lookups restricting the occupancies to a resource (teacher, classroom, subject, ...)
+    :return: The next occupancy, None if nothing is scheduled
+    """
+    first = next(iter(get_occupancies(after, None, *args, **filters)[:1]), None)
+    end = first.start_datetime if first else after + NEXT_OCCUPANCY_HORIZON
+    occurrences = [o for o in expand_series(after, end, *args, **filters) if o.start_datetime >= after]
+    return occurrences[0] if occurrences else first
+
+
+def occupancy_event(o: Occupancy) -> dict:
+    """
+    Serializes an occupancy the way the timeline endpoints return it
+
+    :param o: The occupancy to serialize. Its related rows should already be loaded.
+    :return: The event dictionary
+    """
+    event = {
+        'id': o.id,
+        'group_name': f'Groupe {o.group_number}',
+        'subject_name': o.subject.name,
+        'teacher_name': f'{o.teacher.first_name} {o.teacher.last_name}',
+        'start': o.start_datetime.timestamp(),
+        'end': o.end_datetime.timestamp(),
+        'occupancy_type': o.occupancy_type,
+        'name': o.name,
+    }
+    if o.subject:
+        event['class_name'] = o.subject._class.name
+    if o.classroom:
+        event['classroom_name'] = o.classroom.name
+    if o.series_id:
+        event['series_id'] = o.series_id
+    return event
+
+
+def group_by_day(events: Iterable[dict], nb_per_day: int = 0) -> list:
+    """
+    Groups serialized occupancies sorted by start into days, in a single pass
+
+    :param events: The serialized occupancies (see `occupancy_event`), sorted by start
+    :param nb_per_day: Maximum number of occupancies to keep per day. 0 keeps all of them.
+    :return: The list of days, each containing its date and its occupancies
+    """
+    tz = timezone(settings.TIME_ZONE)
+    days = []
+    current_date = None
+    occ_list = []
+    for event in events:
+        date = datetime.fromtimestamp(event['start'], tz=tz).date()
+        if date != current_date:
+            current_date = date
+            occ_list = []
+            days.append({'date': date.strftime('%d-%m-%Y'), 'occupancies': occ_list})
+        if nb_per_day and len(occ_list) >= nb_per_day:
+            continue
+        occ_list.append(event)
+    return days
+
+
+def get_cached_events(scope: Tuple[str, int], start: datetime, end: datetime, *args, **filters) -> Iterable[dict]:
+    """
+    Gets the serialized occupancies of a timeline week by week, through the timeline cache
+
+    The weeks missing from the cache are fetched together, with a single ranged timeline split into weeks, so that the
+    number of queries does not depend on the number of weeks.
+
+    :param scope: The cached scope matching the filters (see `timeline_cache.get_scope`)
+    :param start: Only keep the occupancies starting after this datetime
+    :param end: Only keep the occupancies ending before this datetime
+    :param args: Q objects restricting the occupancies to the resource of the scope
+    :param filters: Lookups restricting the occupancies to the resource of the scope
+    :return: The serialized occupancies, sorted by start
+    """
+    def compute(missing: List[date]) -> Dict[date, list]:
+        weeks = {monday: [] for monday in missing}
+        range_start = timeline_cache.week_bounds(missing[0])[0]
+        range_end = timeline_cache.week_bounds(missing[-1])[1]
+        for o in get_timeline(range_start, range_end, *args, **filters):
+            # An occupancy belongs to the week it starts in, the weeks in between may already be cached
+            week = weeks.get(timeline_cache.week_start(o.start_datetime))
+            if week is not None:
+                week.append(occupancy_event(o))
+        return weeks
+
+    start_timestamp = start.timestamp()
+    end_timestamp = end.timestamp()
+    mondays = timeline_cache.weeks_between(start, end)
+    weeks = timeline_cache.get_weeks_events(*scope, mondays, compute)
+    for monday in mondays:
+        for event in weeks[monday]:
+            if event['start'] >= start_timestamp and event['end'] <= end_timestamp:
+                yield event
+
+
+def get_days(request, *args, scope: Optional[Tuple[str, int]] = None, **filters) -> list:
+    """
+    Computes the timeline returned by all the `*/occupancies` endpoints
+
+    The `start`, `end` and `occupancies_per_day` query parameters are read from the request. Bounded student, teacher,
+    classroom and class timelines are served from the timeline cache.
+
+    :param request: The request received by the endpoint
+    :param args: Q objects restricting the occupancies to a resource
+    :param scope: The cached scope of the timeline, found from the filters when not given
+    :param filters: Lookups restricting the occupancies to a resource (teacher, classroom, subject, ...)
+    :return: The list of days, each containing its date and its occupancies
+    """
+    query_params = request.query_params
+    start = parse_timestamp(query_params.get('start', None))
+    end = parse_timestamp(query_params.get('end', None))
+    if scope is None and not args:
+        scope = timeline_cache.get_scope(filters)
+    if scope and start and end:
+        events = get_cached_events(scope, start, end, *args, **filters)
+    else:
+        events = map(occupancy_event, get_timeline(start, end, *args, **filters))
+    return group_by_day(events, int(query_params.get('occupancies_per_day', 0)))
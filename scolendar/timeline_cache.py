@@ -0,0 +1,261 @@
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.timezone import localtime
+from pytz import timezone
+
+from scolendar.models import Class, Classroom, StudentSubject, Subject, Teacher
+
+TIMELINE_CACHE = 'timeline'
+
+# The student timelines depend on the groups of the student, their scope is given explicitly (see `membership`)
+scope_filters = {
+    'teacher': 'teacher',
+    'classroom': 'classroom',
+    'class': 'subject___class',
+}
+
+# The busy intervals of all the classrooms, cached per week like a timeline (see `rooms`)
+ROOM_INDEX_SCOPE = ('rooms', 0)
+
+
+def _cache():
+    return caches[TIMELINE_CACHE]
+
+
+def get_scope(filters: dict) -> Optional[Tuple[str, int]]:
+    """
+    Finds the cached scope matching the lookups of a timeline
+
+    :param filters: The lookups restricting the occupancies of the timeline
+    :return: The scope name and the id of the resource, or None if this timeline is not cached
+    """
+    if len(filters) != 1:
+        return None
+    for scope, lookup in scope_filters.items():
+        if lookup in filters:
+            value = filters[lookup]
+            return scope, getattr(value, 'pk', value)
+    return None
+
+
+def week_start(dt: datetime) -> date:
+    """
+    Gets the monday of the (local) week containing a datetime
+    """
+    day = localtime(dt, timezone(settings.TIME_ZONE)).date()
+    return day - timedelta(days=day.weekday())
+
+
+def week_bounds(monday: date) -> Tuple[datetime, datetime]:
+    """
+    Gets the aware datetimes at which a week starts and ends, in the application timezone
+    """
+    tz = timezone(settings.TIME_ZONE)
+    start = tz.localize(datetime.combine(monday, time()))
+    end = tz.localize(datetime.combine(monday + timedelta(days=7), time()))
+    return start, end
+
+
+def weeks_between(start: datetime, end: datetime) -> List[date]:
+    """
+    Lists the mondays of the weeks overlapping a time window
+    """
+    mondays = []
+    monday = week_start(start)
+    while week_bounds(monday)[0] < end:
+        mondays.append(monday)
+        monday += timedelta(days=7)
+    return mondays
+
+
+# Bumped when a name shown in the cached events changes, which drops the weeks of every scope
+_GLOBAL_GENERATION_KEY = 'timeline:generation'
+
+
+def _generation_key(scope: str, scope_id: int) -> str:
+    return f'timeline:{scope}:{scope_id}:generation'
+
+
+def _generation(scope: str, scope_id: int) -> str:
+    key = _generation_key(scope, scope_id)
+    generations = _cache().get_many([_GLOBAL_GENERATION_KEY, key])
+    for missing in {_GLOBAL_GENERATION_KEY, key} - generations.keys():
+        _cache().add(missing, 0)
+        generations[missing] = _cache().get(missing, 0)
+    return f'{generations[_GLOBAL_GENERATION_KEY]}.{generations[key]}'
+
+
+def _week_key(scope: str, scope_id: int, generation: str, monday: date) -> str:
+    return f'timeline:{scope}:{scope_id}:{generation}:{monday.isoformat()}'
+
+
+def _increment(key: str, delta: int = 1):
+    _cache().add(key, 0)
+    try:
+        _cache().incr(key, delta)
+    except ValueError:
+        # The counter was evicted between add and incr
+        _cache().set(key, delta)
+
+
+def _count(counter: str, delta: int = 1):
+    if delta:
+        _increment(f'timeline:{counter}', delta)
+
+
+def get_weeks_events(scope: str, scope_id: int, mondays: List[date],
+                     compute: Callable[[List[date]], Dict[date, list]]) -> Dict[date, list]:
+    """
+    Gets the serialized events of a scope for several weeks, computing all the missing weeks at once
+
+    The cached weeks are read with a single request to the cache, and the missing ones are computed together and
+    stored with a single request.
+
+    :param scope: The scope name (`student`, `teacher`, `classroom`, `class` or `rooms`)
+    :param scope_id: The id of the student, teacher, classroom or class (0 for the room index)
+    :param mondays: The first days of the weeks
+    :param compute: Computes the events of the missing weeks (given sorted), by first day of the week
+    :return: The events of each week, sorted by start
+    """
+    generation = _generation(scope, scope_id)
+    keys = {monday: _week_key(scope, scope_id, generation, monday) for monday in mondays}
+    cached = _cache().get_many(list(keys.values()))
+    weeks = {monday: cached[key] for monday, key in keys.items() if key in cached}
+    missing = sorted(monday for monday in keys if monday not in weeks)
+    _count('hits', len(weeks))
+    _count('misses', len(missing))
+    if missing:
+        computed = compute(missing)
+        computed = {monday: computed.get(monday, []) for monday in missing}
+        _cache().set_many({keys[monday]: events for monday, events in computed.items()})
+        weeks.update(computed)
+    return weeks
+
+
+def get_week_events(scope: str, scope_id: int, monday: date, compute: Callable[[], list]) -> list:
+    """
+    Gets the serialized events of a scope for one week, computing and caching them on a miss, see `get_weeks_events`
+
+    :param compute: Computes the events of the week when they are not cached
+    """
+    return get_weeks_events(scope, scope_id, [monday], lambda missing: {monday: compute()})[monday]
+
+
+def stats() -> Dict[str, int]:
+    """
+    Gets the hit and miss counters of the timeline cache
+    """
+    counters = _cache().get_many(['timeline:hits', 'timeline:misses'])
+    return {
+        'hits': counters.get('timeline:hits', 0),
+        'misses': counters.get('timeline:misses', 0),
+    }
+
+
+def reset_stats():
+    _cache().delete_many(['timeline:hits', 'timeline:misses'])
+
+
+def invalidate_scopes(scopes: Iterable[Tuple[str, int]]):
+    """
+    Drops all the cached weeks of several scopes, by moving them to a new generation of keys
+
+    The old entries are never read again and expire when the cache evicts them.
+    """
+    for scope, scope_id in scopes:
+        _increment(_generation_key(scope, scope_id))
+
+
+def invalidate_all():
+    """
+    Drops the cached weeks of every scope, when a teacher, subject, class or classroom shown in the events is renamed
+    """
+    _increment(_GLOBAL_GENERATION_KEY)
+
+
+# The fields of each model shown in the cached events (see `timeline.occupancy_event`), and the model they are read
+# from. The users are only shown when they are teachers.
+displayed_fields = {
+    'User': (Teacher, ('first_name', 'last_name')),
+    'Teacher': (Teacher, ('first_name', 'last_name')),
+    'Subject': (Subject, ('name',)),
+    'Class': (Class, ('name',)),
+    'Classroom': (Classroom, ('name',)),
+}
+
+
+def displayed_values_changed(instance, update_fields=None) -> bool:
+    """
+    Checks whether a row about to be saved changes a name shown in the cached events, with one query at most
+
+    :param instance: The teacher, user, subject, class or classroom about to be saved
+    :param update_fields: The fields saved, None for all of them
+    """
+    model, fields = displayed_fields[type(instance).__name__]
+    if instance.pk is None or (update_fields is not None and not set(fields) & set(update_fields)):
+        return False
+    previous = model.objects.filter(pk=instance.pk).values_list(*fields).first()
+    return previous is not None and previous != tuple(getattr(instance, field) for field in fields)
+
+
+def resource_scopes(classroom_id: int, teacher_id: int, class_id: int, student_ids: Iterable[int]) -> list:
+    """
+    Lists the scopes whose timeline shows an occupancy (or a series) using these resources, and the room index
+    """
+    scopes = [('classroom', classroom_id), ('teacher', teacher_id), ('class', class_id), ROOM_INDEX_SCOPE]
+    return scopes + [('student', student_id) for student_id in student_ids]
+
+
+def subject_students(subject_ids: Iterable[int]) -> Dict[int, List[int]]:
+    """
+    Gets the students following some subjects, with a single query
+    """
+    students = defaultdict(list)
+    rows = StudentSubject.objects.filter(subject_id__in=set(subject_ids)).values_list('subject_id', 'student_id')
+    for subject_id, student_id in rows:
+        students[subject_id].append(student_id)
+    return students
+
+
+def invalidate_occupancies(changes: Iterable[Tuple[object, Iterable[datetime]]]):
+    """
+    Drops the cached weeks showing some occupancies, in every scope they appear in
+
+    :param changes: The inserted, edited or deleted occupancies, each with the datetimes (previous and new start) whose
+    week has to be invalidated. None datetimes are ignored.
+    """
+    changes = list(changes)
+    students = subject_students(o.subject_id for o, _ in changes)
+    weeks = defaultdict(set)
+    for o, datetimes in changes:
+        mondays = {week_start(dt) for dt in datetimes if dt}
+        for scope in resource_scopes(o.classroom_id, o.teacher_id, o.subject._class_id, students[o.subject_id]):
+            weeks[scope] |= mondays
+    keys = []
+    for (scope, scope_id), mondays in weeks.items():
+        generation = _generation(scope, scope_id)
+        keys += [_week_key(scope, scope_id, generation, monday) for monday in mondays]
+    if keys:
+        _cache().delete_many(keys)
+
+
+def invalidate_occupancy(occupancy, *datetimes: datetime):
+    """
+    Drops the cached weeks showing an occupancy, in every scope it appears in
+
+    :param occupancy: The inserted, edited or deleted occupancy
+    :param datetimes: The datetimes (previous and new start) whose week has to be invalidated
+    """
+    invalidate_occupancies([(occupancy, datetimes)])
+
+
+def series_scopes(series) -> list:
+    """
+    Lists the scopes whose timeline shows an occupancy series
+    """
+    students = subject_students([series.subject_id])[series.subject_id]
+    return resource_scopes(series.classroom_id, series.teacher_id, series.subject._class_id, students)
@@ -0,0 +1,206 @@
+import threading
+from collections import OrderedDict, namedtuple
+from time import monotonic
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework.authtoken.models import Token
+
+User = get_user_model()
+
+
+class Principal(namedtuple('Principal', ['user_id', 'role', 'is_staff', 'teacher_id', 'class_id'])):
+    """
+    Identity of the user behind a request
+
+    :param user_id: The id of the user
+    :param role: `ADM`, `TEA` or `STU` (None for a user who is none of them)
+    :param is_staff: Whether the user is an administrator
+    :param teacher_id: The id of the user as a teacher, None if they are not a teacher
+    :param class_id: The id of the class of the user as a student, None if they are not a student
+    """
+    __slots__ = ()
+
+    @property
+    def is_teacher(self) -> bool:
+        return self.teacher_id is not None
+
+    @property
+    def is_student(self) -> bool:
+        return self.class_id is not None
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of token keys to the identity of their user, with a time to live
+
+    The cache lives in the memory of the process: a token deleted by another process is only forgotten here once its
+    entry expires, so the time to live should stay short.
+    """
+
+    def __init__(self, max_entries: int, timeout: float):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                principal, expiry = entry
+                if expiry > monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return principal
+                self._forget(key)
+            self.misses += 1
+            return None
+
+    def set(self, key: str, principal: Principal):
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = (principal, monotonic() + self.timeout)
+            self._keys_by_user.setdefault(principal.user_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._forget(next(iter(self._entries)))
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._forget(key)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._forget(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Gets the hit and miss counters of the cache, in this process
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def _forget(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._keys_by_user.get(entry[0].user_id)
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[entry[0].user_id]
+
+
+def _settings() -> dict:
+    return {'ENABLED': True, 'MAX_ENTRIES': 10000, 'TIMEOUT': 60, **getattr(settings, 'TOKEN_CACHE', {})}
+
+
+token_cache = TokenCache(_settings()['MAX_ENTRIES'], _settings()['TIMEOUT'])
+
+
+def _user_role(is_staff: bool, teacher_id: Optional[int], class_id: Optional[int]) -> Optional[str]:
+    if is_staff:
+        return 'ADM'
+    if teacher_id is not None:
+        return 'TEA'
+    if class_id is not None:
+        return 'STU'
+    return None
+
+
+def principal_lookups(user_path: str = '') -> List[str]:
+    """
+    Lists the lookups fetching a principal through the user relation of a model, to be passed to `values_list`
+
+    :param user_path: The path to the user model, with its trailing `__` (empty when querying the users themselves)
+    """
+    return [f'{user_path}id', f'{user_path}is_staff', f'{user_path}teacher__user_ptr', f'{user_path}student___class']
+
+
+def principal_from_row(row) -> Principal:
+    """
+    Builds a principal from a row selected with `principal_lookups`
+    """
+    user_id, is_staff, teacher_id, class_id = row
+    return Principal(user_id, _user_role(is_staff, teacher_id, class_id), is_staff, teacher_id, class_id)
+
+
+def get_principal(user) -> Principal:
+    """
+    Gets the principal of a user with a single query, for the requests which are not authenticated with a token
+    """
+    return principal_from_row(User.objects.filter(id=user.id).values_list(*principal_lookups()).get())
+
+
+def resolve_token(key: str) -> Principal:
+    """
+    Gets the principal of a token, with a single query on a cache miss
+
+    The role, teacher id and class id are found with the same query, by joining the teacher and student tables.
+
+    :raise Token.DoesNotExist: if there is no such token
+    """
+    enabled = _settings()['ENABLED']
+    if enabled:
+        principal = token_cache.get(key)
+        if principal is not None:
+            return principal
+    row = Token.objects.filter(key=key).values_list(*principal_lookups('user__')).first()
+    if row is None:
+        raise Token.DoesNotExist
+    principal = principal_from_row(row)
+    if enabled:
+        token_cache.set(key, principal)
+    return principal
+
+
+class TokenUser:
+    """
+    Stands for the user of a cached token
+
+    The id and the staff flag are known without any query, as they are all most endpoints check. The user is loaded
+    from the database the first time another attribute is needed.
+    """
+
+    def __init__(self, principal: Principal):
+        self.id = self.pk = principal.user_id
+        self.is_staff = principal.is_staff
+        self.role = principal.role
+
+    def __getattr__(self, name):
+        if name == '_user':
+            self._user = User.objects.get(id=self.id)
+            return self._user
+        return getattr(self._user, name)
+
+    def __bool__(self):
+        return True
+
+
+def cached_token(key: str) -> Token:
+    """
+    Gets a token and its user from the token cache (see `resolve_token`)
+
+    The token is not fetched from the database: its user is a `TokenUser`, so `token.user.id` and
+    `token.user.is_staff` do not run any query. The principal of the token is set as its `principal` attribute.
+
+    :raise Token.DoesNotExist: if there is no such token
+    """
+    principal = resolve_token(key)
+    token = Token(key=key, user_id=principal.user_id)
+    token._state.adding = False
+    token._state.fields_cache['user'] = TokenUser(principal)
+    token.principal = principal
+    return token
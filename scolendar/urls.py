@@ -1,10 +1,11 @@
 from django.conf.urls import url
 
 from scolendar.views import session, profile, profile_occupancy_modifications, profile_next_occupancy, \
-    profile_iCal_feed, teachers, teachers_details, teacher_occupancies, teacher_subjects, classrooms, \
-    classroom_details, classrooms_occupancies, class_, class_details, class_occupancies, students, students_details, \
-    students_occupancies, students_subjects, subjects, subjects_details, subjects_occupancies, subjects_teachers, \
-    subjects_groups, subjects_groups_occupancies, occupancies, occupancies_details, i_cal_feed
+    profile_iCal_feed, teachers, teachers_services, teachers_details, teacher_occupancies, teacher_subjects, \
+    classrooms, classroom_details, classrooms_occupancies, classrooms_free, class_, class_details, class_occupancies, \
+    class_hours, students, students_details, students_occupancies, students_subjects, students_import, subjects, \
+    subjects_details, subjects_occupancies, subjects_teachers, subjects_groups, subjects_groups_occupancies, \
+    occupancies, occupancies_details, availability, i_cal_feed
 
 urlpatterns = [
     url(r'session$', session),
@@ -15,19 +16,23 @@ urlpatterns = [
     url(r'profile/feeds/ical', profile_iCal_feed),
 
     url(r'teachers$', teachers),
+    url(r'teachers/services$', teachers_services),
     url(r'teachers/(?P<teacher_id>[0-9]+)$', teachers_details),
     url(r'teachers/(?P<teacher_id>[0-9]+)/occupancies$', teacher_occupancies),
     url(r'teachers/(?P<teacher_id>[0-9]+)/subjects$', teacher_subjects),
 
     url(r'classrooms$', classrooms),
+    url(r'classrooms/free$', classrooms_free),
     url(r'classrooms/(?P<classroom_id>[0-9]+)$', classroom_details),
     url(r'classrooms/(?P<classroom_id>[0-9]+)/occupancies$', classrooms_occupancies),
 
     url(r'classes$', class_),
     url(r'classes/(?P<class_id>[0-9]+)$', class_details),
     url(r'classes/(?P<class_id>[0-9]+)/occupancies$', class_occupancies),
+    url(r'classes/(?P<class_id>[0-9]+)/hours$', class_hours),
 
     url(r'students$', students),
+    url(r'students/import$', students_import),
     url(r'students/(?P<student_id>[0-9]+)$', students_details),
     url(r'students/(?P<student_id>[0-9]+)/occupancies$', students_occupancies),
     url(r'students/(?P<student_id>[0-9]+)/subjects$', students_subjects),
@@ -41,6 +46,7 @@ urlpatterns = [
 
     url(r'occupancies$', occupancies),
     url(r'occupancies/(?P<occupancy_id>[0-9]+)$', occupancies_details),
+    url(r'availability$', availability),
 
     url(r'feeds/ical/(?P<token>[a-zA-Z0-9]+)$', i_cal_feed),
 ]
@@ -26,12 +26,13 @@ def end_datetime_validator(datetime_to_validate: datetime):
 
 
 def max_duration_validator(duration_to_validate: timedelta):
-    seconds = conf.max_duration().seconds
+    max_duration = conf.max_duration()
+    seconds = max_duration.seconds
     h = seconds // 3600
     m = (seconds // 60) % 60
     hour = str(h) if len(str(h)) == 2 else f'0{h}'
     minute = str(m) if len(str(m)) == 2 else f'0{m}'
-    if conf.max_duration() < duration_to_validate:
+    if max_duration < duration_to_validate:
         raise ValidationError(_(f'La durée d\'une séance ne peut dépasser {hour}:{minute}'))
 
 
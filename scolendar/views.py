@@ -1,20 +1,26 @@
-from django.http import HttpResponse
-from ics import Calendar, Event
-from ics.attendee import Organizer, Attendee
+import hashlib
 
-from scolendar.models import Occupancy, OccupancyModification, ICalToken, Student, Teacher
+from django.db.models import Count, Max, Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
+
+from scolendar.ical import ALL_FEEDS, feed_changes, feed_fragments, fragments_version
+from scolendar.models import Occupancy, OccupancyModification, OccupancySeries, ICalToken
+from scolendar.tokens import principal_from_row, principal_lookups
 from scolendar.viewsets.auth_viewsets import AuthViewSet
-from scolendar.viewsets.class_viewsets import ClassViewSet, ClassDetailViewSet, ClassOccupancyViewSet
-from scolendar.viewsets.classroom_viewsets import ClassroomDetailViewSet, ClassroomOccupancyViewSet, ClassroomViewSet
-from scolendar.viewsets.occupancy_viewsets import OccupancyDetailViewSet, OccupancyViewSet
+from scolendar.viewsets.class_viewsets import ClassViewSet, ClassDetailViewSet, ClassOccupancyViewSet, \
+    ClassHoursViewSet
+from scolendar.viewsets.classroom_viewsets import ClassroomAvailabilityViewSet, ClassroomDetailViewSet, \
+    ClassroomOccupancyViewSet, ClassroomViewSet
+from scolendar.viewsets.occupancy_viewsets import AvailabilityViewSet, OccupancyDetailViewSet, OccupancyViewSet
 from scolendar.viewsets.profile_viewsets import ProfileViewSet, ProfileLastOccupancyEdit, ProfileNextOccupancy, \
     ProfileICalFeed
 from scolendar.viewsets.student_viewsets import StudentDetailViewSet, StudentOccupancyDetailViewSet, \
-    StudentSubjectDetailViewSet, StudentViewSet
+    StudentSubjectDetailViewSet, StudentViewSet, StudentImportViewSet
 from scolendar.viewsets.subject_viewsets import SubjectDetailViewSet, SubjectOccupancyViewSet, SubjectTeacherViewSet, \
     SubjectGroupViewSet, SubjectGroupOccupancyViewSet, SubjectViewSet
 from scolendar.viewsets.teacher_viewsets import TeacherViewSet, TeacherDetailViewSet, TeacherOccupancyDetailViewSet, \
-    TeacherSubjectDetailViewSet
+    TeacherSubjectDetailViewSet, TeacherServiceReportViewSet
 
 # Session
 session = AuthViewSet.as_view()
@@ -30,19 +36,23 @@ teachers = TeacherViewSet.as_view()
 teachers_details = TeacherDetailViewSet.as_view()
 teacher_occupancies = TeacherOccupancyDetailViewSet.as_view()
 teacher_subjects = TeacherSubjectDetailViewSet.as_view()
+teachers_services = TeacherServiceReportViewSet.as_view()
 
 # Classrooms
 classrooms = ClassroomViewSet.as_view()
 classroom_details = ClassroomDetailViewSet.as_view()
 classrooms_occupancies = ClassroomOccupancyViewSet.as_view()
+classrooms_free = ClassroomAvailabilityViewSet.as_view()
 
 # Classes
 class_ = ClassViewSet.as_view()
 class_details = ClassDetailViewSet.as_view()
 class_occupancies = ClassOccupancyViewSet.as_view()
+class_hours = ClassHoursViewSet.as_view()
 
 # Students
 students = StudentViewSet.as_view()
+students_import = StudentImportViewSet.as_view()
 students_details = StudentDetailViewSet.as_view()
 students_occupancies = StudentOccupancyDetailViewSet.as_view()
 students_subjects = StudentSubjectDetailViewSet.as_view()
@@ -58,55 +68,76 @@ subjects_groups_occupancies = SubjectGroupOccupancyViewSet.as_view()
 # Occupancies
 occupancies = OccupancyViewSet.as_view()
 occupancies_details = OccupancyDetailViewSet.as_view()
+availability = AvailabilityViewSet.as_view()
+
+
+def _i_cal_scope(request, token: str):
+    """
+    Finds the occupancies and series shown in the iCal feed of a token, and the state they are in
+
+    The result is stored on the request, as it is needed by the conditional GET checks and by the feed itself.
+
+    :return: The occupancies and series querysets, the feed state (number of modifications and series, date of the
+    last change) and the version of the fragments, or None if the token is invalid
+    """
+    if hasattr(request, 'i_cal_scope'):
+        return request.i_cal_scope
+    request.i_cal_scope = None
+    # The role of the user is found with the same query as the token
+    row = ICalToken.objects.filter(pk=token).values_list(*principal_lookups('user__')).first()
+    if row is None:
+        return None
+    request.principal = principal = principal_from_row(row)
+    if principal.is_student:
+        scope = ('class', principal.class_id)
+        occupancy_list = Occupancy.objects.filter(subject___class_id=principal.class_id)
+        series_list = OccupancySeries.objects.filter(subject___class_id=principal.class_id)
+    elif principal.is_teacher:
+        scope = ('teacher', principal.teacher_id)
+        occupancy_list = Occupancy.objects.filter(teacher_id=principal.teacher_id)
+        series_list = OccupancySeries.objects.filter(teacher_id=principal.teacher_id)
+    else:
+        return None
+    # The state covers the deleted rows too, so that a deletion moves it forward. The hard deletions and the renames
+    # leave no row behind, they are recorded by `ical.touch_feeds`.
+    modifications = OccupancyModification.objects.filter(occupancy__in=occupancy_list).aggregate(
+        count=Count('id'),
+        last=Max('modification_date'),
+    )
+    series = series_list.aggregate(count=Count('id'), last=Max('modification_date'))
+    changes = feed_changes([scope, ALL_FEEDS])
+    last_modified = max((d for d in (modifications['last'], series['last'], *changes.values()) if d), default=None)
+    state = (principal.user_id, modifications['count'], series['count'], last_modified)
+    # Deleted occupancies are only shown when they cancel an occurrence of a series
+    occupancy_list = occupancy_list.filter(Q(deleted=False) | Q(series__isnull=False))
+    series_list = series_list.filter(deleted=False)
+    request.i_cal_scope = (occupancy_list, series_list, state, fragments_version(changes))
+    return request.i_cal_scope
+
+
+def _i_cal_etag(request, token):
+    scope = _i_cal_scope(request, token)
+    if scope is None:
+        return None
+    return hashlib.md5(repr(scope[2]).encode()).hexdigest()
+
+
+def _i_cal_last_modified(request, token):
+    scope = _i_cal_scope(request, token)
+    if scope is None:
+        return None
+    return scope[2][-1]
 
 
+@condition(etag_func=_i_cal_etag, last_modified_func=_i_cal_last_modified)
 def i_cal_feed(request, token):
-    try:
-        token = ICalToken.objects.get(pk=token)
-        try:
-            student = Student.objects.get(id=token.user.id)
-            occupancy_list = Occupancy.objects.filter(subject___class=student._class)
-        except Student.DoesNotExist:
-            try:
-                teacher = Teacher.objects.get(id=token.user.id)
-                occupancy_list = Occupancy.objects.filter(teacher=teacher)
-            except Teacher.DoesNotExist:
-                return HttpResponse('Invalid token', status=403)
-        calendar = Calendar()
-        for occ in occupancy_list:
-            occ_mod_created = OccupancyModification.objects.get(occupancy=occ, modification_type='INSERT')
-            organizer = Organizer(
-                common_name=f'{occ.teacher.first_name} {occ.teacher.last_name}',
-                email=occ.teacher.email,
-            )
-            if occ.group_number:
-                attendee_name = f'{occ.subject.name} - Groupe {occ.group_number}'
-            else:
-                attendee_name = f'{occ.subject._class.name}'
-            attendees = [
-                Attendee(
-                    common_name=attendee_name,
-                    email='',
-                )
-            ]
-            e = Event(
-                name=occ.name,
-                begin=occ.start_datetime,
-                duration=occ.duration,
-                created=occ_mod_created.modification_date,
-                location=occ.classroom.name,
-                organizer=organizer,
-                attendees=attendees,
-            )
-            occ_last_modification = OccupancyModification.objects.filter(
-                occupancy=occ,
-                modification_type='EDIT'
-            ).order_by('-modification_date')
-            if len(occ_last_modification) > 0:
-                e.last_modified = occ_last_modification[0].modification_date
-            calendar.events.add(e)
-        response = HttpResponse(str(calendar), content_type='text/calendar')
-        response['Content-Disposition'] = 'attachment; filename="calendar.ics"'
-        return response
-    except ICalToken.DoesNotExist:
-        return HttpResponse('Token does not exist', status=403)
+    scope = _i_cal_scope(request, token)
+    if scope is None:
+        if not ICalToken.objects.filter(pk=token).exists():
+            return HttpResponse('Token does not exist', status=403)
+        return HttpResponse('Invalid token', status=403)
+    occupancy_list, series_list, _, version = scope
+    response = StreamingHttpResponse(feed_fragments(occupancy_list, series_list, version),
+                                     content_type='text/calendar')
+    response['Content-Disposition'] = 'attachment; filename="calendar.ics"'
+    return response
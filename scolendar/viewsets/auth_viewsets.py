@@ -7,16 +7,28 @@ from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.response import Response as RF_Response
 
 from scolendar.errors import error_codes
-from scolendar.models import Student, Teacher
+from scolendar.tokens import Principal, cached_token, get_principal, token_cache
 
 
 class TokenHandlerMixin:
     """
     Removes code duplication related to getting the token from the HTTP Header and parsing it.
 
-    If a token is received, return the model instance of that token.
+    If a token is received, return the model instance of that token. The token and its user come from the token cache
+    (see `scolendar.tokens.cached_token`), so checking `token.user.is_staff` does not query the database.
     """
 
+    def _get_principal(self, request) -> Principal:
+        """
+        Gets the role, teacher id and class id of the user behind a request, resolved once along with the token
+
+        :raise Token.DoesNotExist: if the token is missing or invalid
+        :raise AttributeError: if the header is malformed
+        """
+        if getattr(request, 'principal', None) is None:
+            self._get_token(request)
+        return request.principal
+
     @staticmethod
     def _get_token(request) -> Token:
         received = request.META.get('HTTP_AUTHORIZATION')
@@ -26,7 +38,9 @@ class TokenHandlerMixin:
         if data[0] != 'Bearer':
             raise AttributeError('Token error')
         rec_token = data[-1]
-        return Token.objects.get(key=rec_token)
+        token = cached_token(rec_token)
+        request.principal = token.principal
+        return token
 
 
 class AuthViewSet(ObtainAuthToken, TokenHandlerMixin):
@@ -81,20 +95,6 @@ class AuthViewSet(ObtainAuthToken, TokenHandlerMixin):
     def post(self, request, *args, **kwargs):
         user = authenticate(request, username=request.data['username'], password=request.data['password'])
         if user is not None:
-            def get_user_type():
-                if user.is_staff:
-                    return 'ADM'
-                try:
-                    Teacher.objects.get(id=user.id)
-                    return 'TEA'
-                except Teacher.DoesNotExist:
-                    pass
-                try:
-                    Student.objects.get(id=user.id)
-                    return 'STU'
-                except Student.DoesNotExist:
-                    pass
-
             token, created = Token.objects.get_or_create(user=user)
             response = {
                 'status': 'success',
@@ -103,7 +103,7 @@ class AuthViewSet(ObtainAuthToken, TokenHandlerMixin):
                     'id': user.id,
                     'first_name': user.first_name,
                     'last_name': user.last_name,
-                    'kind': get_user_type(),
+                    'kind': get_principal(user).role,
                 },
             }
             login(request, user)
@@ -146,6 +146,7 @@ class AuthViewSet(ObtainAuthToken, TokenHandlerMixin):
             token = self._get_token(request)
             if token.user:
                 token.delete()
+                token_cache.invalidate(token.key)
                 logout(request)
                 return RF_Response({'status': 'success'})
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'}, status=status.HTTP_403_FORBIDDEN)
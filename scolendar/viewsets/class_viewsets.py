@@ -1,11 +1,6 @@
-from datetime import datetime, timedelta
-
-from django.conf import settings
-from django.db.models import Q
-from django.db.models.functions import Trunc
-from drf_yasg.openapi import Schema, Response, Parameter, TYPE_OBJECT, TYPE_ARRAY, TYPE_INTEGER, TYPE_STRING, IN_QUERY
+from drf_yasg.openapi import Schema, Response, Parameter, TYPE_OBJECT, TYPE_ARRAY, TYPE_INTEGER, TYPE_NUMBER, \
+    TYPE_STRING, IN_QUERY
 from drf_yasg.utils import swagger_auto_schema
-from pytz import timezone
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import NotFound
@@ -13,12 +8,16 @@ from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response as RF_Response
 from rest_framework.views import APIView
 
+from scolendar.deletion import delete_all_or_none
 from scolendar.errors import error_codes
-from scolendar.models import Classroom, levels, Class, Occupancy
+from scolendar.hours import students_hours, student_total, total_hours
+from scolendar.models import Classroom, levels, Class, Student, StudentSubject
 from scolendar.paginations import ClassResultSetPagination
+from scolendar.search import search
 from scolendar.serializers import ClassSerializer, ClassCreationSerializer
+from scolendar.timeline import get_days
 from scolendar.viewsets.auth_viewsets import TokenHandlerMixin
-from scolendar.viewsets.common.schemas import occupancies_schema
+from scolendar.viewsets.common.schemas import occupancies_schema, hours_schema
 
 
 class ClassViewSet(GenericAPIView, TokenHandlerMixin):
@@ -31,9 +30,7 @@ class ClassViewSet(GenericAPIView, TokenHandlerMixin):
         query = self.request.query_params.get('query', None)
         if query:
             if len(query) >= 3:
-                queryset = queryset.filter(
-                    Q(name__unaccent__icontains=query)
-                )
+                return search(queryset, query).order_by('-search_rank', 'name')
         return queryset.order_by('name')
 
     @swagger_auto_schema(
@@ -49,7 +46,13 @@ class ClassViewSet(GenericAPIView, TokenHandlerMixin):
                     type=TYPE_OBJECT,
                     properties={
                         'status': Schema(type=TYPE_STRING, example='success'),
-                        'total': Schema(type=TYPE_INTEGER, description='Total number of classes', example=166),
+                        'total': Schema(type=TYPE_INTEGER,
+                                        description='Total number of classes (estimated with `count=estimate`, '
+                                                    'null with `count=none`)',
+                                        example=166),
+                        'next_cursor': Schema(type=TYPE_STRING,
+                                              description='Position of the next page, only returned with the `cursor` '
+                                                          'parameter (null on the last page)'),
                         'classes': Schema(
                             type=TYPE_ARRAY,
                             items=Schema(
@@ -115,6 +118,8 @@ class ClassViewSet(GenericAPIView, TokenHandlerMixin):
                 'total': response['count'],
                 'classes': response['results'],
             }
+            if 'next_cursor' in response:
+                data['next_cursor'] = response['next_cursor']
             return RF_Response(data)
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
@@ -125,7 +130,7 @@ class ClassViewSet(GenericAPIView, TokenHandlerMixin):
         except NotFound:
             data = {
                 'status': 'success',
-                'total': len(self.get_queryset()),
+                'total': self.paginator.get_count(self.get_queryset()),
                 'teachers': [],
             }
             return RF_Response(data)
@@ -277,8 +282,8 @@ class ClassViewSet(GenericAPIView, TokenHandlerMixin):
                 )
             ),
             422: Response(
-                description='Class is still used by a subject (code=`ClassUsed`)\nA student is still in this class '
-                            '(code=`StudentInClass`)',
+                description='The body is not a list of IDs (code=`MalformedData`)\nClass is still used by a subject '
+                            '(code=`ClassUsed`)\nA student is still in this class (code=`StudentInClass`)',
                 schema=Schema(
                     title='ErrorResponse',
                     type=TYPE_OBJECT,
@@ -310,15 +315,13 @@ class ClassViewSet(GenericAPIView, TokenHandlerMixin):
                 return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
                                    status=status.HTTP_401_UNAUTHORIZED)
 
-            def delete_class(class_id: int):
-                _class = Class.objects.get(id=class_id)
-                _class.delete()
-
-            for post_id in request.data:
-                try:
-                    delete_class(post_id)
-                except Class.DoesNotExist:
-                    return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
+            try:
+                deleted = delete_all_or_none(Class.objects.all(), request.data)
+            except ValueError:
+                return RF_Response({'status': 'error', 'code': 'MalformedData'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if not deleted:
+                return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
             return RF_Response({'status': 'success'})
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
@@ -602,59 +605,104 @@ class ClassOccupancyViewSet(APIView, TokenHandlerMixin):
                                    status=status.HTTP_403_FORBIDDEN)
             try:
                 _class = Class.objects.get(id=class_id)
+                return RF_Response({'status': 'success', 'days': get_days(request, subject___class=_class)})
+            except Class.DoesNotExist:
+                return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
+        except Token.DoesNotExist:
+            return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
+                               status=status.HTTP_401_UNAUTHORIZED)
+        except AttributeError:
+            return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
+                               status=status.HTTP_401_UNAUTHORIZED)
 
-                def get_days() -> list:
-                    start_timestamp = request.query_params.get('start', None)
-                    end_timestamp = request.query_params.get('end', None)
-                    nb_per_day = int(request.query_params.get('occupancies_per_day', 0))
 
-                    days = []
-                    occ = Occupancy.objects.filter(
-                        subject___class=_class,
-                        deleted=False
-                    ).order_by('start_datetime').annotate(day=Trunc('start_datetime', 'day'))
-                    if start_timestamp:
-                        occ = occ.filter(
-                            start_datetime__gte=datetime.fromtimestamp(
-                                int(start_timestamp),
-                                tz=timezone(settings.TIME_ZONE)
-                            )
-                        )
-                    if end_timestamp:
-                        occ = occ.filter(
-                            end_datetime__lte=datetime.fromtimestamp(
-                                int(end_timestamp),
-                                tz=timezone(settings.TIME_ZONE)
+class ClassHoursViewSet(APIView, TokenHandlerMixin):
+    @swagger_auto_schema(
+        operation_summary='Gets the hours attended by each student of a class.',
+        operation_description='Note : only users with the role `administrator` should be able to access this route.\n'
+                              'A student attends the sessions of the whole class, and the ones of their own group in '
+                              'each subject. The students are sorted by name.',
+        responses={
+            200: Response(
+                description='Hours of the students',
+                schema=Schema(
+                    title='ClassHoursResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='success'),
+                        'students': Schema(
+                            type=TYPE_ARRAY,
+                            items=Schema(
+                                type=TYPE_OBJECT,
+                                properties={
+                                    'id': Schema(type=TYPE_INTEGER, example=166),
+                                    'first_name': Schema(type=TYPE_STRING, example='John'),
+                                    'last_name': Schema(type=TYPE_STRING, example='Doe'),
+                                    'total_hours': Schema(type=TYPE_NUMBER, example=166.5),
+                                    'hours': hours_schema,
+                                },
+                                required=['id', 'first_name', 'last_name', 'total_hours', 'hours', ]
                             )
-                        )
-                    for day in (occ[0].day + timedelta(n) for n in
-                                range((occ[len(occ) - 1].day - occ[0].day).days + 2)):
-                        day_occupancies = occ.filter(start_datetime__day=day.day)
-                        if len(day_occupancies) == 0:
-                            continue
-                        if nb_per_day != 0:
-                            day_occupancies = day_occupancies[:nb_per_day]
-                        occ_list = []
-                        for o in day_occupancies:
-                            event = {
-                                'id': o.id,
-                                'group_name': f'Groupe {o.group_number}',
-                                'subject_name': o.subject.name,
-                                'teacher_name': f'{o.teacher.first_name} {o.teacher.last_name}',
-                                'start': o.start_datetime.timestamp(),
-                                'end': o.end_datetime.timestamp(),
-                                'occupancy_type': o.occupancy_type,
-                                'name': o.name,
-                            }
-                            if o.subject:
-                                event['class_name'] = o.subject._class.name
-                            if o.classroom:
-                                event['classroom_name'] = o.classroom.name
-                            occ_list.append(event)
-                        days.append({'date': day.strftime("%d-%m-%Y"), 'occupancies': occ_list})
-                    return days
-
-                return RF_Response({'status': 'success', 'days': get_days()})
+                        ),
+                    },
+                    required=['status', 'students', ]
+                )
+            ),
+            401: Response(
+                description='Invalid token (code=`InvalidCredentials`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+            403: Response(
+                description='Insufficient rights (code=`InsufficientAuthorization`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+            404: Response(
+                description='Invalid ID(s) (code=`InvalidID`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+        },
+        tags=['Classes', ]
+    )
+    def get(self, request, class_id):
+        try:
+            token = self._get_token(request)
+            if not token.user.is_staff:
+                return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
+                                   status=status.HTTP_403_FORBIDDEN)
+            try:
+                _class = Class.objects.get(id=class_id)
+                subjects = students_hours(
+                    StudentSubject.objects.filter(student___class=_class).select_related('subject'))
+                students = []
+                for student in Student.objects.filter(_class=_class).order_by('last_name', 'first_name', 'id') \
+                        .values('id', 'first_name', 'last_name'):
+                    hours = student_total(subjects.get(student['id'], []))
+                    students.append({**student, 'total_hours': total_hours(hours), 'hours': hours})
+                return RF_Response({'status': 'success', 'students': students})
             except Class.DoesNotExist:
                 return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
         except Token.DoesNotExist:
@@ -1,11 +1,6 @@
-from datetime import datetime, timedelta
-
-from django.conf import settings
-from django.db.models import Q
-from django.db.models.functions import Trunc
+from django.core.exceptions import ValidationError
 from drf_yasg.openapi import Schema, Response, Parameter, TYPE_OBJECT, TYPE_ARRAY, TYPE_INTEGER, TYPE_STRING, IN_QUERY
 from drf_yasg.utils import swagger_auto_schema
-from pytz import timezone
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import NotFound
@@ -13,10 +8,15 @@ from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response as RF_Response
 from rest_framework.views import APIView
 
+from scolendar.deletion import delete_all_or_none
 from scolendar.errors import error_codes
-from scolendar.models import Classroom, Occupancy
+from scolendar.models import Classroom
 from scolendar.paginations import ClassroomResultSetPagination
+from scolendar.rooms import free_classrooms
+from scolendar.search import search
 from scolendar.serializers import ClassroomCreationSerializer, ClassroomSerializer
+from scolendar.timeline import get_days, parse_timestamp
+from scolendar.validators import end_datetime_validator, max_duration_validator, start_datetime_validator
 from scolendar.viewsets.auth_viewsets import TokenHandlerMixin
 from scolendar.viewsets.common.schemas import occupancies_schema
 
@@ -31,9 +31,7 @@ class ClassroomViewSet(GenericAPIView, TokenHandlerMixin):
         query = self.request.query_params.get('query', None)
         if query:
             if len(query) >= 3:
-                queryset = queryset.filter(
-                    Q(name__unaccent__icontains=query)
-                )
+                return search(queryset, query).order_by('-search_rank', 'name')
         return queryset.order_by('name')
 
     @swagger_auto_schema(
@@ -51,8 +49,12 @@ class ClassroomViewSet(GenericAPIView, TokenHandlerMixin):
                         'status': Schema(type=TYPE_STRING,
                                          example='success'),
                         'total': Schema(type=TYPE_INTEGER,
-                                        description='Total number of classrooms',
+                                        description='Total number of classrooms (estimated with `count=estimate`, '
+                                                    'null with `count=none`)',
                                         example=166),
+                        'next_cursor': Schema(type=TYPE_STRING,
+                                              description='Position of the next page, only returned with the `cursor` '
+                                                          'parameter (null on the last page)'),
                         'classrooms': Schema(type=TYPE_ARRAY,
                                              items=Schema(
                                                  title='Classroom',
@@ -128,6 +130,8 @@ class ClassroomViewSet(GenericAPIView, TokenHandlerMixin):
                 'total': response['count'],
                 'classrooms': response['results'],
             }
+            if 'next_cursor' in response:
+                data['next_cursor'] = response['next_cursor']
             return RF_Response(data)
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
@@ -138,7 +142,7 @@ class ClassroomViewSet(GenericAPIView, TokenHandlerMixin):
         except NotFound:
             data = {
                 'status': 'success',
-                'total': len(self.get_queryset()),
+                'total': self.paginator.get_count(self.get_queryset()),
                 'teachers': [],
             }
             return RF_Response(data)
@@ -296,7 +300,8 @@ class ClassroomViewSet(GenericAPIView, TokenHandlerMixin):
                 )
             ),
             422: Response(
-                description='Invalid ID(s) (code=`ClassroomUsed`)',
+                description='The body is not a list of IDs (code=`MalformedData`)\n'
+                            'Invalid ID(s) (code=`ClassroomUsed`)',
                 schema=Schema(
                     title='ErrorResponse',
                     type=TYPE_OBJECT,
@@ -329,16 +334,13 @@ class ClassroomViewSet(GenericAPIView, TokenHandlerMixin):
                 return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
                                    status=status.HTTP_401_UNAUTHORIZED)
 
-            def delete_classroom(classroom_id: int):
-                classroom = Classroom.objects.get(id=classroom_id)
-                classroom.delete()
-
-            for post_id in request.data:
-                try:
-                    delete_classroom(post_id)
-                except Classroom.DoesNotExist:
-                    return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
-
+            try:
+                deleted = delete_all_or_none(Classroom.objects.all(), request.data)
+            except ValueError:
+                return RF_Response({'status': 'error', 'code': 'MalformedData'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if not deleted:
+                return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
             return RF_Response({'status': 'success'})
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
@@ -607,61 +609,131 @@ class ClassroomOccupancyViewSet(APIView, TokenHandlerMixin):
                                    status=status.HTTP_403_FORBIDDEN)
             try:
                 classroom = Classroom.objects.get(id=classroom_id)
+                return RF_Response({'status': 'success', 'days': get_days(request, classroom=classroom)})
+            except Classroom.DoesNotExist:
+                return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
+        except Token.DoesNotExist:
+            return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
+                               status=status.HTTP_401_UNAUTHORIZED)
+        except AttributeError:
+            return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
+                               status=status.HTTP_401_UNAUTHORIZED)
 
-                def get_days() -> list:
-                    start_timestamp = request.query_params.get('start', None)
-                    end_timestamp = request.query_params.get('end', None)
-                    nb_per_day = int(request.query_params.get('occupancies_per_day', 0))
 
-                    days = []
-                    occ = Occupancy.objects.filter(
-                        classroom=classroom,
-                        deleted=False
-                    ).order_by('start_datetime').annotate(day=Trunc('start_datetime', 'day'))
-                    if start_timestamp:
-                        occ = occ.filter(
-                            start_datetime__gte=datetime.fromtimestamp(
-                                int(start_timestamp),
-                                tz=timezone(settings.TIME_ZONE)
-                            )
-                        )
-                    if end_timestamp:
-                        occ = occ.filter(
-                            end_datetime__lte=datetime.fromtimestamp(
-                                int(end_timestamp),
-                                tz=timezone(settings.TIME_ZONE)
-                            )
-                        )
-                    for day in (occ[0].day + timedelta(n) for n in
-                                range((occ[len(occ) - 1].day - occ[0].day).days + 2)):
-                        day_occupancies = occ.filter(start_datetime__day=day.day)
-                        if len(day_occupancies) == 0:
-                            continue
-                        if nb_per_day != 0:
-                            day_occupancies = day_occupancies[:nb_per_day]
-                        occ_list = []
-                        for o in day_occupancies:
-                            event = {
-                                'id': o.id,
-                                'group_name': f'Groupe {o.group_number}',
-                                'subject_name': o.subject.name,
-                                'teacher_name': f'{o.teacher.first_name} {o.teacher.last_name}',
-                                'start': o.start_datetime.timestamp(),
-                                'end': o.end_datetime.timestamp(),
-                                'occupancy_type': o.occupancy_type,
-                                'name': o.name,
-                            }
-                            if o.subject:
-                                event['class_name'] = o.subject._class.name
-                            if o.classroom:
-                                event['classroom_name'] = o.classroom.name
-                            occ_list.append(event)
-                        days.append({'date': day.strftime("%d-%m-%Y"), 'occupancies': occ_list})
-                    return days
+class ClassroomAvailabilityViewSet(APIView, TokenHandlerMixin):
+    @swagger_auto_schema(
+        operation_summary='Finds the classrooms which are free during a time slot.',
+        operation_description='Note : only users with the role `administrator`, or professors, should be able to access'
+                              ' this route.\nOnly the classrooms holding at least `capacity` people are returned, the '
+                              'ones whose capacity fits it the most tightly first.',
+        responses={
+            200: Response(
+                description='The free classrooms.',
+                schema=Schema(
+                    title='FreeClassroomList',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='success'),
+                        'classrooms': Schema(
+                            type=TYPE_ARRAY,
+                            items=Schema(
+                                title='Classroom',
+                                type=TYPE_OBJECT,
+                                properties={
+                                    'id': Schema(type=TYPE_INTEGER, example=166),
+                                    'name': Schema(type=TYPE_STRING, example='B12'),
+                                    'capacity': Schema(type=TYPE_INTEGER, example=166),
+                                },
+                                required=['id', 'name', 'capacity', ]
+                            ),
+                        ),
+                    },
+                    required=['status', 'classrooms', ]
+                )
+            ),
+            401: Response(
+                description='Invalid token (code=`InvalidCredentials`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+            403: Response(
+                description='Insufficient rights (code=`InsufficientAuthorization`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+            422: Response(
+                description='Invalid parameters (code=`MalformedData`)\nEnd before start (code=`EndBeforeStart`)\n'
+                            'Outside of the opening hours, or too long (code=`InvalidTimeSlot`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+        },
+        tags=['Classrooms', 'role-professor'],
+        manual_parameters=[
+            Parameter(name='start', description='Start timestamp of the time slot', in_=IN_QUERY, type=TYPE_INTEGER,
+                      required=True),
+            Parameter(name='end', description='End timestamp of the time slot', in_=IN_QUERY, type=TYPE_INTEGER,
+                      required=True),
+            Parameter(name='capacity', description='Number of people the classroom must hold', in_=IN_QUERY,
+                      type=TYPE_INTEGER, required=False),
+        ],
+    )
+    def get(self, request, *args, **kwargs):
+        try:
+            principal = self._get_principal(request)
+            if not principal.is_staff and not principal.is_teacher:
+                return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
+                                   status=status.HTTP_403_FORBIDDEN)
 
-                return RF_Response({'status': 'success', 'days': get_days()})
-            except Classroom.DoesNotExist:
-                return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
+            query_params = request.query_params
+            try:
+                start = parse_timestamp(query_params['start'])
+                end = parse_timestamp(query_params['end'])
+                capacity = int(query_params.get('capacity') or 0)
+            except (KeyError, ValueError, OverflowError, OSError):
+                return RF_Response({'status': 'error', 'code': 'MalformedData'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if start is None or end is None:
+                return RF_Response({'status': 'error', 'code': 'MalformedData'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if end <= start:
+                return RF_Response({'status': 'error', 'code': 'EndBeforeStart'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            try:
+                start_datetime_validator(start)
+                end_datetime_validator(end)
+                max_duration_validator(end - start)
+            except ValidationError:
+                return RF_Response({'status': 'error', 'code': 'InvalidTimeSlot'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+            return RF_Response({
+                'status': 'success',
+                'classrooms': [
+                    {'id': c.id, 'name': c.name, 'capacity': c.capacity} for c in free_classrooms(start, end, capacity)
+                ],
+            })
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
                                status=status.HTTP_401_UNAUTHORIZED)
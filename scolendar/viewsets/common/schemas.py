@@ -1,4 +1,4 @@
-from drf_yasg.openapi import Schema, TYPE_OBJECT, TYPE_ARRAY, TYPE_STRING, TYPE_BOOLEAN, TYPE_INTEGER
+from drf_yasg.openapi import Schema, TYPE_OBJECT, TYPE_ARRAY, TYPE_STRING, TYPE_BOOLEAN, TYPE_INTEGER, TYPE_NUMBER
 
 from scolendar.models import occupancy_list
 
@@ -17,6 +17,36 @@ teacher_list_schema = Schema(
     )
 )
 
+hours_schema = Schema(
+    type=TYPE_OBJECT,
+    properties={
+        'cm': Schema(type=TYPE_NUMBER, example=16.5),
+        'td': Schema(type=TYPE_NUMBER, example=24),
+        'tp': Schema(type=TYPE_NUMBER, example=12),
+        'projet': Schema(type=TYPE_NUMBER, example=0),
+        'administration': Schema(type=TYPE_NUMBER, example=0),
+        'external': Schema(type=TYPE_NUMBER, example=0),
+    },
+    required=['cm', 'td', 'tp', 'projet', 'administration', 'external', ]
+)
+
+services_schema = Schema(
+    type=TYPE_ARRAY,
+    items=Schema(
+        type=TYPE_OBJECT,
+        properties={
+            'class': Schema(type=TYPE_STRING, example='L3 INFORMATIQUE'),
+            'cm': Schema(type=TYPE_NUMBER, example=16.5),
+            'projet': Schema(type=TYPE_NUMBER, example=0),
+            'td': Schema(type=TYPE_NUMBER, example=24),
+            'tp': Schema(type=TYPE_NUMBER, example=12),
+            'administration': Schema(type=TYPE_NUMBER, example=0),
+            'external': Schema(type=TYPE_NUMBER, example=0),
+        },
+        required=['class', 'cm', 'projet', 'td', 'tp', 'administration', 'external', ]
+    )
+)
+
 occupancies_schema = Schema(
     title='Occupancies',
     type=TYPE_OBJECT,
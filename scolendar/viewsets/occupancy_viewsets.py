@@ -1,17 +1,18 @@
-from datetime import datetime, timedelta
+from datetime import timedelta
 
-from django.conf import settings
-from django.db.models.functions import Trunc
-from drf_yasg.openapi import Schema, Response, Parameter, TYPE_OBJECT, TYPE_INTEGER, TYPE_STRING, IN_QUERY
+from drf_yasg.openapi import Schema, Response, Parameter, TYPE_OBJECT, TYPE_ARRAY, TYPE_INTEGER, TYPE_STRING, \
+    IN_QUERY
 from drf_yasg.utils import swagger_auto_schema
-from pytz import timezone
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response as RF_Response
 from rest_framework.views import APIView
 
+from scolendar.availability import MAX_WINDOW, busy_condition, free_slots
 from scolendar.errors import error_codes
-from scolendar.models import Classroom, Class, Occupancy
+from scolendar.models import Classroom, Class, Occupancy, Subject, Teacher, occupancy_list
+from scolendar.occupancies import bulk_create_occupancies
+from scolendar.timeline import get_days, parse_timestamp
 from scolendar.viewsets.auth_viewsets import TokenHandlerMixin
 from scolendar.viewsets.common.schemas import occupancies_schema
 
@@ -94,56 +95,113 @@ class OccupancyViewSet(APIView, TokenHandlerMixin):
                 return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
                                    status=status.HTTP_401_UNAUTHORIZED)
 
-            def get_days() -> list:
-                start_timestamp = request.query_params.get('start', None)
-                end_timestamp = request.query_params.get('end', None)
-                nb_per_day = int(request.query_params.get('occupancies_per_day', 0))
+            return RF_Response({'status': 'success', 'days': get_days(request)})
+        except Token.DoesNotExist:
+            return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
+                               status=status.HTTP_401_UNAUTHORIZED)
+        except AttributeError:
+            return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
+                               status=status.HTTP_401_UNAUTHORIZED)
 
-                days = []
-                occ = Occupancy.objects.filter(deleted=False).order_by('start_datetime').annotate(
-                    day=Trunc('start_datetime', 'day'))
-                if start_timestamp:
-                    occ = occ.filter(
-                        start_datetime__gte=datetime.fromtimestamp(
-                            int(start_timestamp),
-                            tz=timezone(settings.TIME_ZONE)
-                        )
-                    )
-                if end_timestamp:
-                    occ = occ.filter(
-                        end_datetime__lte=datetime.fromtimestamp(
-                            int(end_timestamp),
-                            tz=timezone(settings.TIME_ZONE)
-                        )
-                    )
-                for day in (occ[0].day + timedelta(n) for n in
-                            range((occ[len(occ) - 1].day - occ[0].day).days + 2)):
-                    day_occupancies = occ.filter(start_datetime__day=day.day)
-                    if len(day_occupancies) == 0:
-                        continue
-                    if nb_per_day != 0:
-                        day_occupancies = day_occupancies[:nb_per_day]
-                    occ_list = []
-                    for o in day_occupancies:
-                        event = {
-                            'id': o.id,
-                            'group_name': f'Groupe {o.group_number}',
-                            'subject_name': o.subject.name,
-                            'teacher_name': f'{o.teacher.first_name} {o.teacher.last_name}',
-                            'start': o.start_datetime.timestamp(),
-                            'end': o.end_datetime.timestamp(),
-                            'occupancy_type': o.occupancy_type,
-                            'name': o.name,
-                        }
-                        if o.subject:
-                            event['class_name'] = o.subject._class.name
-                        if o.classroom:
-                            event['classroom_name'] = o.classroom.name
-                        occ_list.append(event)
-                    days.append({'date': day.strftime("%d-%m-%Y"), 'occupancies': occ_list})
-                return days
+    @swagger_auto_schema(
+        operation_summary='Creates many occupancies at once.',
+        operation_description='Note : only users with the role `administrator` should be able to access this route.\n'
+                              'The valid occupancies are created even if some others are rejected. The rejected ones '
+                              'are returned with their index in the request and the reason they were rejected.',
+        responses={
+            201: Response(
+                description='Occupancies created',
+                schema=Schema(
+                    title='OccupancyBulkCreationResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='success'),
+                        'created': Schema(type=TYPE_ARRAY, items=Schema(type=TYPE_INTEGER, example=166)),
+                        'errors': Schema(
+                            type=TYPE_ARRAY,
+                            items=Schema(
+                                type=TYPE_OBJECT,
+                                properties={
+                                    'index': Schema(type=TYPE_INTEGER, example=0),
+                                    'code': Schema(type=TYPE_STRING, enum=error_codes),
+                                },
+                            ),
+                        ),
+                    },
+                    required=['status', 'created', 'errors', ]
+                )
+            ),
+            401: Response(
+                description='Invalid token (code=`InvalidCredentials`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+            403: Response(
+                description='Insufficient rights (code=`InsufficientAuthorization`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+            422: Response(
+                description='Invalid request body (code=`MalformedData`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+        },
+        tags=['Occupancies', ],
+        request_body=Schema(
+            title='OccupancyBulkCreationRequest',
+            type=TYPE_ARRAY,
+            items=Schema(
+                type=TYPE_OBJECT,
+                properties={
+                    'subject_id': Schema(type=TYPE_INTEGER, example=166),
+                    'classroom_id': Schema(type=TYPE_INTEGER, example=166),
+                    'teacher_id': Schema(type=TYPE_INTEGER, example=166),
+                    'group_number': Schema(type=TYPE_INTEGER, example=1),
+                    'start': Schema(type=TYPE_INTEGER, example=1587776227),
+                    'end': Schema(type=TYPE_INTEGER, example=1587776227),
+                    'name': Schema(type=TYPE_STRING, example='TD Chapitre 1'),
+                    'description': Schema(type=TYPE_STRING, example=''),
+                    'occupancy_type': Schema(type=TYPE_STRING, enum=occupancy_list),
+                },
+                required=['subject_id', 'classroom_id', 'teacher_id', 'start', 'end', 'name', 'occupancy_type', ]
+            ),
+        ),
+    )
+    def post(self, request, *args, **kwargs):
+        try:
+            token = self._get_token(request)
+            if not token.user.is_staff:
+                return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
+                                   status=status.HTTP_403_FORBIDDEN)
 
-            return RF_Response({'status': 'success', 'days': get_days()})
+            if not isinstance(request.data, list):
+                return RF_Response({'status': 'error', 'code': 'MalformedData'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            created, errors = bulk_create_occupancies(request.data)
+            return RF_Response({'status': 'success', 'created': created, 'errors': errors},
+                               status=status.HTTP_201_CREATED)
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
                                status=status.HTTP_401_UNAUTHORIZED)
@@ -357,3 +415,204 @@ class OccupancyDetailViewSet(APIView, TokenHandlerMixin):
         except AttributeError:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
                                status=status.HTTP_401_UNAUTHORIZED)
+
+
+def _all_exist(model, ids) -> bool:
+    return model.objects.filter(id__in=ids).count() == len(set(ids))
+
+
+class AvailabilityViewSet(APIView, TokenHandlerMixin):
+    @swagger_auto_schema(
+        operation_summary='Finds the common free slots of several resources.',
+        operation_description='Note : only users with the role `administrator` or `professor` should be able to access '
+                              'this route.\n'
+                              'The resources are the given teachers, classes, group of a subject and classrooms. A '
+                              'slot is a time interval during the opening hours where none of them is occupied, '
+                              'lasting at least `duration` seconds.',
+        responses={
+            200: Response(
+                description='Free slots, sorted',
+                schema=Schema(
+                    title='AvailabilityResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='success'),
+                        'slots': Schema(
+                            type=TYPE_ARRAY,
+                            items=Schema(
+                                type=TYPE_OBJECT,
+                                properties={
+                                    'start': Schema(type=TYPE_INTEGER, example=1587776227),
+                                    'end': Schema(type=TYPE_INTEGER, example=1587776227),
+                                },
+                                required=['start', 'end', ]
+                            ),
+                        ),
+                    },
+                    required=['status', 'slots', ]
+                )
+            ),
+            401: Response(
+                description='Invalid token (code=`InvalidCredentials`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+            403: Response(
+                description='Insufficient rights (code=`InsufficientAuthorization`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+            404: Response(
+                description='Invalid ID(s) (code=`InvalidID`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+            422: Response(
+                description='Invalid parameters (code=`MalformedData`)\nEnd before start (code=`EndBeforeStart`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+        },
+        tags=['Occupancies', 'role-professor', ],
+        manual_parameters=[
+            Parameter(
+                name='start',
+                description='Start timestamp of the searched period',
+                in_=IN_QUERY,
+                type=TYPE_INTEGER,
+                required=True,
+            ),
+            Parameter(
+                name='end',
+                description='End timestamp of the searched period (at most a year after the start)',
+                in_=IN_QUERY,
+                type=TYPE_INTEGER,
+                required=True,
+            ),
+            Parameter(
+                name='duration',
+                description='Minimum duration of a slot, in seconds',
+                in_=IN_QUERY,
+                type=TYPE_INTEGER,
+                required=True,
+            ),
+            Parameter(
+                name='teacher_id',
+                description='A teacher who must be free (can be repeated)',
+                in_=IN_QUERY,
+                type=TYPE_INTEGER,
+                required=False,
+            ),
+            Parameter(
+                name='class_id',
+                description='A class which must be free as a whole (can be repeated)',
+                in_=IN_QUERY,
+                type=TYPE_INTEGER,
+                required=False,
+            ),
+            Parameter(
+                name='subject_id',
+                description='A subject whose class (or group, see `group_number`) must be free',
+                in_=IN_QUERY,
+                type=TYPE_INTEGER,
+                required=False,
+            ),
+            Parameter(
+                name='group_number',
+                description='The group of the subject which must be free, instead of its whole class',
+                in_=IN_QUERY,
+                type=TYPE_INTEGER,
+                required=False,
+            ),
+            Parameter(
+                name='classroom_id',
+                description='A classroom which must be free (can be repeated)',
+                in_=IN_QUERY,
+                type=TYPE_INTEGER,
+                required=False,
+            ),
+        ],
+    )
+    def get(self, request, *args, **kwargs):
+        try:
+            principal = self._get_principal(request)
+            if not principal.is_staff and not principal.is_teacher:
+                return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
+                                   status=status.HTTP_403_FORBIDDEN)
+
+            query_params = request.query_params
+            try:
+                start = parse_timestamp(query_params['start'])
+                end = parse_timestamp(query_params['end'])
+                duration = timedelta(seconds=int(query_params['duration']))
+                teacher_ids = [int(i) for i in query_params.getlist('teacher_id')]
+                class_ids = [int(i) for i in query_params.getlist('class_id')]
+                classroom_ids = [int(i) for i in query_params.getlist('classroom_id')]
+                subject_id = int(query_params['subject_id']) if query_params.get('subject_id') else None
+                group_number = int(query_params['group_number']) if query_params.get('group_number') else None
+            except (KeyError, ValueError, OverflowError, OSError):
+                return RF_Response({'status': 'error', 'code': 'MalformedData'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if start is None or end is None or duration <= timedelta(0) or end - start > MAX_WINDOW or \
+                    not (teacher_ids or class_ids or classroom_ids or subject_id is not None):
+                return RF_Response({'status': 'error', 'code': 'MalformedData'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if end <= start:
+                return RF_Response({'status': 'error', 'code': 'EndBeforeStart'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+            groups = []
+            if subject_id is not None:
+                try:
+                    subject = Subject.objects.only('_class_id', 'group_count').get(id=subject_id)
+                except Subject.DoesNotExist:
+                    return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
+                if group_number is not None and not 1 <= group_number <= subject.group_count:
+                    return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
+                groups.append((subject._class_id, subject.id, group_number))
+            if not (_all_exist(Teacher, teacher_ids) and _all_exist(Class, class_ids) and
+                    _all_exist(Classroom, classroom_ids)):
+                return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
+
+            condition = busy_condition(teacher_ids, class_ids, groups, classroom_ids)
+            return RF_Response({
+                'status': 'success',
+                'slots': [
+                    {'start': int(slot_start.timestamp()), 'end': int(slot_end.timestamp())}
+                    for slot_start, slot_end in free_slots(condition, start, end, duration)
+                ],
+            })
+        except Token.DoesNotExist:
+            return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
+                               status=status.HTTP_401_UNAUTHORIZED)
+        except AttributeError:
+            return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
+                               status=status.HTTP_401_UNAUTHORIZED)
@@ -13,7 +13,9 @@ from rest_framework.response import Response as RF_Response
 from rest_framework.views import APIView
 
 from scolendar.errors import error_codes
-from scolendar.models import occupancy_list, Student, OccupancyModification, ICalToken, Occupancy
+from scolendar.models import occupancy_list, OccupancyModification, ICalToken
+from scolendar.membership import student_filter
+from scolendar.timeline import get_next_occupancy, occupancy_event
 from scolendar.viewsets.auth_viewsets import TokenHandlerMixin
 
 
@@ -193,14 +195,14 @@ class ProfileLastOccupancyEdit(APIView, TokenHandlerMixin):
     )
     def get(self, request):
         try:
-            token = self._get_token(request)
-            if token.user.is_staff:
+            principal = self._get_principal(request)
+            if principal.is_staff:
                 return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
                                    status=status.HTTP_403_FORBIDDEN)
-            try:
-                student = Student.objects.get(id=token.user.id)
+            if principal.is_student:
                 occ_modifications = OccupancyModification.objects.filter(
-                    occupancy__subject__studentsubject__student=student).order_by('-modification_date')[:25]
+                    occupancy__subject__studentsubject__student_id=principal.user_id
+                ).order_by('-modification_date')[:25]
                 modifications = []
                 for occ in occ_modifications:
                     occupancy = {
@@ -220,8 +222,6 @@ class ProfileLastOccupancyEdit(APIView, TokenHandlerMixin):
                         'occupancy': occupancy
                     })
                 return RF_Response({'status': 'success', 'modification': modifications})
-            except Student.DoesNotExist:
-                pass
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
                                status=status.HTTP_401_UNAUTHORIZED)
@@ -233,7 +233,7 @@ class ProfileLastOccupancyEdit(APIView, TokenHandlerMixin):
 class ProfileNextOccupancy(APIView, TokenHandlerMixin):
     @swagger_auto_schema(
         operation_summary='Gets the user\'s next occupancy',
-        operation_description='',
+        operation_description='The occupancy is null when nothing is scheduled for the user.',
         responses={
             200: Response(
                 description='Success',
@@ -244,6 +244,7 @@ class ProfileNextOccupancy(APIView, TokenHandlerMixin):
                         'status': Schema(type=TYPE_STRING, example='success'),
                         'occupancy': Schema(
                             type=TYPE_OBJECT,
+                            x_nullable=True,
                             properties={
                                 'id': Schema(type=TYPE_INTEGER, example=166),
                                 'classroom_name': Schema(type=TYPE_STRING, example='B.001'),
@@ -300,27 +301,18 @@ class ProfileNextOccupancy(APIView, TokenHandlerMixin):
     )
     def get(self, request):
         try:
-            token = self._get_token(request)
-            if token.user.is_staff:
+            principal = self._get_principal(request)
+            if principal.is_staff:
                 return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
                                    status=status.HTTP_403_FORBIDDEN)
-            o = Occupancy.objects.filter(start_datetime__gte=datetime.now(tz=timezone(settings.TIME_ZONE))).order_by(
-                'start_datetime')[0]
-            event = {
-                'id': o.id,
-                'group_name': f'Groupe {o.group_number}',
-                'subject_name': o.subject.name,
-                'teacher_name': f'{o.teacher.first_name} {o.teacher.last_name}',
-                'start': o.start_datetime.timestamp(),
-                'end': o.end_datetime.timestamp(),
-                'occupancy_type': o.occupancy_type,
-                'name': o.name,
-            }
-            if o.subject:
-                event['class_name'] = o.subject._class.name
-            if o.classroom:
-                event['classroom_name'] = o.classroom.name
-            return RF_Response({'status': 'success', 'occupancy': event})
+            now = datetime.now(tz=timezone(settings.TIME_ZONE))
+            if principal.is_teacher:
+                o = get_next_occupancy(now, teacher_id=principal.teacher_id)
+            elif principal.is_student:
+                o = get_next_occupancy(now, student_filter(principal.user_id))
+            else:
+                o = None
+            return RF_Response({'status': 'success', 'occupancy': occupancy_event(o) if o else None})
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
                                status=status.HTTP_401_UNAUTHORIZED)
@@ -379,7 +371,7 @@ class ProfileICalFeed(APIView, TokenHandlerMixin):
             if token.user.is_staff:
                 return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
                                    status=status.HTTP_403_FORBIDDEN)
-            token, created = ICalToken.objects.get_or_create(user=token.user)
+            token, created = ICalToken.objects.get_or_create(user_id=token.user.id)
             return RF_Response({'status': 'success', 'url': f'{request.build_absolute_uri("/api/feeds/ical/")}{token}'})
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
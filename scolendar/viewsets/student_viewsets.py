@@ -1,14 +1,9 @@
-from datetime import datetime, timedelta
 
-from django.conf import settings
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
-from django.db.models import Q
-from django.db.models.functions import Trunc
-from drf_yasg.openapi import Schema, Response, Parameter, TYPE_OBJECT, TYPE_ARRAY, TYPE_INTEGER, TYPE_STRING, \
-    TYPE_BOOLEAN, IN_QUERY
+from drf_yasg.openapi import Schema, Response, Parameter, TYPE_OBJECT, TYPE_ARRAY, TYPE_INTEGER, TYPE_NUMBER, \
+    TYPE_STRING, TYPE_BOOLEAN, IN_QUERY
 from drf_yasg.utils import swagger_auto_schema
-from pytz import timezone
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import NotFound
@@ -16,12 +11,18 @@ from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response as RF_Response
 from rest_framework.views import APIView
 
+from scolendar.deletion import delete_all_or_none
 from scolendar.errors import error_codes
-from scolendar.models import Student, Class, StudentSubject, Occupancy, TeacherSubject, Teacher
+from scolendar.hours import students_hours, student_total, total_hours
+from scolendar.membership import student_filter
+from scolendar.models import Student, Class, StudentSubject, TeacherSubject
 from scolendar.paginations import StudentResultSetPagination
+from scolendar.search import search
 from scolendar.serializers import StudentCreationSerializer, StudentSerializer
+from scolendar.students import MalformedImport, import_students, iter_csv_rows, iter_json_rows
+from scolendar.timeline import get_days
 from scolendar.viewsets.auth_viewsets import TokenHandlerMixin
-from scolendar.viewsets.common.schemas import teacher_list_schema, occupancies_schema
+from scolendar.viewsets.common.schemas import teacher_list_schema, occupancies_schema, hours_schema
 
 
 class StudentViewSet(GenericAPIView, TokenHandlerMixin):
@@ -34,11 +35,7 @@ class StudentViewSet(GenericAPIView, TokenHandlerMixin):
         query = self.request.query_params.get('query', None)
         if query:
             if len(query) >= 3:
-                queryset = queryset.filter(
-                    Q(first_name__unaccent__icontains=query) |
-                    Q(last_name__unaccent__icontains=query) |
-                    Q(_class__name__unaccent__icontains=query)
-                )
+                return search(queryset, query).order_by('-search_rank', 'last_name', 'first_name')
         return queryset.order_by('last_name', 'first_name')
 
     @swagger_auto_schema(
@@ -56,8 +53,12 @@ class StudentViewSet(GenericAPIView, TokenHandlerMixin):
                         'status': Schema(type=TYPE_STRING,
                                          example='success'),
                         'total': Schema(type=TYPE_INTEGER,
-                                        description='Total number of students',
+                                        description='Total number of students (estimated with `count=estimate`, '
+                                                    'null with `count=none`)',
                                         example=166),
+                        'next_cursor': Schema(type=TYPE_STRING,
+                                              description='Position of the next page, only returned with the `cursor` '
+                                                          'parameter (null on the last page)'),
                         'students': Schema(type=TYPE_ARRAY,
                                            items=Schema(
                                                type=TYPE_OBJECT,
@@ -140,6 +141,8 @@ class StudentViewSet(GenericAPIView, TokenHandlerMixin):
                 'total': response['count'],
                 'students': response['results'],
             }
+            if 'next_cursor' in response:
+                data['next_cursor'] = response['next_cursor']
             return RF_Response(data)
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
@@ -150,7 +153,7 @@ class StudentViewSet(GenericAPIView, TokenHandlerMixin):
         except NotFound:
             data = {
                 'status': 'success',
-                'total': len(self.get_queryset()),
+                'total': self.paginator.get_count(self.get_queryset()),
                 'teachers': [],
             }
             return RF_Response(data)
@@ -316,6 +319,22 @@ class StudentViewSet(GenericAPIView, TokenHandlerMixin):
                     required=['status', 'code', ]
                 )
             ),
+            422: Response(
+                description='The body is not a list of IDs (code=`MalformedData`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(
+                            type=TYPE_STRING,
+                            example='error'),
+                        'code': Schema(
+                            type=TYPE_STRING,
+                            enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
         },
         tags=['Students'],
         request_body=Schema(
@@ -334,17 +353,152 @@ class StudentViewSet(GenericAPIView, TokenHandlerMixin):
                 return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
                                    status=status.HTTP_401_UNAUTHORIZED)
 
-            def delete_student(student_id: int):
-                student = Student.objects.get(id=student_id)
-                student.delete()
+            try:
+                deleted = delete_all_or_none(Student.objects.all(), request.data)
+            except ValueError:
+                return RF_Response({'status': 'error', 'code': 'MalformedData'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if not deleted:
+                return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
+            return RF_Response({'status': 'success'})
+        except Token.DoesNotExist:
+            return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
+                               status=status.HTTP_401_UNAUTHORIZED)
+        except AttributeError:
+            return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
+                               status=status.HTTP_401_UNAUTHORIZED)
 
-            for post_id in request.data:
-                try:
-                    delete_student(post_id)
-                except Student.DoesNotExist:
-                    return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
 
-            return RF_Response({'status': 'success'})
+class StudentImportViewSet(APIView, TokenHandlerMixin):
+    @swagger_auto_schema(
+        operation_summary='Creates many students at once, from a CSV file or a JSON array.',
+        operation_description='Note : only users with the role `administrator` should be able to access this route.\n'
+                              'The body is read as it is received, so thousands of students can be sent at once. A '
+                              'CSV body (`Content-Type: text/csv`) starts with a header line naming the columns. '
+                              'The `username` defaults to `first_name.last_name`. A password is generated for the '
+                              'students without a `password`, and the initial credentials of every created student '
+                              'are returned once.\n'
+                              'Rows whose username is already taken are skipped. The other invalid rows are returned '
+                              'with their index and the reason they failed. The students are written by chunks of '
+                              '500 rows, each committed on its own: the rows of a chunk which could not be written '
+                              'are all returned as failed (code=`Unknown`), and none of them is created. The groups '
+                              'of the affected subjects are re-organized once, at the end of the import.',
+        responses={
+            201: Response(
+                description='Students imported',
+                schema=Schema(
+                    title='StudentImportResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='success'),
+                        'created': Schema(
+                            type=TYPE_ARRAY,
+                            items=Schema(
+                                type=TYPE_OBJECT,
+                                properties={
+                                    'id': Schema(type=TYPE_INTEGER, example=166),
+                                    'username': Schema(type=TYPE_STRING, example='john.doe'),
+                                    'password': Schema(type=TYPE_STRING, example='aW3xK9pQ'),
+                                },
+                            ),
+                        ),
+                        'skipped': Schema(type=TYPE_ARRAY, items=Schema(type=TYPE_INTEGER, example=0)),
+                        'failed': Schema(
+                            type=TYPE_ARRAY,
+                            items=Schema(
+                                type=TYPE_OBJECT,
+                                properties={
+                                    'index': Schema(type=TYPE_INTEGER, example=0),
+                                    'code': Schema(type=TYPE_STRING, enum=error_codes),
+                                },
+                            ),
+                        ),
+                    },
+                    required=['status', 'created', 'skipped', 'failed', ]
+                )
+            ),
+            401: Response(
+                description='Invalid token (code=`InvalidCredentials`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+            403: Response(
+                description='Insufficient rights (code=`InsufficientAuthorization`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+            422: Response(
+                description='The body is not a CSV file nor a JSON array (code=`MalformedData`). The rows read before '
+                            'the error are imported, and returned as in a successful import.',
+                schema=Schema(
+                    title='StudentImportErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                        'created': Schema(type=TYPE_ARRAY, items=Schema(type=TYPE_OBJECT)),
+                        'skipped': Schema(type=TYPE_ARRAY, items=Schema(type=TYPE_INTEGER, example=0)),
+                        'failed': Schema(type=TYPE_ARRAY, items=Schema(type=TYPE_OBJECT)),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+        },
+        tags=['Students'],
+        request_body=Schema(
+            title='StudentImportRequest',
+            type=TYPE_ARRAY,
+            items=Schema(
+                type=TYPE_OBJECT,
+                properties={
+                    'first_name': Schema(type=TYPE_STRING, example='John'),
+                    'last_name': Schema(type=TYPE_STRING, example='Doe'),
+                    'class_id': Schema(type=TYPE_INTEGER, example=166),
+                    'username': Schema(type=TYPE_STRING, example='john.doe'),
+                    'email': Schema(type=TYPE_STRING, example='john.doe@etu.univ-amu.fr'),
+                    'password': Schema(type=TYPE_STRING, example='passwdtest'),
+                },
+                required=['first_name', 'last_name', 'class_id', ]
+            ),
+        ),
+    )
+    def post(self, request, *args, **kwargs):
+        try:
+            token = self._get_token(request)
+            if not token.user.is_staff:
+                return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
+                                   status=status.HTTP_403_FORBIDDEN)
+
+            stream = request.stream
+            if stream is None:
+                return RF_Response({'status': 'error', 'code': 'MalformedData'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if request.content_type.startswith('text/csv'):
+                rows = iter_csv_rows(stream)
+            else:
+                rows = iter_json_rows(stream)
+            try:
+                created, skipped, failed = import_students(rows)
+            except MalformedImport as e:
+                return RF_Response({'status': 'error', 'code': 'MalformedData', 'created': e.created,
+                                    'skipped': e.skipped, 'failed': e.failed},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            return RF_Response({'status': 'success', 'created': created, 'skipped': skipped, 'failed': failed},
+                               status=status.HTTP_201_CREATED)
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
                                status=status.HTTP_401_UNAUTHORIZED)
@@ -371,18 +525,23 @@ class StudentDetailViewSet(APIView, TokenHandlerMixin):
                                 'first_name': Schema(type=TYPE_STRING, example='John'),
                                 'last_name': Schema(type=TYPE_STRING, example='Doe'),
                                 'username': Schema(type=TYPE_STRING, example='road_buddy'),
-                                'total_hours': Schema(type=TYPE_INTEGER, example=166),
+                                'total_hours': Schema(type=TYPE_NUMBER, example=166.5),
+                                'hours': hours_schema,
                                 'subjects': Schema(
                                     type=TYPE_ARRAY,
                                     items=Schema(
                                         type=TYPE_OBJECT,
                                         properties={
                                             'name': Schema(type=TYPE_STRING, example='Anglais'),
-                                            'group': Schema(type=TYPE_STRING, example='Groupe 1'),
+                                            'group': Schema(type=TYPE_INTEGER, example=1),
+                                            'total_hours': Schema(type=TYPE_NUMBER, example=24),
+                                            'hours': hours_schema,
                                         },
                                         required=[
                                             'name',
                                             'group',
+                                            'total_hours',
+                                            'hours',
                                         ]
                                     )
                                 )
@@ -392,6 +551,7 @@ class StudentDetailViewSet(APIView, TokenHandlerMixin):
                                 'last_name',
                                 'username',
                                 'total_hours',
+                                'hours',
                                 'subjects',
                             ]
                         ),
@@ -447,30 +607,16 @@ class StudentDetailViewSet(APIView, TokenHandlerMixin):
             try:
                 student = Student.objects.get(id=student_id)
 
-                def get_subjects() -> list:
-                    subject_list = []
-                    student_subjects = StudentSubject.objects.filter(student=student)
-                    # TODO check this shit
-                    for s in student_subjects:
-                        subject_list.append(
-                            {
-                                'name': s.subject.name,
-                                'group': s.group_number,
-                            }
-                        )
-                    return subject_list
-
-                subjects = get_subjects()
-
-                def count_hours() -> int:
-                    total = 0
-                    return total
-
+                student_subjects = StudentSubject.objects.filter(student=student).select_related('subject') \
+                    .order_by('subject__name')
+                subjects = students_hours(student_subjects).get(student.id, [])
+                hours = student_total(subjects)
                 student = {
                     'first_name': student.first_name,
                     'last_name': student.last_name,
                     'username': student.username,
-                    'total_hours': count_hours(),
+                    'total_hours': total_hours(hours),
+                    'hours': hours,
                     'subjects': subjects,
                 }
                 return RF_Response({'status': 'success', 'student': student})
@@ -676,68 +822,15 @@ class StudentOccupancyDetailViewSet(APIView, TokenHandlerMixin):
     )
     def get(self, request, student_id):
         try:
-            token = self._get_token(request)
-            try:
-                Teacher.objects.get(id=token.user_id)
+            if self._get_principal(request).is_teacher:
                 return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
                                    status=status.HTTP_403_FORBIDDEN)
-            except Teacher.DoesNotExist:
-                try:
-                    student = Student.objects.get(id=student_id)
-
-                    def get_days() -> list:
-                        start_timestamp = request.query_params.get('start', None)
-                        end_timestamp = request.query_params.get('end', None)
-                        nb_per_day = int(request.query_params.get('occupancies_per_day', 0))
-                        days = []
-                        occ = Occupancy.objects.filter(
-                            subject__studentsubject__student=student,
-                            deleted=False
-                        ).order_by('start_datetime').annotate(day=Trunc('start_datetime', 'day'))
-                        if start_timestamp:
-                            occ = occ.filter(
-                                start_datetime__gte=datetime.fromtimestamp(
-                                    int(start_timestamp),
-                                    tz=timezone(settings.TIME_ZONE)
-                                )
-                            )
-                        if end_timestamp:
-                            occ = occ.filter(
-                                end_datetime__lte=datetime.fromtimestamp(
-                                    int(end_timestamp),
-                                    tz=timezone(settings.TIME_ZONE)
-                                )
-                            )
-                        for day in (occ[0].day + timedelta(n) for n in
-                                    range((occ[len(occ) - 1].day - occ[0].day).days + 2)):
-                            day_occupancies = occ.filter(start_datetime__day=day.day)
-                            if len(day_occupancies) == 0:
-                                continue
-                            if nb_per_day != 0:
-                                day_occupancies = day_occupancies[:nb_per_day]
-                            occ_list = []
-                            for o in day_occupancies:
-                                event = {
-                                    'id': o.id,
-                                    'group_name': f'Groupe {o.group_number}',
-                                    'subject_name': o.subject.name,
-                                    'teacher_name': f'{o.teacher.first_name} {o.teacher.last_name}',
-                                    'start': o.start_datetime.timestamp(),
-                                    'end': o.end_datetime.timestamp(),
-                                    'occupancy_type': o.occupancy_type,
-                                    'name': o.name,
-                                }
-                                if o.subject:
-                                    event['class_name'] = o.subject._class.name
-                                if o.classroom:
-                                    event['classroom_name'] = o.classroom.name
-                                occ_list.append(event)
-                            days.append({'date': day.strftime("%d-%m-%Y"), 'occupancies': occ_list})
-                        return days
-
-                    return RF_Response({'status': 'success', 'days': get_days()})
-                except Student.DoesNotExist:
-                    return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
+            try:
+                student = Student.objects.get(id=student_id)
+                days = get_days(request, student_filter(student.id), scope=('student', student.id))
+                return RF_Response({'status': 'success', 'days': days})
+            except Student.DoesNotExist:
+                return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
                                status=status.HTTP_401_UNAUTHORIZED)
@@ -1,12 +1,9 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 
-from django.conf import settings
-from django.db.models import Q
-from django.db.models.functions import Trunc
-from drf_yasg.openapi import Schema, Response, Parameter, TYPE_OBJECT, TYPE_ARRAY, TYPE_INTEGER, TYPE_STRING, \
-    TYPE_BOOLEAN, IN_QUERY
+from django.db.models import Count
+from drf_yasg.openapi import Schema, Response, Parameter, TYPE_OBJECT, TYPE_ARRAY, TYPE_INTEGER, TYPE_NUMBER, \
+    TYPE_STRING, TYPE_BOOLEAN, IN_QUERY
 from drf_yasg.utils import swagger_auto_schema
-from pytz import timezone
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import NotFound
@@ -14,14 +11,18 @@ from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response as RF_Response
 from rest_framework.views import APIView
 
+from scolendar.deletion import delete_all_or_none
 from scolendar.errors import error_codes
 from scolendar.exceptions import TeacherInChargeError
+from scolendar.hours import group_hours, subject_hours, subject_total_hours, total_hours
 from scolendar.models import Student, Teacher, occupancy_list, Classroom, Class, Subject, \
-    TeacherSubject, Occupancy
+    TeacherSubject, Occupancy, StudentSubject
 from scolendar.paginations import SubjectResultSetPagination
+from scolendar.search import search
 from scolendar.serializers import OccupancyCreationSerializer, SubjectSerializer, SubjectCreationSerializer
+from scolendar.timeline import get_days
 from scolendar.viewsets.auth_viewsets import TokenHandlerMixin
-from scolendar.viewsets.common.schemas import occupancies_schema
+from scolendar.viewsets.common.schemas import occupancies_schema, hours_schema
 
 
 class SubjectViewSet(GenericAPIView, TokenHandlerMixin):
@@ -34,10 +35,7 @@ class SubjectViewSet(GenericAPIView, TokenHandlerMixin):
         query = self.request.query_params.get('query', None)
         if query:
             if len(query) >= 3:
-                queryset = queryset.filter(
-                    Q(name__unaccent__icontains=query) |
-                    Q(_class__name__unaccent_lower__trigram_similar=query)
-                )
+                return search(queryset, query).order_by('-search_rank', '_class__name', 'name')
         return queryset.order_by('_class__name', 'name')
 
     @swagger_auto_schema(
@@ -55,9 +53,13 @@ class SubjectViewSet(GenericAPIView, TokenHandlerMixin):
                         'status': Schema(type=TYPE_STRING, example='success'),
                         'total': Schema(
                             type=TYPE_INTEGER,
-                            description='Total number of subjects',
+                            description='Total number of subjects (estimated with `count=estimate`, '
+                                        'null with `count=none`)',
                             example=166
                         ),
+                        'next_cursor': Schema(type=TYPE_STRING,
+                                              description='Position of the next page, only returned with the `cursor` '
+                                                          'parameter (null on the last page)'),
                         'subjects': Schema(
                             type=TYPE_ARRAY,
                             items=Schema(
@@ -124,6 +126,8 @@ class SubjectViewSet(GenericAPIView, TokenHandlerMixin):
                 'total': response['count'],
                 'subjects': response['results'],
             }
+            if 'next_cursor' in response:
+                data['next_cursor'] = response['next_cursor']
             return RF_Response(data)
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
@@ -134,7 +138,7 @@ class SubjectViewSet(GenericAPIView, TokenHandlerMixin):
         except NotFound:
             data = {
                 'status': 'success',
-                'total': len(self.get_queryset()),
+                'total': self.paginator.get_count(self.get_queryset()),
                 'teachers': [],
             }
             return RF_Response(data)
@@ -303,7 +307,8 @@ class SubjectViewSet(GenericAPIView, TokenHandlerMixin):
                 )
             ),
             422: Response(
-                description='Subject used in an occupancy (code=`SubjectUsed`)',
+                description='The body is not a list of IDs (code=`MalformedData`)\nSubject used in an occupancy '
+                            '(code=`SubjectUsed`)',
                 schema=Schema(
                     title='ErrorResponse',
                     type=TYPE_OBJECT,
@@ -336,15 +341,13 @@ class SubjectViewSet(GenericAPIView, TokenHandlerMixin):
                 return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
                                    status=status.HTTP_401_UNAUTHORIZED)
 
-            def delete_subject(student_id: int):
-                subject = Subject.objects.get(id=student_id)
-                subject.delete()
-
-            for post_id in request.data:
-                try:
-                    delete_subject(post_id)
-                except Subject.DoesNotExist:
-                    return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
+            try:
+                deleted = delete_all_or_none(Subject.objects.all(), request.data)
+            except ValueError:
+                return RF_Response({'status': 'error', 'code': 'MalformedData'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if not deleted:
+                return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
             return RF_Response({'status': 'success'})
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
@@ -371,7 +374,8 @@ class SubjectDetailViewSet(APIView, TokenHandlerMixin):
                             properties={
                                 'name': Schema(type=TYPE_STRING, example='PPPE'),
                                 'class_name': Schema(type=TYPE_STRING, example='L3 INFORMATIQUEE'),
-                                'total_hours': Schema(type=TYPE_INTEGER, example=166),
+                                'total_hours': Schema(type=TYPE_NUMBER, example=166.5),
+                                'hours': hours_schema,
                                 'teachers': Schema(
                                     type=TYPE_ARRAY,
                                     items=Schema(
@@ -386,19 +390,25 @@ class SubjectDetailViewSet(APIView, TokenHandlerMixin):
                                     )
                                 ),
                                 'groups': Schema(
-                                    type=TYPE_OBJECT,
-                                    properties={
-                                        'id': Schema(type=TYPE_INTEGER, example=166),
-                                        'name': Schema(type=TYPE_STRING, example='Groupe 1'),
-                                        'count': Schema(type=TYPE_INTEGER, example=166),
-                                    },
-                                    required=['id', 'name', 'count', ]
+                                    type=TYPE_ARRAY,
+                                    items=Schema(
+                                        type=TYPE_OBJECT,
+                                        properties={
+                                            'id': Schema(type=TYPE_INTEGER, example=1),
+                                            'name': Schema(type=TYPE_STRING, example='Groupe 1'),
+                                            'count': Schema(type=TYPE_INTEGER, example=166),
+                                            'total_hours': Schema(type=TYPE_NUMBER, example=42),
+                                            'hours': hours_schema,
+                                        },
+                                        required=['id', 'name', 'count', 'total_hours', 'hours', ]
+                                    )
                                 ),
                             },
                             required=[
                                 'name',
                                 'class_name',
                                 'total_hours',
+                                'hours',
                                 'teachers',
                                 'groups',
                             ]
@@ -453,7 +463,7 @@ class SubjectDetailViewSet(APIView, TokenHandlerMixin):
                 return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
                                    status=status.HTTP_403_FORBIDDEN)
             try:
-                subject = Student.objects.get(id=subject_id)
+                subject = Subject.objects.get(id=subject_id)
 
                 # TODO check this shit
                 def get_subject_teachers() -> list:
@@ -471,34 +481,36 @@ class SubjectDetailViewSet(APIView, TokenHandlerMixin):
                         )
                     return teachers
 
+                hours = subject_hours([subject.id])
+
                 def get_subject_groups() -> list:
                     groups = []
+                    counts = dict(StudentSubject.objects.filter(subject=subject).values_list('group_number')
+                                  .annotate(count=Count('id')).order_by())
                     for i in range(1, subject.group_count + 1):
+                        attended = group_hours(hours, subject.id, i)
                         groups.append(
                             {
+                                'id': i,
                                 'name': f'Groupe {i}',
-                                'count': 0,
-                                'is_student_group': i == subject.group_number
+                                'count': counts.get(i, 0),
+                                'total_hours': total_hours(attended),
+                                'hours': attended,
                             }
                         )
                     return groups
 
-                def count_hours() -> int:
-                    total = 0
-                    occupancies = Occupancy.objects.get(subject=subject)
-                    for occ in occupancies:
-                        total += occ.duration.seconds / 3600.
-                    return total
-
+                scheduled = subject_total_hours(hours, subject.id)
                 subject = {
                     'name': subject.name,
                     'class_name': subject._class.name,
-                    'total_hours': count_hours(),
+                    'total_hours': total_hours(scheduled),
+                    'hours': scheduled,
                     'teachers': get_subject_teachers(),
                     'groups': get_subject_groups()
                 }
                 return RF_Response({'status': 'success', 'subject': subject})
-            except Student.DoesNotExist:
+            except Subject.DoesNotExist:
                 return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
@@ -714,61 +726,9 @@ class SubjectOccupancyViewSet(APIView, TokenHandlerMixin):
                 return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
                                    status=status.HTTP_403_FORBIDDEN)
             try:
-                student = Subject.objects.get(id=subject_id)
-
-                def get_days() -> list:
-                    start_timestamp = request.query_params.get('start', None)
-                    end_timestamp = request.query_params.get('end', None)
-                    nb_per_day = int(request.query_params.get('occupancies_per_day', 0))
-
-                    days = []
-                    occ = Occupancy.objects.filter(
-                        subject__studentsubject__student=student,
-                        deleted=False
-                    ).order_by('start_datetime').annotate(day=Trunc('start_datetime', 'day'))
-                    if start_timestamp:
-                        occ = occ.filter(
-                            start_datetime__gte=datetime.fromtimestamp(
-                                int(start_timestamp),
-                                tz=timezone(settings.TIME_ZONE)
-                            )
-                        )
-                    if end_timestamp:
-                        occ = occ.filter(
-                            end_datetime__lte=datetime.fromtimestamp(
-                                int(end_timestamp),
-                                tz=timezone(settings.TIME_ZONE)
-                            )
-                        )
-                    for day in (occ[0].day + timedelta(n) for n in
-                                range((occ[len(occ) - 1].day - occ[0].day).days + 2)):
-                        day_occupancies = occ.filter(start_datetime__day=day.day)
-                        if len(day_occupancies) == 0:
-                            continue
-                        if nb_per_day != 0:
-                            day_occupancies = day_occupancies[:nb_per_day]
-                        occ_list = []
-                        for o in day_occupancies:
-                            event = {
-                                'id': o.id,
-                                'group_name': f'Groupe {o.group_number}',
-                                'subject_name': o.subject.name,
-                                'teacher_name': f'{o.teacher.first_name} {o.teacher.last_name}',
-                                'start': o.start_datetime.timestamp(),
-                                'end': o.end_datetime.timestamp(),
-                                'occupancy_type': o.occupancy_type,
-                                'name': o.name,
-                            }
-                            if o.subject:
-                                event['class_name'] = o.subject._class.name
-                            if o.classroom:
-                                event['classroom_name'] = o.classroom.name
-                            occ_list.append(event)
-                        days.append({'date': day.strftime("%d-%m-%Y"), 'occupancies': occ_list})
-                    return days
-
-                return RF_Response({'status': 'success', 'days': get_days()})
-            except Student.DoesNotExist:
+                subject = Subject.objects.get(id=subject_id)
+                return RF_Response({'status': 'success', 'days': get_days(request, subject=subject)})
+            except Subject.DoesNotExist:
                 return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
@@ -1322,60 +1282,9 @@ class SubjectGroupOccupancyViewSet(APIView, TokenHandlerMixin):
                                    status=status.HTTP_403_FORBIDDEN)
             try:
                 subject = Subject.objects.get(id=subject_id)
-
-                def get_days() -> list:
-                    start_timestamp = request.query_params.get('start', None)
-                    end_timestamp = request.query_params.get('end', None)
-                    nb_per_day = int(request.query_params.get('occupancies_per_day', 0))
-                    days = []
-                    occ = Occupancy.objects.filter(
-                        subject=subject,
-                        group_number=group_number,
-                        deleted=False,
-                    ).order_by('start_datetime').annotate(day=Trunc('start_datetime', 'day'))
-                    if start_timestamp:
-                        occ = occ.filter(
-                            start_datetime__gte=datetime.fromtimestamp(
-                                int(start_timestamp),
-                                tz=timezone(settings.TIME_ZONE)
-                            )
-                        )
-                    if end_timestamp:
-                        occ = occ.filter(
-                            end_datetime__lte=datetime.fromtimestamp(
-                                int(end_timestamp),
-                                tz=timezone(settings.TIME_ZONE)
-                            )
-                        )
-                    for day in (occ[0].day + timedelta(n) for n in
-                                range((occ[len(occ) - 1].day - occ[0].day).days + 2)):
-                        day_occupancies = occ.filter(start_datetime__day=day.day)
-                        if len(day_occupancies) == 0:
-                            continue
-                        if nb_per_day != 0:
-                            day_occupancies = day_occupancies[:nb_per_day]
-                        occ_list = []
-                        for o in day_occupancies:
-                            event = {
-                                'id': o.id,
-                                'group_name': f'Groupe {o.group_number}',
-                                'subject_name': o.subject.name,
-                                'teacher_name': f'{o.teacher.first_name} {o.teacher.last_name}',
-                                'start': o.start_datetime.timestamp(),
-                                'end': o.end_datetime.timestamp(),
-                                'occupancy_type': o.occupancy_type,
-                                'name': o.name,
-                            }
-                            if o.subject:
-                                event['class_name'] = o.subject._class.name
-                            if o.classroom:
-                                event['classroom_name'] = o.classroom.name
-                            occ_list.append(event)
-                        days.append({'date': day.strftime("%d-%m-%Y"), 'occupancies': occ_list})
-                    return days
-
-                return RF_Response({'status': 'success', 'days': get_days()})
-            except Class.DoesNotExist:
+                days = get_days(request, subject=subject, group_number=group_number)
+                return RF_Response({'status': 'success', 'days': days})
+            except Subject.DoesNotExist:
                 return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
@@ -1474,10 +1383,7 @@ class SubjectGroupOccupancyViewSet(APIView, TokenHandlerMixin):
     def post(self, request, subject_id, group_number):
         # TODO check this shit
         try:
-            token = self._get_token(request)
-            try:
-                Teacher.objects.get(id=token.user.id)
-            except Teacher.DoesNotExist:
+            if not self._get_principal(request).is_teacher:
                 return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
                                    status=status.HTTP_403_FORBIDDEN)
             try:
@@ -1,14 +1,9 @@
-from datetime import datetime, timedelta
-
-from django.conf import settings
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
-from django.db.models import Q
-from django.db.models.functions import Trunc
-from drf_yasg.openapi import Schema, Response, Parameter, TYPE_OBJECT, TYPE_ARRAY, TYPE_INTEGER, TYPE_STRING, IN_QUERY
+from drf_yasg.openapi import Schema, Response, Parameter, TYPE_OBJECT, TYPE_ARRAY, TYPE_INTEGER, TYPE_NUMBER, \
+    TYPE_STRING, IN_QUERY
 from drf_yasg.utils import swagger_auto_schema
-from pytz import timezone
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import NotFound
@@ -16,24 +11,18 @@ from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response as RF_Response
 from rest_framework.views import APIView
 
-from conf.conf import get_service_coefficients
+from scolendar.deletion import delete_all_or_none
 from scolendar.errors import error_codes
 from scolendar.groups import group_size
-from scolendar.models import Teacher, ranks, Occupancy, TeacherSubject
+from scolendar.models import Teacher, ranks, TeacherSubject
 from scolendar.paginations import TeacherResultSetPagination
+from scolendar.search import search
+from scolendar.services import service_report, teacher_service
 from scolendar.serializers import TeacherCreationSerializer, TeacherSerializer
 from scolendar.validators import phone_number_validator
+from scolendar.timeline import get_days
 from scolendar.viewsets.auth_viewsets import TokenHandlerMixin
-from scolendar.viewsets.common.schemas import teacher_list_schema, occupancies_schema
-
-occupancy_types = {
-    'CM': 'cm',
-    'TD': 'td',
-    'TP': 'tp',
-    'PROJ': 'projet',
-    'ADM': 'administration',
-    'EXT': 'external',
-}
+from scolendar.viewsets.common.schemas import teacher_list_schema, occupancies_schema, services_schema
 
 
 class TeacherViewSet(GenericAPIView, TokenHandlerMixin):
@@ -46,12 +35,7 @@ class TeacherViewSet(GenericAPIView, TokenHandlerMixin):
         query = self.request.query_params.get('query', None)
         if query:
             if len(query) >= 3:
-                queryset = queryset.filter(
-                    Q(first_name__unaccent__icontains=query) |
-                    Q(last_name__unaccent__icontains=query) |
-                    Q(_class__name__unaccent__icontains=query) |
-                    Q(phone_number__unaccent__icontains=query)
-                )
+                return search(queryset, query).order_by('-search_rank', 'last_name', 'first_name')
         return queryset.order_by('last_name', 'first_name')
 
     @swagger_auto_schema(
@@ -70,8 +54,12 @@ class TeacherViewSet(GenericAPIView, TokenHandlerMixin):
                         'status': Schema(type=TYPE_STRING,
                                          example='success'),
                         'total': Schema(type=TYPE_INTEGER,
-                                        description='Total number of students',
+                                        description='Total number of students (estimated with `count=estimate`, '
+                                                    'null with `count=none`)',
                                         example=166),
+                        'next_cursor': Schema(type=TYPE_STRING,
+                                              description='Position of the next page, only returned with the `cursor` '
+                                                          'parameter (null on the last page)'),
                         'teachers': Schema(type=TYPE_ARRAY,
                                            items=Schema(
                                                type=TYPE_OBJECT,
@@ -156,6 +144,8 @@ class TeacherViewSet(GenericAPIView, TokenHandlerMixin):
                 'total': response['count'],
                 'teachers': response['results'],
             }
+            if 'next_cursor' in response:
+                data['next_cursor'] = response['next_cursor']
             return RF_Response(data)
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
@@ -166,7 +156,7 @@ class TeacherViewSet(GenericAPIView, TokenHandlerMixin):
         except NotFound:
             data = {
                 'status': 'success',
-                'total': len(self.get_queryset()),
+                'total': self.paginator.get_count(self.get_queryset()),
                 'teachers': [],
             }
             return RF_Response(data)
@@ -335,7 +325,8 @@ class TeacherViewSet(GenericAPIView, TokenHandlerMixin):
                 )
             ),
             422: Response(
-                description='The teacher is still in charge of a subject (code=`TeacherInCharge`).',
+                description='The body is not a list of IDs (code=`MalformedData`)\nThe teacher is still in charge '
+                            'of a subject (code=`TeacherInCharge`).',
                 schema=Schema(
                     title='ErrorResponse',
                     type=TYPE_OBJECT,
@@ -368,16 +359,13 @@ class TeacherViewSet(GenericAPIView, TokenHandlerMixin):
                 return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
                                    status=status.HTTP_401_UNAUTHORIZED)
 
-            def delete_teacher(student_id: int):
-                student = Teacher.objects.get(id=student_id)
-                student.delete()
-
-            for post_id in request.data:
-                try:
-                    delete_teacher(post_id)
-                except Teacher.DoesNotExist:
-                    return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
-
+            try:
+                deleted = delete_all_or_none(Teacher.objects.all(), request.data)
+            except ValueError:
+                return RF_Response({'status': 'error', 'code': 'MalformedData'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if not deleted:
+                return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
             return RF_Response({'status': 'success'})
         except Token.DoesNotExist:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
@@ -409,31 +397,8 @@ class TeacherDetailViewSet(APIView, TokenHandlerMixin):
                                 'email': Schema(type=TYPE_STRING, example='email@example.com'),
                                 'phone_number': Schema(type=TYPE_STRING, example='06 61 66 16 61'),
                                 'rank': Schema(type=TYPE_STRING, enum=ranks),
-                                'total_services': Schema(type=TYPE_INTEGER, example=166),
-                                'services': Schema(
-                                    type=TYPE_ARRAY,
-                                    items=Schema(
-                                        type=TYPE_OBJECT,
-                                        properties={
-                                            'class': Schema(type=TYPE_STRING, example='L3 INFORMATIQUE'),
-                                            'cm': Schema(type=TYPE_INTEGER, example=166),
-                                            'projet': Schema(type=TYPE_INTEGER, example=166),
-                                            'td': Schema(type=TYPE_INTEGER, example=166),
-                                            'tp': Schema(type=TYPE_INTEGER, example=166),
-                                            'administration': Schema(type=TYPE_INTEGER, example=166),
-                                            'external': Schema(type=TYPE_INTEGER, example=166),
-                                        },
-                                        required=[
-                                            'class',
-                                            'cm',
-                                            'projet',
-                                            'td',
-                                            'tp',
-                                            'administration',
-                                            'external',
-                                        ]
-                                    )
-                                )
+                                'total_services': Schema(type=TYPE_NUMBER, example=166.75),
+                                'services': services_schema,
                             },
                             required=[
                                 'first_name',
@@ -497,58 +462,15 @@ class TeacherDetailViewSet(APIView, TokenHandlerMixin):
                                    status=status.HTTP_403_FORBIDDEN)
             try:
                 teacher = Teacher.objects.get(id=teacher_id)
-
-                def get_services() -> list:
-                    services = []
-                    # TODO check this shit
-                    teacher_subjects = TeacherSubject.objects.filter(teacher=teacher)
-                    for ts in teacher_subjects:
-                        service_entry = {'class': teacher_subjects.subject._class.name}
-                        for s_type in service_list:
-                            try:
-                                occupancies = Occupancy.objects.get(teacher=teacher, occupancy_type=s_type,
-                                                                    subject=ts.subject)
-                            except Occupancy.DoesNotExist:
-                                service_entry[occupancy_types[s_type]] = 0
-                                continue
-                            total = 0
-                            for occ in occupancies:
-                                total += occ.duration / 3600.
-                            service_entry[occupancy_types[s_type]] = total
-                    return services
-
-                service_list = get_services()
-
-                def count_service_value() -> int:
-                    coefficients = get_service_coefficients()
-                    total = 0
-                    for entry in service_list:
-                        for k, v in coefficients:
-                            total += entry[occupancy_types[k]] * float(v)
-                    return total
-
-                try:
-                    teacher = {
-                        'first_name': teacher.first_name,
-                        'last_name': teacher.last_name,
-                        'username': teacher.username,
-                        'email': teacher.email,
-                        'phone_number': teacher.phone_number,
-                        'rank': teacher.rank,
-                        'total_services': count_service_value(),
-                        'services': service_list,
-                    }
-                except TeacherSubject.DoesNotExist:
-                    teacher = {
-                        'first_name': teacher.first_name,
-                        'last_name': teacher.last_name,
-                        'username': teacher.username,
-                        'email': teacher.email,
-                        'phone_number': teacher.phone_number,
-                        'rank': teacher.rank,
-                        'total_services': 0,
-                        'services': [],
-                    }
+                teacher = {
+                    'first_name': teacher.first_name,
+                    'last_name': teacher.last_name,
+                    'username': teacher.username,
+                    'email': teacher.email,
+                    'phone_number': teacher.phone_number,
+                    'rank': teacher.rank,
+                    **teacher_service(teacher.id),
+                }
                 return RF_Response({'status': 'success', 'teacher': teacher})
             except Teacher.DoesNotExist:
                 return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
@@ -757,59 +679,7 @@ class TeacherOccupancyDetailViewSet(APIView, TokenHandlerMixin):
                                    status=status.HTTP_403_FORBIDDEN)
             try:
                 teacher = Teacher.objects.get(id=teacher_id)
-
-                def get_days() -> list:
-                    start_timestamp = request.query_params.get('start', None)
-                    end_timestamp = request.query_params.get('end', None)
-                    nb_per_day = int(request.query_params.get('occupancies_per_day', 0))
-
-                    days = []
-                    occ = Occupancy.objects.filter(
-                        teacher=teacher,
-                        deleted=False
-                    ).order_by('start_datetime').annotate(day=Trunc('start_datetime', 'day'))
-                    if start_timestamp:
-                        occ = occ.filter(
-                            start_datetime__gte=datetime.fromtimestamp(
-                                int(start_timestamp),
-                                tz=timezone(settings.TIME_ZONE)
-                            )
-                        )
-                    if end_timestamp:
-                        occ = occ.filter(
-                            end_datetime__lte=datetime.fromtimestamp(
-                                int(end_timestamp),
-                                tz=timezone(settings.TIME_ZONE)
-                            )
-                        )
-                    for day in (occ[0].day + timedelta(n) for n in
-                                range((occ[len(occ) - 1].day - occ[0].day).days + 2)):
-                        day_occupancies = occ.filter(start_datetime__day=day.day)
-                        if len(day_occupancies) == 0:
-                            continue
-                        if nb_per_day != 0:
-                            day_occupancies = day_occupancies[:nb_per_day]
-                        occ_list = []
-                        for o in day_occupancies:
-                            event = {
-                                'id': o.id,
-                                'group_name': f'Groupe {o.group_number}',
-                                'subject_name': o.subject.name,
-                                'teacher_name': f'{o.teacher.first_name} {o.teacher.last_name}',
-                                'start': o.start_datetime.timestamp(),
-                                'end': o.end_datetime.timestamp(),
-                                'occupancy_type': o.occupancy_type,
-                                'name': o.name,
-                            }
-                            if o.subject:
-                                event['class_name'] = o.subject._class.name
-                            if o.classroom:
-                                event['classroom_name'] = o.classroom.name
-                            occ_list.append(event)
-                        days.append({'date': day.strftime("%d-%m-%Y"), 'occupancies': occ_list})
-                    return days
-
-                return RF_Response({'status': 'success', 'days': get_days()})
+                return RF_Response({'status': 'success', 'days': get_days(request, teacher=teacher)})
             except Teacher.DoesNotExist:
                 return RF_Response({'status': 'error', 'code': 'InvalidID'}, status=status.HTTP_404_NOT_FOUND)
         except Token.DoesNotExist:
@@ -966,3 +836,78 @@ class TeacherSubjectDetailViewSet(APIView, TokenHandlerMixin):
         except AttributeError:
             return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
                                status=status.HTTP_401_UNAUTHORIZED)
+
+
+class TeacherServiceReportViewSet(APIView, TokenHandlerMixin):
+    @swagger_auto_schema(
+        operation_summary='Gets the services of all teachers.',
+        operation_description='Note : only users with the role `administrator` should be able to access this route.\n'
+                              'The teachers are sorted by name. The hours are summed per class and occupancy type, '
+                              'the `total_services` is weighted by the service coefficients.',
+        responses={
+            200: Response(
+                description='Service report',
+                schema=Schema(
+                    title='TeacherServiceReportResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='success'),
+                        'teachers': Schema(
+                            type=TYPE_ARRAY,
+                            items=Schema(
+                                type=TYPE_OBJECT,
+                                properties={
+                                    'id': Schema(type=TYPE_INTEGER, example=166),
+                                    'first_name': Schema(type=TYPE_STRING, example='John'),
+                                    'last_name': Schema(type=TYPE_STRING, example='Doe'),
+                                    'rank': Schema(type=TYPE_STRING, enum=ranks),
+                                    'total_services': Schema(type=TYPE_NUMBER, example=166.75),
+                                    'services': services_schema,
+                                },
+                                required=['id', 'first_name', 'last_name', 'rank', 'total_services', 'services', ]
+                            )
+                        ),
+                    },
+                    required=['status', 'teachers', ]
+                )
+            ),
+            401: Response(
+                description='Invalid token (code=`InvalidCredentials`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+            403: Response(
+                description='Insufficient rights (code=`InsufficientAuthorization`)',
+                schema=Schema(
+                    title='ErrorResponse',
+                    type=TYPE_OBJECT,
+                    properties={
+                        'status': Schema(type=TYPE_STRING, example='error'),
+                        'code': Schema(type=TYPE_STRING, enum=error_codes),
+                    },
+                    required=['status', 'code', ]
+                )
+            ),
+        },
+        tags=['Teachers', ]
+    )
+    def get(self, request):
+        try:
+            token = self._get_token(request)
+            if not token.user.is_staff:
+                return RF_Response({'status': 'error', 'code': 'InsufficientAuthorization'},
+                                   status=status.HTTP_403_FORBIDDEN)
+            return RF_Response({'status': 'success', 'teachers': service_report()})
+        except Token.DoesNotExist:
+            return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
+                               status=status.HTTP_401_UNAUTHORIZED)
+        except AttributeError:
+            return RF_Response({'status': 'error', 'code': 'InvalidCredentials'},
+                               status=status.HTTP_401_UNAUTHORIZED)